@@ -0,0 +1,309 @@
+# batch recommendation functions
+import os
+import numpy as np
+import pandas as pd
+from modules import wine_search_functions as wsf
+from modules import user_store_functions as usf
+from modules import wine_recommendation_functions as wrf
+from modules import user_profile_view_functions as upv
+
+# wine types recommended per user distribution (as recommend_wines)
+distribution_wine_types = {"equal": ["red", "white"],
+                           "more_red": ["red"],
+                           "more_white": ["white"]}
+
+# batch recommendations filename (inside data folder)
+recommendations_file = "recommendations.parquet"
+
+# batch taste profile recommendations filename (inside data folder)
+profile_recommendations_file = "profile_recommendations.parquet"
+
+
+def favorite_zones(zones):
+    """
+    Function that determines every user's favourite zone at once (as determine_favorite_zone:
+    zone with most wines, first one in zone order if tied).
+
+    Parameters:
+        zones (dataframe): user_key, position, zone and qty per user zone.
+
+    Returns:
+        favorites (dataframe): user_key and favourite zone of users with at least one wine.
+    """
+    zones = zones[zones["qty"] > 0]
+    zones = zones.sort_values(["user_key", "qty", "position"], ascending=[True, False, True], kind="stable")
+    return zones.drop_duplicates("user_key")[["user_key", "zone"]].reset_index(drop=True)
+
+
+def select_reference_wines(rng, wines, favorites):
+    """
+    Function that randomly selects every user's reference wine from their favourite zone at once
+    (as select_wine_from_favorite_zone).
+
+    Parameters:
+        rng (np.random.Generator): random generator.
+        wines (dataframe): user_key, zone and catalogue row per user wine, ordered by user key.
+        favorites (dataframe): user_key and favourite zone per user.
+
+    Returns:
+        references (dataframe): user_key, favourite zone and reference catalogue row per user.
+    """
+    candidates = wines.merge(favorites.astype({"zone": wines["zone"].dtype}), on=["user_key", "zone"])
+    candidates = candidates.sort_values("user_key", kind="stable")
+    user_keys, starts, counts = np.unique(candidates["user_key"].to_numpy(), return_index=True, return_counts=True)
+
+    picks = starts + (rng.random(len(starts)) * counts).astype(np.int64)
+    return pd.DataFrame({"user_key": user_keys,
+                         "favorite_zone": candidates["zone"].to_numpy()[picks],
+                         "selected": candidates["row"].to_numpy()[picks]})
+
+
+def top_k_not_owned(engine, queries, query_users, wines, k=1, distance="euclidean", block_size=4096):
+    """
+    Function that finds the k nearest catalogue wines of every query vector that its user does not own.
+    Queries are answered as blocked matrix queries, so memory is bounded by block_size x catalogue size.
+
+    Parameters:
+        engine (dict): catalogue search engine.
+        queries (np.array): query vectors, one per row.
+        query_users (np.array): user_key of each query (one query per user).
+        wines (dataframe): user_key and catalogue row per user wine (owned wines).
+        k (int): number of wines per query.
+        distance (str): distance to use. Euclidean, manhattan or cosine.
+        block_size (int): number of queries per block.
+
+    Returns:
+        nearest (np.array): n_queries x k catalogue indexes of the recommended wines, nearest first.
+        nearest_dist (np.array): corresponding distances.
+    """
+    labels = engine["labels"]
+
+    # owned wines of each query user, as (query number, catalogue position) pairs
+    query_of_user = pd.Series(np.arange(len(query_users)), index=query_users)
+    owned = wines[wines["user_key"].isin(query_of_user.index)]
+    owned_query = query_of_user.loc[owned["user_key"].to_numpy()].to_numpy()
+    owned_pos = labels.get_indexer(owned["row"].to_numpy())
+    order = np.argsort(owned_query, kind="stable")
+    owned_query, owned_pos = owned_query[order], owned_pos[order]
+
+    k = min(k, len(labels))
+    nearest_pos = np.empty((len(queries), k), dtype=np.int64)
+    nearest_dist = np.empty((len(queries), k))
+    for start in range(0, len(queries), block_size):
+        end = min(start + block_size, len(queries))
+        dist = wsf.compute_distances(engine, queries[start:end], distance)
+
+        # owned wines can not be recommended
+        lo, hi = np.searchsorted(owned_query, [start, end])
+        dist[owned_query[lo:hi] - start, owned_pos[lo:hi]] = np.inf
+
+        nearest_pos[start:end], nearest_dist[start:end] = wsf.select_top_k(dist, k)
+
+    return labels.to_numpy()[nearest_pos], nearest_dist
+
+
+def nearest_not_owned(engine, references, wines, distance="euclidean", block_size=4096):
+    """
+    Function that finds every reference wine nearest catalogue wine that its user does not own.
+
+    Parameters:
+        engine (dict): catalogue search engine.
+        references (dataframe): user_key and reference catalogue row per user (an owned wine).
+        wines (dataframe): user_key and catalogue row per user wine (owned wines).
+        distance (str): distance to use. Euclidean, manhattan or cosine.
+        block_size (int): number of queries per block.
+
+    Returns:
+        nearest (np.array): catalogue index of each recommended wine.
+        nearest_dist (np.array): corresponding distances.
+    """
+    queries = engine["matrix"][engine["labels"].get_indexer(references["selected"].to_numpy())]
+    nearest, nearest_dist = top_k_not_owned(engine, queries, references["user_key"].to_numpy(), wines,
+                                            1, distance, block_size)
+    return nearest[:, 0], nearest_dist[:, 0]
+
+
+def recommend_all_users(conn, distance="euclidean", seed=None, block_size=4096):
+    """
+    Function that recommends a wine to every user of the user store in one pass per wine type.
+    Users and catalogues are loaded once, favourite zones and reference wines are computed with
+    array operations and all nearest wine searches run as a single (blocked) matrix query.
+
+    Parameters:
+        conn (sqlite3.Connection): user store connection.
+        distance (str): distance to use. Euclidean, manhattan or cosine.
+        seed (int): random generator seed of reference wines selection. Random run if None.
+        block_size (int): number of queries per block.
+
+    Returns:
+        recommendations (dataframe): one row per user and recommended wine type with user, user_key,
+        distribution, wine_type, favorite_zone, selected and nearest catalogue indexes and distance.
+    """
+    rng = np.random.default_rng(seed)
+    users = usf.get_users_table(conn)[["user_key", "user", "distribution"]]
+
+    recommendations = []
+    for wine_type in ["red", "white"]:
+        # users that get a recommendation of this wine type
+        type_distributions = [d for d, wine_types in distribution_wine_types.items() if wine_type in wine_types]
+        type_users = users[users["distribution"].isin(type_distributions)]
+
+        zones = usf.get_user_zones_table(conn, wine_type)
+        wines = usf.get_user_wines_table(conn, wine_type)
+        favorites = favorite_zones(zones[zones["user_key"].isin(type_users["user_key"])])
+        references = select_reference_wines(rng, wines, favorites)
+        if len(references) == 0:
+            continue
+
+        engine = wrf.get_search_engine(wine_type)
+        nearest, nearest_dist = nearest_not_owned(engine, references, wines, distance, block_size)
+
+        references["wine_type"] = wine_type
+        references["nearest"] = nearest
+        references["distance"] = nearest_dist
+        recommendations.append(type_users.merge(references, on="user_key"))
+
+    if len(recommendations) == 0:
+        # empty store or no user with wines of the wine types recommended to them
+        recommendations.append(users.iloc[:0].assign(favorite_zone=pd.Series(dtype=str),
+                                                     selected=pd.Series(dtype=np.int32),
+                                                     wine_type=pd.Series(dtype=str),
+                                                     nearest=pd.Series(dtype=np.int64),
+                                                     distance=pd.Series(dtype=np.float64)))
+    recommendations = pd.concat(recommendations, ignore_index=True)
+    recommendations["wine_type"] = recommendations["wine_type"].astype("category")
+    recommendations["favorite_zone"] = recommendations["favorite_zone"].astype("category")
+    return recommendations.sort_values(["user_key", "wine_type"], ignore_index=True)
+
+
+def profile_vectors(engine, wines, weighting="mean", profiles=None):
+    """
+    Function that computes every user's taste vector at once (as user_profile_vector).
+    With mean weighting, vectors of users whose materialized profile is still valid (same wines as
+    when it was built) are read from it, and only the other users' vectors are computed.
+
+    Parameters:
+        engine (dict): catalogue search engine.
+        wines (dataframe): user_key, zone and catalogue row per user wine, ordered by user key.
+        weighting (str): "mean" (every wine alike) or "zone" (wines weighted by their zone quantity).
+        profiles (dataframe): materialized profiles of this wine type (see user_profile_view_functions).
+            All vectors are computed if None.
+
+    Returns:
+        user_keys (np.array): user key of each vector.
+        vectors (np.array): taste vector of each user in scaled feature space.
+    """
+    user_keys, starts, counts = np.unique(wines["user_key"].to_numpy(), return_index=True, return_counts=True)
+    if profiles is None or weighting != "mean":
+        return user_keys, compute_profile_vectors(engine, wines, starts, weighting)
+
+    # valid materialized profiles (same rows signature)
+    rows = wines["row"].to_numpy()
+    signatures = np.add.reduceat(upv.mix_rows(rows), starts).view(np.int64)
+    view_pos = pd.Index(profiles["user_key"]).get_indexer(user_keys)
+    valid = view_pos >= 0
+    valid[valid] = profiles["rows_signature"].to_numpy()[view_pos[valid]] == signatures[valid]
+
+    vectors = np.empty((len(user_keys), engine["matrix"].shape[1]))
+    vectors[valid] = profiles[wsf.scaled_cols].to_numpy(dtype=np.float64)[view_pos[valid]]
+    if not valid.all():
+        stale_wines = wines[np.repeat(~valid, counts)]
+        stale_starts = np.concatenate([[0], np.cumsum(counts[~valid])[:-1]])
+        vectors[~valid] = compute_profile_vectors(engine, stale_wines, stale_starts, weighting)
+    return user_keys, vectors
+
+
+def compute_profile_vectors(engine, wines, starts, weighting="mean"):
+    """
+    Function that computes users' taste vectors from their wines.
+
+    Parameters:
+        engine (dict): catalogue search engine.
+        wines (dataframe): user_key, zone and catalogue row per user wine, ordered by user key.
+        starts (np.array): position of each user's first wine.
+        weighting (str): "mean" (every wine alike) or "zone" (wines weighted by their zone quantity).
+
+    Returns:
+        vectors (np.array): taste vector of each user in scaled feature space.
+    """
+    vectors = engine["matrix"][engine["labels"].get_indexer(wines["row"].to_numpy())]
+    if weighting == "zone":
+        weights = wines.groupby(["user_key", "zone"], observed=True)["row"].transform("size").to_numpy(np.float64)
+    else:
+        weights = np.ones(len(wines))
+    sums = np.add.reduceat(vectors * weights[:, None], starts, axis=0)
+    return sums / np.add.reduceat(weights, starts)[:, None]
+
+
+def recommend_all_users_by_profile(conn, k=5, distance="euclidean", weighting="mean", block_size=4096):
+    """
+    Function that recommends the k wines closest to every user's taste vector in one pass per wine type:
+    taste vectors are read from the materialized profiles while valid (mean weighting), the others are
+    computed with array operations, and all are ranked against the catalogue as a single
+    (blocked) matrix query.
+
+    Parameters:
+        conn (sqlite3.Connection): user store connection.
+        k (int): number of wines to recommend per user and wine type.
+        distance (str): distance to use. Euclidean, manhattan or cosine.
+        weighting (str): taste vector weighting, "mean" or "zone".
+        block_size (int): number of queries per block.
+
+    Returns:
+        recommendations (dataframe): one row per user, recommended wine type and rank with user, user_key,
+        distribution, wine_type, rank (0 is nearest), nearest catalogue index and distance.
+    """
+    users = usf.get_users_table(conn)[["user_key", "user", "distribution"]]
+    view = upv.get_user_profiles()
+
+    recommendations = []
+    for wine_type in ["red", "white"]:
+        # users that get a recommendation of this wine type
+        type_distributions = [d for d, wine_types in distribution_wine_types.items() if wine_type in wine_types]
+        type_users = users[users["distribution"].isin(type_distributions)]
+
+        wines = usf.get_user_wines_table(conn, wine_type)
+        wines = wines[wines["user_key"].isin(type_users["user_key"])]
+        if len(wines) == 0:
+            continue
+
+        engine = wrf.get_search_engine(wine_type)
+        profiles = None if view is None else view[view.index.get_level_values("wine_type") == wine_type]
+        user_keys, vectors = profile_vectors(engine, wines, weighting, profiles)
+        nearest, nearest_dist = top_k_not_owned(engine, vectors, user_keys, wines, k, distance, block_size)
+
+        ranked = pd.DataFrame({"user_key": np.repeat(user_keys, nearest.shape[1]),
+                               "wine_type": wine_type,
+                               "rank": np.tile(np.arange(nearest.shape[1], dtype=np.int16), len(user_keys)),
+                               "nearest": nearest.ravel(),
+                               "distance": nearest_dist.ravel()})
+        # fewer unseen wines than k
+        ranked = ranked[np.isfinite(ranked["distance"])]
+        recommendations.append(type_users.merge(ranked, on="user_key"))
+
+    if len(recommendations) == 0:
+        # empty store or no user with wines of the wine types recommended to them
+        recommendations.append(users.iloc[:0].assign(wine_type=pd.Series(dtype=str),
+                                                     rank=pd.Series(dtype=np.int16),
+                                                     nearest=pd.Series(dtype=np.int64),
+                                                     distance=pd.Series(dtype=np.float64)))
+    recommendations = pd.concat(recommendations, ignore_index=True)
+    recommendations["wine_type"] = recommendations["wine_type"].astype("category")
+    return recommendations.sort_values(["user_key", "wine_type", "rank"], ignore_index=True)
+
+
+def save_recommendations(path, recommendations, filename=None):
+    """
+    Function that saves batch recommendations as parquet.
+
+    Parameters:
+        path (str): path to data.
+        recommendations (dataframe): batch recommendations (see recommend_all_users).
+        filename (str): parquet filename. recommendations_file if None.
+
+    Returns:
+        str: saved file path.
+    """
+    file_path = os.path.join(path, filename or recommendations_file)
+    recommendations.to_parquet(file_path, engine="pyarrow", index=False)
+    return file_path
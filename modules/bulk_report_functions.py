@@ -0,0 +1,157 @@
+# bulk report functions
+import os
+import time
+import shutil
+import zipfile
+import tempfile
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from modules import wine_catalogue_functions as wcat
+from modules import wine_recommendation_functions as wrf
+from modules import recommendation_cache_functions as rcf
+from modules import user_store_functions as usf
+from modules import user_profile_functions as upf
+
+# users sent to a worker at once (bigger chunks, less inter-process traffic)
+reports_per_task = 8
+
+# progress is printed every progress_every reports
+progress_every = 100
+
+# worker process state (set once per worker by init_report_worker)
+worker_state = {}
+
+
+def init_report_worker(path, output_dir, distance, cache_dir):
+    """
+    Function that prepares a report worker process: catalogues, search indexes and user store
+    loaded once.
+
+    Parameters:
+        path (str): path to data.
+        output_dir (str): folder where reports are saved.
+        distance (str): distance to use. Euclidean, manhattan or cosine.
+        cache_dir (str): recommendation cache disk tier folder. Memory only if None.
+    """
+    wcat.set_data_root(path)
+    rcf.cache_dir = cache_dir
+    for wine_type in wcat.catalogue_files:
+        wcat.get_catalogue(wine_type, upf.profile_cols)
+        wrf.get_search_engine(wine_type)
+        wrf.get_knn_graph(wine_type)
+        rcf.catalogue_content_hash(wine_type)
+
+    worker_state.update(user_store=usf.connect_user_store(path),
+                        output_dir=output_dir,
+                        distance=distance)
+
+
+def render_user_report(user_id):
+    """
+    Function that creates the recommendation pdf of a user (worker process).
+
+    Parameters:
+        user_id (str): user id.
+
+    Returns:
+        user_id (str): user id.
+        output_file (str): created pdf path. None if the user does not exist.
+        seconds (float): time spent creating the report.
+    """
+    start = time.perf_counter()
+    user_data = usf.get_user(worker_state["user_store"], user_id)
+    if user_data is None:
+        return user_id, None, 0.0
+
+    distance = worker_state["distance"]
+    distribution, solution_red, solution_white = rcf.get_recommendation(user_data, distance)["recommendation"]
+    recommendation_text = wrf.create_recommendation_text(distribution, solution_red, solution_white)
+    user_red_cat, user_white_cat = upf.get_user_catalogues(user_data)
+    output_file = upf.create_recomendation_pdf(user_data, user_red_cat, user_white_cat, user_id,
+                                               solution_red, solution_white, recommendation_text,
+                                               pdf_path=worker_state["output_dir"],
+                                               report_key=rcf.recommendation_key(user_data, distance))
+    return user_id, output_file, time.perf_counter() - start
+
+
+def create_bulk_reports(path, user_ids=None, output_dir=None, archive_file=None,
+                        distance="euclidean", n_workers=None, cache_dir=None):
+    """
+    Function that creates the recommendation pdf of many users in a process pool.
+    Each worker loads catalogues and user store once and renders plots in memory, reusing its
+    radar figures between reports.
+    Reports are saved in output_dir or packed in a single zip archive.
+
+    Parameters:
+        path (str): path to data.
+        user_ids (list(str)): users to report. Every user of the user store if None.
+        output_dir (str): folder where reports are saved. "../report" (as create_recomendation_pdf) if None.
+            Ignored if archive_file is set.
+        archive_file (str): zip file where reports are packed. Reports are kept in output_dir if None.
+        distance (str): distance to use. Euclidean, manhattan or cosine.
+        n_workers (int): number of worker processes. Number of cores if None.
+        cache_dir (str): recommendation cache disk tier folder. Memory only if None.
+
+    Returns:
+        reports (dataframe): user, report (pdf path or archive member, None if the user does not
+        exist) and seconds spent per report.
+    """
+    if user_ids is None:
+        user_store = usf.connect_user_store(path)
+        user_ids = usf.list_users(user_store)
+        user_store.close()
+
+    tmp_root = None
+    if archive_file is not None:
+        # reports are staged and moved into the archive as they arrive
+        tmp_root = tempfile.mkdtemp(prefix="bulk_reports_")
+        output_dir = tmp_root
+    elif output_dir is None:
+        output_dir = "../report"
+    os.makedirs(output_dir, exist_ok=True)
+
+    # pdf images are already compressed, members are stored as they are
+    archive = zipfile.ZipFile(archive_file, "w", zipfile.ZIP_STORED) if archive_file is not None else None
+    results = []
+    start = time.perf_counter()
+    try:
+        with ProcessPoolExecutor(max_workers=n_workers or os.cpu_count(), initializer=init_report_worker,
+                                 initargs=(path, output_dir, distance, cache_dir)) as executor:
+            for user_id, output_file, seconds in executor.map(render_user_report, user_ids,
+                                                              chunksize=reports_per_task):
+                if output_file is not None and archive is not None:
+                    archive.write(output_file, os.path.basename(output_file))
+                    os.remove(output_file)
+                    output_file = os.path.basename(output_file)
+                results.append((user_id, output_file, seconds))
+
+                if len(results) % progress_every == 0 or len(results) == len(user_ids):
+                    elapsed = time.perf_counter() - start
+                    remaining = (len(user_ids) - len(results)) * elapsed / len(results)
+                    print(f"{len(results)}/{len(user_ids)} REPORTS IN {elapsed:.1f}s "
+                          f"({len(results) / elapsed:.1f} reports/s, {remaining:.0f}s left)")
+    finally:
+        if archive is not None:
+            archive.close()
+            shutil.rmtree(tmp_root, ignore_errors=True)
+
+    return pd.DataFrame(results, columns=["user", "report", "seconds"])
+
+
+def report_timing_summary(reports):
+    """
+    Function that summarizes per report timings of a bulk run.
+
+    Parameters:
+        reports (dataframe): bulk run results (see create_bulk_reports).
+
+    Returns:
+        str: number of reports, missing users and mean, median and 95th percentile seconds per report.
+    """
+    seconds = reports.loc[reports["report"].notna(), "seconds"].to_numpy()
+    if len(seconds) == 0:
+        return "NO REPORTS CREATED"
+    missing = int(reports["report"].isna().sum())
+    return (f"{len(seconds)} REPORTS ({missing} USERS NOT FOUND). SECONDS PER REPORT: "
+            f"MEAN {seconds.mean():.3f}, MEDIAN {np.median(seconds):.3f}, P95 {np.percentile(seconds, 95):.3f}")
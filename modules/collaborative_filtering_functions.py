@@ -0,0 +1,402 @@
+# collaborative filtering functions
+import os
+import time
+import resource
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from concurrent.futures import ProcessPoolExecutor
+from modules import wine_catalogue_functions as wcat
+from modules import user_store_functions as usf
+from modules import batch_recommendation_functions as brf
+from modules import user_wine_distribution_functions as uwdf
+
+# users per block of the user x user similarity product (memory is bounded by the block similarities)
+block_users = 512
+
+# similar users kept per user
+neighbours_per_user = 20
+
+# owners per wine users are compared with (approximate neighbourhoods: candidates grow with the number of
+# owners of each wine, so with millions of users only a random sample of each wine owners is compared).
+# All owners (exact neighbourhoods) if None
+sampled_owners_per_wine = None
+
+# random sample seed of wine owners
+sample_seed = 0
+
+# collaborative recommendations and neighbourhoods filenames (inside data folder)
+collaborative_recommendations_file = "collaborative_recommendations.parquet"
+user_neighbours_file = "user_neighbours.parquet"
+
+# worker process state (set once per worker by init_similarity_worker)
+worker_state = {}
+
+
+def build_user_wine_matrix(n_users, wines, labels):
+    """
+    Function that builds the sparse user x wine ownership matrix: one row per user, one column per
+    catalogue wine (red catalogue columns first, then white ones).
+
+    Parameters:
+        n_users (int): number of users (matrix rows).
+        wines (dict): wine type -> (user position, catalogue row) arrays, one element per user wine.
+        labels (dict): wine type -> catalogue index (pd.Index), which gives the column order.
+
+    Returns:
+        matrix (sparse.csr_matrix): n_users x n_wines float32 matrix, 1 where a user owns a wine.
+        columns (dict): wine type -> (first, last + 1) matrix columns of its catalogue.
+    """
+    columns = {}
+    user_pos, wine_pos = [], []
+    offset = 0
+    for wine_type, type_labels in labels.items():
+        columns[wine_type] = (offset, offset + len(type_labels))
+        if wine_type in wines:
+            users, rows = wines[wine_type]
+            positions = type_labels.get_indexer(rows)
+            known = positions >= 0 # wines no longer in the catalogue are ignored
+            user_pos.append(np.asarray(users)[known])
+            wine_pos.append(positions[known] + offset)
+        offset += len(type_labels)
+
+    user_pos = np.concatenate(user_pos) if user_pos else np.array([], dtype=np.int64)
+    wine_pos = np.concatenate(wine_pos) if wine_pos else np.array([], dtype=np.int64)
+    matrix = sparse.csr_matrix((np.ones(len(user_pos), dtype=np.float32), (user_pos, wine_pos)),
+                               shape=(n_users, offset))
+    matrix.sum_duplicates()
+    matrix.data[:] = 1.0 # a wine delivered twice is owned once
+    return matrix, columns
+
+
+def load_user_wine_matrix(conn):
+    """
+    Function that builds the user x wine ownership matrix of the user store.
+
+    Parameters:
+        conn (sqlite3.Connection): user store connection.
+
+    Returns:
+        users (dataframe): users table (matrix rows, ordered by user key).
+        matrix (sparse.csr_matrix): user x wine ownership matrix (see build_user_wine_matrix).
+        columns (dict): wine type -> (first, last + 1) matrix columns of its catalogue.
+    """
+    users = usf.get_users_table(conn)
+    user_keys = users["user_key"].to_numpy()
+
+    wines, labels = {}, {}
+    for wine_type in wcat.catalogue_files:
+        wine_users, rows = usf.get_user_wine_arrays(conn, wine_type)
+        wines[wine_type] = (np.searchsorted(user_keys, wine_users), rows)
+        labels[wine_type] = wcat.get_catalogue(wine_type, ["Cluster"]).index
+
+    matrix, columns = build_user_wine_matrix(len(users), wines, labels)
+    return users, matrix, columns
+
+
+def simulation_user_wine_matrix(simulation, labels):
+    """
+    Function that builds the user x wine ownership matrix of a columnar users simulation
+    (see user_wine_distribution_functions.simulate_users), without a user store.
+
+    Parameters:
+        simulation (dict): columnar users simulation.
+        labels (dict): wine type -> catalogue index (pd.Index), which gives the column order.
+
+    Returns:
+        matrix (sparse.csr_matrix): user x wine ownership matrix (see build_user_wine_matrix).
+        columns (dict): wine type -> (first, last + 1) matrix columns of its catalogue.
+    """
+    assignments = simulation["assignments"]
+    wines = {}
+    for wine_type in labels:
+        type_wines = assignments[assignments["wine_type"] == wine_type]
+        wines[wine_type] = (type_wines["user_idx"].to_numpy(), type_wines["row"].to_numpy())
+    return build_user_wine_matrix(len(simulation["users"]), wines, labels)
+
+
+def sparse_top_k(matrix, k):
+    """
+    Function that selects the k greatest stored values of each row of a sparse matrix. Rows are
+    padded to the longest row and partitioned, so no row is sorted beyond its k values.
+
+    Parameters:
+        matrix (sparse.csr_matrix): sparse matrix.
+        k (int): values kept per row.
+
+    Returns:
+        positions (np.array): n_rows x k int32 columns, greatest first. -1 where a row has fewer values.
+        values (np.array): n_rows x k float32 corresponding values (0 where missing).
+    """
+    n_rows = matrix.shape[0]
+    counts = np.diff(matrix.indptr)
+    width = max(int(counts.max(initial=0)), k)
+    rows = np.repeat(np.arange(n_rows), counts)
+
+    # rows side by side, missing values at -inf
+    padded = np.full((n_rows, width), -np.inf, dtype=np.float32)
+    padded[rows, np.arange(len(rows)) - matrix.indptr[rows]] = matrix.data
+    top = np.argpartition(-padded, k - 1, axis=1)[:, :k] if k < width else np.broadcast_to(np.arange(width), (n_rows, width))
+    values = np.take_along_axis(padded, top, axis=1)
+    order = np.argsort(-values, axis=1, kind="stable")
+    top, values = np.take_along_axis(top, order, axis=1), np.take_along_axis(values, order, axis=1)
+
+    found = np.isfinite(values)
+    positions = np.full((n_rows, k), -1, dtype=np.int32)
+    positions[found] = matrix.indices[(matrix.indptr[:-1, None] + top)[found]]
+    return positions, np.where(found, values, 0.0).astype(np.float32)
+
+
+def sample_row_entries(matrix, n, seed=0):
+    """
+    Function that keeps at most n random stored values per row of a sparse matrix.
+
+    Parameters:
+        matrix (sparse.csr_matrix): sparse matrix.
+        n (int): values kept per row.
+        seed (int): random generator seed.
+
+    Returns:
+        sparse.csr_matrix: sampled matrix.
+    """
+    rows = np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr))
+    order = np.argsort(rows + np.random.default_rng(seed).random(len(rows)))  # random order within each row
+    keep = order[np.arange(len(order)) - matrix.indptr[rows[order]] < n]
+    return sparse.csr_matrix((matrix.data[keep], (rows[keep], matrix.indices[keep])), shape=matrix.shape)
+
+
+def init_similarity_worker(matrix, columns, n_neighbours, k, block_size, sampled_owners):
+    """
+    Function that prepares a similarity worker process: ownership matrix, its row normalized
+    version (cosine similarity is a dot product of normalized rows) and the transposed wine x owner
+    matrix users are compared with kept once.
+
+    Parameters:
+        matrix (sparse.csr_matrix): user x wine ownership matrix.
+        columns (dict): wine type -> (first, last + 1) matrix columns of its catalogue.
+        n_neighbours (int): similar users kept per user.
+        k (int): wines recommended per user and wine type.
+        block_size (int): users per block.
+        sampled_owners (int): owners per wine users are compared with. All owners if None.
+    """
+    n_wines = np.diff(matrix.indptr).astype(np.float32)
+    with np.errstate(divide="ignore"):
+        scale = np.where(n_wines > 0, 1.0 / np.sqrt(n_wines), 0.0).astype(np.float32)
+    normalized = (sparse.diags(scale) @ matrix).tocsr()
+    owners = normalized.T.tocsr()
+    if sampled_owners is not None:
+        owners = sample_row_entries(owners, sampled_owners, sample_seed)
+
+    worker_state.update(matrix=matrix,
+                        normalized=normalized,
+                        owners=owners,
+                        columns=columns,
+                        n_neighbours=n_neighbours,
+                        k=k,
+                        block_size=block_size)
+
+
+def similarity_block(start):
+    """
+    Function that finds the nearest users and recommended wines of a block of users (worker process).
+    Block similarities are one sparse product, so only users sharing a wine are compared (with
+    sampled owners, similarities only add up the wines where the other user was sampled).
+
+    Parameters:
+        start (int): first user (matrix row) of the block.
+
+    Returns:
+        start (int): first user of the block.
+        neighbours (np.array): block users x n_neighbours most similar users (-1 if fewer).
+        similarities (np.array): corresponding cosine similarities.
+        recommendations (dict): wine type -> (wines, scores) block users x k catalogue positions not owned
+            by the user, scored by the similarity of the neighbours that own them (-1 if fewer).
+    """
+    matrix, normalized = worker_state["matrix"], worker_state["normalized"]
+    end = min(start + worker_state["block_size"], matrix.shape[0])
+
+    # cosine similarity with every (sampled) user sharing a wine, excluding the user itself
+    similarity = (normalized[start:end] @ worker_state["owners"]).tocsr()
+    rows = np.repeat(np.arange(end - start), np.diff(similarity.indptr))
+    similarity.data[similarity.indices == rows + start] = 0.0
+    similarity.eliminate_zeros()
+    neighbours, similarities = sparse_top_k(similarity, worker_state["n_neighbours"])
+
+    # wines of the neighbours weighted by similarity, owned wines removed
+    found = neighbours >= 0
+    weights = sparse.csr_matrix((similarities[found], (np.nonzero(found)[0], neighbours[found])),
+                                shape=(end - start, matrix.shape[0]))
+    scores = (weights @ matrix).tocsr()
+    scores = (scores - scores.multiply(matrix[start:end])).tocsr()
+    scores.eliminate_zeros()
+
+    recommendations = {}
+    for wine_type, (first, last) in worker_state["columns"].items():
+        wines, wine_scores = sparse_top_k(scores[:, first:last].tocsr(), worker_state["k"])
+        recommendations[wine_type] = (wines, wine_scores)
+    return start, neighbours, similarities, recommendations
+
+
+def compute_neighbourhoods(matrix, columns, n_neighbours=None, k=5, n_workers=None):
+    """
+    Function that finds every user's most similar users (cosine similarity of owned wines) and
+    recommends the wines they own. Users are processed in blocks of block_users, spread over a
+    process pool (in process if n_workers is 1).
+
+    Parameters:
+        matrix (sparse.csr_matrix): user x wine ownership matrix.
+        columns (dict): wine type -> (first, last + 1) matrix columns of its catalogue.
+        n_neighbours (int): similar users kept per user. neighbours_per_user if None.
+        k (int): wines recommended per user and wine type.
+        n_workers (int): number of worker processes. Number of cores if None.
+
+    Returns:
+        neighbours (np.array): n_users x n_neighbours most similar users (matrix rows, -1 if fewer).
+        similarities (np.array): corresponding cosine similarities.
+        recommendations (dict): wine type -> (wines, scores) n_users x k catalogue positions of the
+            recommended wines and their scores (-1 if fewer).
+    """
+    n_neighbours = n_neighbours or neighbours_per_user
+    n_users = matrix.shape[0]
+    neighbours = np.full((n_users, n_neighbours), -1, dtype=np.int32)
+    similarities = np.zeros((n_users, n_neighbours), dtype=np.float32)
+    recommendations = {wine_type: (np.full((n_users, k), -1, dtype=np.int32), np.zeros((n_users, k), dtype=np.float32))
+                       for wine_type in columns}
+
+    def collect(results):
+        for start, block_neighbours, block_similarities, block_recommendations in results:
+            end = start + len(block_neighbours)
+            neighbours[start:end], similarities[start:end] = block_neighbours, block_similarities
+            for wine_type, (wines, scores) in block_recommendations.items():
+                recommendations[wine_type][0][start:end] = wines
+                recommendations[wine_type][1][start:end] = scores
+
+    starts = range(0, n_users, block_users)
+    initargs = (matrix, columns, n_neighbours, k, block_users, sampled_owners_per_wine)
+    n_workers = n_workers or os.cpu_count()
+    if n_workers == 1:
+        init_similarity_worker(*initargs)
+        collect(map(similarity_block, starts))
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=init_similarity_worker,
+                                 initargs=initargs) as executor:
+            collect(executor.map(similarity_block, starts))
+
+    return neighbours, similarities, recommendations
+
+
+def recommend_all_users_collaborative(conn, k=5, n_neighbours=None, n_workers=None):
+    """
+    Function that recommends every user the wines owned by the users with the most similar cellars.
+
+    Parameters:
+        conn (sqlite3.Connection): user store connection.
+        k (int): number of wines to recommend per user and wine type.
+        n_neighbours (int): similar users considered per user. neighbours_per_user if None.
+        n_workers (int): number of worker processes. Number of cores if None.
+
+    Returns:
+        recommendations (dataframe): one row per user, recommended wine type (according to users
+        distribution) and rank with user, user_key, distribution, wine_type, rank (0 is best),
+        nearest catalogue index and score (sum of similarities of the neighbours owning it).
+        neighbours (dataframe): user_key, rank, neighbour user key and similarity.
+    """
+    users, matrix, columns = load_user_wine_matrix(conn)
+    neighbours, similarities, type_recommendations = compute_neighbourhoods(matrix, columns, n_neighbours,
+                                                                            k, n_workers)
+    user_keys = users["user_key"].to_numpy()
+
+    found = neighbours >= 0
+    user_pos, rank = np.nonzero(found)
+    neighbours = pd.DataFrame({"user_key": user_keys[user_pos],
+                               "rank": rank.astype(np.int16),
+                               "neighbour": user_keys[neighbours[found]],
+                               "similarity": similarities[found]})
+
+    recommendations = []
+    for wine_type, (wines, scores) in type_recommendations.items():
+        # users that get a recommendation of this wine type
+        type_distributions = [d for d, wine_types in brf.distribution_wine_types.items() if wine_type in wine_types]
+        type_users = users["distribution"].isin(type_distributions).to_numpy()
+
+        found = (wines >= 0) & type_users[:, None]
+        user_pos, rank = np.nonzero(found)
+        labels = wcat.get_catalogue(wine_type, ["Cluster"]).index.to_numpy()
+        recommendations.append(pd.DataFrame({"user_key": user_keys[user_pos],
+                                             "wine_type": wine_type,
+                                             "rank": rank.astype(np.int16),
+                                             "nearest": labels[wines[found]],
+                                             "score": scores[found]}))
+
+    if len(recommendations) == 0:
+        # no catalogue columns in the matrix
+        recommendations.append(pd.DataFrame({"user_key": pd.Series(dtype=np.int64),
+                                             "wine_type": pd.Series(dtype=str),
+                                             "rank": pd.Series(dtype=np.int16),
+                                             "nearest": pd.Series(dtype=np.int64),
+                                             "score": pd.Series(dtype=np.float32)}))
+    recommendations = pd.concat(recommendations, ignore_index=True)
+    recommendations = users[["user_key", "user", "distribution"]].merge(recommendations, on="user_key")
+    recommendations["wine_type"] = recommendations["wine_type"].astype("category")
+    return recommendations.sort_values(["user_key", "wine_type", "rank"], ignore_index=True), neighbours
+
+
+def save_collaborative(path, recommendations, neighbours):
+    """
+    Function that saves collaborative recommendations and user neighbourhoods as parquet.
+
+    Parameters:
+        path (str): path to data.
+        recommendations (dataframe): collaborative recommendations (see recommend_all_users_collaborative).
+        neighbours (dataframe): user neighbourhoods (see recommend_all_users_collaborative).
+
+    Returns:
+        str: saved recommendations file path.
+    """
+    neighbours.to_parquet(os.path.join(path, user_neighbours_file), engine="pyarrow", index=False)
+    return brf.save_recommendations(path, recommendations, collaborative_recommendations_file)
+
+
+def benchmark_collaborative(n_users, k=5, n_neighbours=None, n_workers=None, seed=0):
+    """
+    Function that measures the collaborative engine on simulated users: ownership matrix build
+    and neighbourhood computation times and memory.
+
+    Parameters:
+        n_users (int): number of simulated users.
+        k (int): wines recommended per user and wine type.
+        n_neighbours (int): similar users kept per user. neighbours_per_user if None.
+        n_workers (int): number of worker processes. Number of cores if None.
+        seed (int): simulation seed.
+
+    Returns:
+        dict: users, user wines, simulation, matrix build and neighbourhood seconds, users per second,
+        matrix and result megabytes and peak resident megabytes (so far) of this process and of its workers.
+    """
+    catalogues = {wine_type: wcat.get_catalogue(wine_type, ["Cluster", "Zone"]) for wine_type in wcat.catalogue_files}
+
+    start = time.perf_counter()
+    simulation = uwdf.simulate_users(catalogues["red"], catalogues["white"], n_users, seed)
+    simulation_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    matrix, columns = simulation_user_wine_matrix(simulation, {wine_type: df.index for wine_type, df in catalogues.items()})
+    build_seconds = time.perf_counter() - start
+    del simulation
+
+    start = time.perf_counter()
+    neighbours, similarities, recommendations = compute_neighbourhoods(matrix, columns, n_neighbours, k, n_workers)
+    neighbourhood_seconds = time.perf_counter() - start
+
+    result_bytes = neighbours.nbytes + similarities.nbytes + sum(w.nbytes + s.nbytes for w, s in recommendations.values())
+    # ru_maxrss is in kilobytes on linux
+    return {"users": n_users,
+            "user_wines": matrix.nnz,
+            "simulation_s": round(simulation_seconds, 2),
+            "matrix_build_s": round(build_seconds, 2),
+            "neighbourhoods_s": round(neighbourhood_seconds, 2),
+            "users_per_s": round(n_users / neighbourhood_seconds),
+            "matrix_mb": round((matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes) / 1024 ** 2, 1),
+            "result_mb": round(result_bytes / 1024 ** 2, 1),
+            "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            "peak_worker_rss_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1)}
@@ -0,0 +1,218 @@
+# pairwise distance functions
+import os
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+# queries per block
+query_block_size = 1024
+
+# memory (bytes) all threads may use for block distances. Catalogue blocks are sized to fit in it
+memory_budget = 256 * 1024 ** 2
+
+# float arrays allocated per block distance (distances, products / differences and top k candidates)
+arrays_per_block = 3
+
+# bytes of the top k selection index of each block distance
+index_bytes = 8
+
+
+def row_norms(matrix):
+    """
+    Function that computes the squared norm and norm of each matrix row.
+
+    Parameters:
+        matrix (np.array): vectors, one per row.
+
+    Returns:
+        sq_norms (np.array): squared norm of each row.
+        norms (np.array): norm of each row.
+    """
+    sq_norms = np.einsum("ij,ij->i", matrix, matrix)
+    return sq_norms, np.sqrt(sq_norms)
+
+
+def block_distances(queries, targets, distance, target_sq_norms=None, target_norms=None):
+    """
+    Function that computes the distance between every query and target vector of a block.
+    Euclidean and cosine distances are a single matrix product, manhattan distance is accumulated
+    feature by feature (memory bounded by n_queries x n_targets). Result keeps the inputs precision.
+
+    Parameters:
+        queries (np.array): query vectors, one per row.
+        targets (np.array): target vectors, one per row.
+        distance (str): distance to use. Euclidean, manhattan or cosine.
+        target_sq_norms (np.array): squared norm of each target (euclidean). Computed if None.
+        target_norms (np.array): norm of each target (cosine). Computed if None.
+
+    Returns:
+        distances (np.array): n_queries x n_targets distances. Lower is more similar.
+    """
+    if distance == "euclidean":
+        if target_sq_norms is None:
+            target_sq_norms, _ = row_norms(targets)
+        dist = queries @ targets.T
+        dist *= -2.0
+        dist += np.einsum("ij,ij->i", queries, queries)[:, None]
+        dist += target_sq_norms[None, :]
+        np.maximum(dist, 0.0, out=dist) # avoid negative rounding errors
+        return np.sqrt(dist, out=dist)
+
+    if distance == "manhattan":
+        dist = np.zeros((len(queries), len(targets)), dtype=np.result_type(queries, targets))
+        for feature in range(queries.shape[1]):
+            dist += np.abs(queries[:, feature, None] - targets[None, :, feature])
+        return dist
+
+    if distance in ("cosine", "cosine_similarity"):
+        # cosine distance = 1 - cosine similarity
+        if target_norms is None:
+            _, target_norms = row_norms(targets)
+        q_norms = np.linalg.norm(queries, axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            similarity = (queries @ targets.T) / (q_norms[:, None] * target_norms[None, :])
+        return 1.0 - np.nan_to_num(similarity, nan=0.0)
+
+    raise ValueError(f"Unknown distance '{distance}'. Use euclidean, manhattan or cosine.")
+
+
+def target_block_size(n_queries, n_targets, itemsize, n_jobs, budget=None):
+    """
+    Function that sizes catalogue blocks so that every thread block distances fit in the memory budget.
+
+    Parameters:
+        n_queries (int): queries per block.
+        n_targets (int): number of target vectors.
+        itemsize (int): bytes per float.
+        n_jobs (int): number of threads.
+        budget (int): memory budget in bytes. memory_budget if None.
+
+    Returns:
+        int: targets per block (at least one).
+    """
+    budget = budget or memory_budget
+    per_thread = budget / max(n_jobs, 1)
+    bytes_per_distance = arrays_per_block * itemsize + index_bytes
+    return int(min(n_targets, max(1, per_thread // (bytes_per_distance * max(n_queries, 1)))))
+
+
+def pairwise_distances(queries, targets, distance="euclidean", dtype=np.float64, block_size=None, n_jobs=None):
+    """
+    Function that computes the full query x target distance matrix (e.g. similarity matrices for
+    analysis) by blocks of queries in parallel threads (NumPy releases the GIL).
+
+    Parameters:
+        queries (np.array): query vectors, one per row.
+        targets (np.array): target vectors, one per row.
+        distance (str): distance to use. Euclidean, manhattan or cosine.
+        dtype (np.dtype): computation precision, np.float32 or np.float64.
+        block_size (int): queries per block. query_block_size if None.
+        n_jobs (int): number of threads. All cores if None.
+
+    Returns:
+        distances (np.array): n_queries x n_targets distances.
+    """
+    block_size = block_size or query_block_size
+    queries = np.ascontiguousarray(np.atleast_2d(queries), dtype=dtype)
+    targets = np.ascontiguousarray(np.atleast_2d(targets), dtype=dtype)
+    target_sq_norms, target_norms = row_norms(targets)
+    result = np.empty((len(queries), len(targets)), dtype=dtype)
+
+    def process_block(start):
+        end = min(start + block_size, len(queries))
+        result[start:end] = block_distances(queries[start:end], targets, distance, target_sq_norms, target_norms)
+
+    with ThreadPoolExecutor(max_workers=n_jobs or os.cpu_count()) as executor:
+        list(executor.map(process_block, range(0, len(queries), block_size)))
+    return result
+
+
+def merge_top_k(best_pos, best_dist, dist, offset, k):
+    """
+    Function that merges the running k nearest targets of each query with a new block of distances.
+
+    Parameters:
+        best_pos (np.array): n_queries x k target positions found so far.
+        best_dist (np.array): n_queries x k corresponding distances (inf where not found yet).
+        dist (np.array): n_queries x block distances to the targets starting at offset.
+        offset (int): target position of the first block column.
+        k (int): number of neighbours to keep (at least 1, at most the running neighbours kept).
+
+    Returns:
+        best_pos (np.array): n_queries x k merged target positions (unordered).
+        best_dist (np.array): n_queries x k corresponding distances.
+    """
+    if not 1 <= k <= best_pos.shape[1]:
+        raise ValueError(f"k must be between 1 and {best_pos.shape[1]} (running neighbours), got {k}.")
+    cand_dist = np.hstack([best_dist, dist])
+    selected = np.argpartition(cand_dist, k - 1, axis=1)[:, :k]
+    block_pos = np.arange(offset, offset + dist.shape[1])
+    cand_pos = np.where(selected < k, np.take_along_axis(best_pos, np.minimum(selected, k - 1), axis=1),
+                        block_pos[np.maximum(selected - k, 0)])
+    return cand_pos, np.take_along_axis(cand_dist, selected, axis=1)
+
+
+def streaming_top_k(queries, targets, k, distance="euclidean", dtype=np.float64, query_positions=None,
+                    block_size=None, n_jobs=None, budget=None):
+    """
+    Function that obtains the k nearest targets of every query without materializing the full
+    distance matrix: each thread scans the targets by blocks sized to the memory budget and keeps
+    only the running k nearest. A catalogue self join passes the catalogue as queries and targets.
+
+    Parameters:
+        queries (np.array): query vectors, one per row.
+        targets (np.array): target vectors, one per row.
+        k (int): number of nearest targets per query (at least 1). Clamped to the number of candidates.
+        distance (str): distance to use. Euclidean, manhattan or cosine.
+        dtype (np.dtype): computation precision, np.float32 or np.float64.
+        query_positions (np.array): target position of each query, never returned as its neighbour
+            (self join). None if queries are not targets.
+        block_size (int): queries per block. query_block_size if None.
+        n_jobs (int): number of threads. All cores if None.
+        budget (int): memory budget in bytes for block distances. memory_budget if None.
+
+    Returns:
+        positions (np.array): n_queries x k target positions ordered by distance (no column if there
+            is no candidate).
+        top_dist (np.array): n_queries x k corresponding distances.
+    """
+    if k < 1:
+        raise ValueError(f"k must be at least 1, got {k}.")
+    block_size = block_size or query_block_size
+    queries = np.ascontiguousarray(np.atleast_2d(queries), dtype=dtype)
+    targets = np.ascontiguousarray(np.atleast_2d(targets), dtype=dtype)
+    target_sq_norms, target_norms = row_norms(targets)
+
+    # k nearest among the candidates (a self join query is not its own candidate)
+    k = max(min(k, len(targets) - (query_positions is not None)), 0)
+    positions = np.empty((len(queries), k), dtype=np.int64)
+    top_dist = np.empty((len(queries), k), dtype=dtype)
+    if k == 0:
+        return positions, top_dist
+
+    n_jobs = n_jobs or os.cpu_count()
+    n_block_targets = target_block_size(min(block_size, len(queries)), len(targets), queries.itemsize,
+                                        n_jobs, budget)
+
+    def process_block(start):
+        end = min(start + block_size, len(queries))
+        best_pos = np.zeros((end - start, k), dtype=np.int64)
+        best_dist = np.full((end - start, k), np.inf, dtype=dtype)
+        for offset in range(0, len(targets), n_block_targets):
+            stop = min(offset + n_block_targets, len(targets))
+            dist = block_distances(queries[start:end], targets[offset:stop], distance,
+                                   target_sq_norms[offset:stop], target_norms[offset:stop])
+            if query_positions is not None:
+                # a query is not its own neighbour
+                own = query_positions[start:end] - offset
+                inside = (own >= 0) & (own < stop - offset)
+                dist[np.nonzero(inside)[0], own[inside]] = np.inf
+            best_pos, best_dist = merge_top_k(best_pos, best_dist, dist, offset, k)
+
+        # order neighbours by distance
+        order = np.argsort(best_dist, axis=1, kind="stable")
+        positions[start:end] = np.take_along_axis(best_pos, order, axis=1)
+        top_dist[start:end] = np.take_along_axis(best_dist, order, axis=1)
+
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        list(executor.map(process_block, range(0, len(queries), block_size)))
+    return positions, top_dist
@@ -0,0 +1,119 @@
+# quantile sketch functions
+import numpy as np
+
+# Mergeable approximate quantile sketch (KLL style compactors).
+# Level h keeps values that represent 2**h original values. When a level grows over its
+# capacity it is sorted and every other value is promoted to the next level, so memory is
+# bounded by capacity x number of levels whatever the number of values.
+
+
+def create_quantile_sketch(capacity=4096):
+    """
+    Function that creates an empty quantile sketch.
+
+    Parameters:
+        capacity (int): maximum values per level. Higher capacity, lower error.
+
+    Returns:
+        sketch (dict): quantile sketch composed by:
+            capacity: maximum values per level.
+            levels: list of value arrays, level h values have weight 2**h.
+            count: number of values added.
+            offset: next compaction offset (alternated to avoid bias).
+    """
+    return {"capacity": capacity, "levels": [np.empty(0)], "count": 0, "offset": 0}
+
+
+def compress_quantile_sketch(sketch):
+    """
+    Function that compacts sketch levels over capacity promoting half of their values to next level.
+
+    Parameters:
+        sketch (dict): quantile sketch.
+
+    Returns:
+        sketch (dict): compacted quantile sketch.
+    """
+    levels = sketch["levels"]
+    h = 0
+    while h < len(levels):
+        if len(levels[h]) > sketch["capacity"]:
+            items = np.sort(levels[h])
+            n_even = len(items) - len(items) % 2
+
+            # keep every other value (alternating offset) and the odd one out
+            promoted = items[sketch["offset"]:n_even:2]
+            sketch["offset"] = 1 - sketch["offset"]
+            levels[h] = items[n_even:]
+            if h + 1 == len(levels):
+                levels.append(np.empty(0))
+            levels[h + 1] = np.concatenate([levels[h + 1], promoted])
+        h += 1
+    return sketch
+
+
+def update_quantile_sketch(sketch, values):
+    """
+    Function that adds values to a quantile sketch. NaN values are ignored.
+
+    Parameters:
+        sketch (dict): quantile sketch.
+        values (array-like): values to add.
+
+    Returns:
+        sketch (dict): updated quantile sketch.
+    """
+    values = np.asarray(values, dtype=np.float64).ravel()
+    values = values[~np.isnan(values)]
+    sketch["levels"][0] = np.concatenate([sketch["levels"][0], values])
+    sketch["count"] += len(values)
+    return compress_quantile_sketch(sketch)
+
+
+def merge_quantile_sketches(sketch1, sketch2):
+    """
+    Function that merges two quantile sketches (e.g. computed from different chunks or files).
+
+    Parameters:
+        sketch1 (dict): quantile sketch.
+        sketch2 (dict): quantile sketch.
+
+    Returns:
+        sketch (dict): new quantile sketch summarizing values of both sketches.
+    """
+    n_levels = max(len(sketch1["levels"]), len(sketch2["levels"]))
+    empty = np.empty(0)
+    levels = [np.concatenate([sketch1["levels"][h] if h < len(sketch1["levels"]) else empty,
+                              sketch2["levels"][h] if h < len(sketch2["levels"]) else empty])
+              for h in range(n_levels)]
+
+    sketch = {"capacity": min(sketch1["capacity"], sketch2["capacity"]),
+              "levels": levels,
+              "count": sketch1["count"] + sketch2["count"],
+              "offset": sketch1["offset"]}
+    return compress_quantile_sketch(sketch)
+
+
+def sketch_quantiles(sketch, quantiles):
+    """
+    Function that estimates quantiles from a quantile sketch.
+    Linear interpolation between ranks, as np.percentile does, so results are exact while
+    no compaction has been needed.
+
+    Parameters:
+        sketch (dict): quantile sketch.
+        quantiles (list(float)): quantiles to estimate, between 0 and 1.
+
+    Returns:
+        values (np.array): estimated quantile values.
+    """
+    items = np.concatenate(sketch["levels"])
+    weights = np.concatenate([np.full(len(level), 2.0 ** h) for h, level in enumerate(sketch["levels"])])
+
+    order = np.argsort(items, kind="stable")
+    items, weights = items[order], weights[order]
+
+    # rank of each value center in the original data
+    ranks = np.cumsum(weights) - weights + (weights - 1) / 2.0
+    total = weights.sum()
+    return np.interp(np.asarray(quantiles) * (total - 1), ranks, items)
@@ -0,0 +1,179 @@
+# recommendation cache functions
+import os
+import json
+import pickle
+import hashlib
+import threading
+from collections import OrderedDict
+from modules import wine_catalogue_functions as wcat
+from modules import wine_recommendation_functions as wrf
+
+# maximum number of recommendations kept in memory (least recently used are evicted)
+cache_size = 1024
+
+# optional disk tier folder (one file per user and distance). Memory only if None
+cache_dir = None
+
+# in memory tier: (user, distance) -> (key, entry), least recently used first
+memory_cache = OrderedDict()
+
+# content hash per catalogue, computed once per catalogue file version
+catalogue_hashes = {}
+
+# guard the memory tier and catalogue hashes (service worker threads share them)
+cache_lock = threading.Lock()
+hash_lock = threading.Lock()
+
+
+def catalogue_content_hash(wine_type):
+    """
+    Function that returns the content hash of a clustered catalogue file.
+    The file is only read again when its version (modification time and size) changes.
+
+    Parameters:
+        wine_type (str): "red" or "white".
+
+    Returns:
+        str: hexadecimal content hash.
+    """
+    version = wcat.catalogue_version(wine_type)
+    with hash_lock:
+        if wine_type not in catalogue_hashes or catalogue_hashes[wine_type][0] != version:
+            digest = hashlib.sha1()
+            with open(wcat.catalogue_path(wine_type), 'rb') as catalogue_file:
+                for block in iter(lambda: catalogue_file.read(1024 * 1024), b""):
+                    digest.update(block)
+            catalogue_hashes[wine_type] = (version, digest.hexdigest())
+        return catalogue_hashes[wine_type][1]
+
+
+def recommendation_key(user_data, distance):
+    """
+    Function that computes the cache key of a user recommendation. It changes when the user
+    record, either catalogue, the distance or the recommendation mode change.
+
+    Parameters:
+        user_data (dict): user wine distribution configuration.
+        distance (str): distance to use. Euclidean, manhattan or cosine.
+
+    Returns:
+        str: hexadecimal cache key.
+    """
+    digest = hashlib.sha1()
+    digest.update(json.dumps([str(user_data["user"]), distance,
+                              catalogue_content_hash("red"), catalogue_content_hash("white"),
+                              wrf.recommendation_mode, wrf.profile_weighting]).encode())
+    digest.update(json.dumps(user_data, sort_keys=True, default=int).encode())
+    return digest.hexdigest()
+
+
+def cache_file(user_id, distance):
+    """
+    Function that returns the disk tier file of a user recommendation.
+
+    Parameters:
+        user_id (str): user id.
+        distance (str): distance used.
+
+    Returns:
+        str: cache file path.
+    """
+    return os.path.join(cache_dir, f"user_{user_id}_{distance}.pkl")
+
+
+def cache_get(user_id, distance, key):
+    """
+    Function that looks up a recommendation in memory and then on disk.
+    Entries saved with another key (user or catalogues changed) are ignored.
+
+    Parameters:
+        user_id (str): user id.
+        distance (str): distance used.
+        key (str): current recommendation key.
+
+    Returns:
+        entry (dict): cached entry or None.
+    """
+    with cache_lock:
+        cached = memory_cache.get((user_id, distance))
+        if cached is not None and cached[0] == key:
+            memory_cache.move_to_end((user_id, distance))
+            return cached[1]
+
+    if cache_dir is not None and os.path.exists(cache_file(user_id, distance)):
+        with open(cache_file(user_id, distance), 'rb') as pickle_file:
+            cached = pickle.load(pickle_file)
+        if cached[0] == key:
+            cache_put(user_id, distance, key, cached[1], write_disk=False)
+            return cached[1]
+    return None
+
+
+def cache_put(user_id, distance, key, entry, write_disk=True):
+    """
+    Function that saves a recommendation in memory (evicting least recently used ones) and on disk.
+
+    Parameters:
+        user_id (str): user id.
+        distance (str): distance used.
+        key (str): recommendation key.
+        entry (dict): entry to cache.
+        write_disk (bool): whether to write the disk tier.
+    """
+    with cache_lock:
+        memory_cache[(user_id, distance)] = (key, entry)
+        memory_cache.move_to_end((user_id, distance))
+        while len(memory_cache) > cache_size:
+            memory_cache.popitem(last=False)
+
+    if write_disk and cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_file = f"{cache_file(user_id, distance)}.{threading.get_ident()}.tmp" # one per writing thread
+        with open(tmp_file, 'wb') as pickle_file:
+            pickle.dump((key, entry), pickle_file)
+        os.replace(tmp_file, cache_file(user_id, distance))
+
+
+def get_recommendation(user_data, distance="euclidean"):
+    """
+    Function that returns a user recommendation, computing it only if it is not cached for the
+    current user record and catalogues.
+
+    Parameters:
+        user_data (dict): user wine distribution configuration.
+        distance (str): distance to use. Euclidean, manhattan or cosine.
+
+    Returns:
+        entry (dict): cached entry composed by:
+            recommendation: distribution, solution_red and solution_white (see recommend_wines).
+            report: recommendation pdf path, None if not created yet.
+    """
+    user_id = str(user_data["user"])
+    key = recommendation_key(user_data, distance)
+    entry = cache_get(user_id, distance, key)
+    if entry is None:
+        entry = {"recommendation": wrf.recommend_wines(user_data, distance), "report": None}
+        cache_put(user_id, distance, key, entry)
+    return entry
+
+
+def set_report(user_data, distance, report_path):
+    """
+    Function that saves the recommendation pdf path of a cached recommendation.
+
+    Parameters:
+        user_data (dict): user wine distribution configuration.
+        distance (str): distance used.
+        report_path (str): recommendation pdf path.
+    """
+    entry = get_recommendation(user_data, distance)
+    entry["report"] = report_path
+    cache_put(str(user_data["user"]), distance, recommendation_key(user_data, distance), entry)
+
+
+def clear_cache():
+    """
+    Function that empties the in memory tier (disk entries are ignored once their key changes).
+    """
+    with cache_lock:
+        memory_cache.clear()
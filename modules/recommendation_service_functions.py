@@ -0,0 +1,246 @@
+# recommendation service functions
+import os
+import json
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+from modules import wine_catalogue_functions as wcat
+from modules import wine_search_functions as wsf
+from modules import wine_recommendation_functions as wrf
+from modules import recommendation_cache_functions as rcf
+from modules import user_store_functions as usf
+from modules import user_profile_functions as upf
+
+# maximum computations queued or running at the same time (next ones get 503 until one finishes)
+max_pending_requests = 64
+
+# user store connection per worker thread (sqlite connections can not be shared between threads)
+thread_data = threading.local()
+
+# http status reasons
+status_reasons = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+                  500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+def warm_up(path):
+    """
+    Function that loads catalogues, their search indexes and the user store before serving requests.
+
+    Parameters:
+        path (str): path to data.
+    """
+    wcat.set_data_root(path)
+    for wine_type in wcat.catalogue_files:
+        wcat.get_catalogue(wine_type)
+        wrf.get_search_engine(wine_type)
+        wrf.get_knn_graph(wine_type)
+        if wrf.search_nprobe is not None:
+            wrf.get_ivf_index(wine_type)
+        rcf.catalogue_content_hash(wine_type)
+    get_user_store()
+
+
+def get_user_store():
+    """
+    Function that returns the user store connection of the current thread, opening it if needed.
+
+    Returns:
+        conn (sqlite3.Connection): user store connection.
+    """
+    if getattr(thread_data, "user_store", None) is None:
+        thread_data.user_store = usf.open_user_store(wcat.get_data_root())
+    return thread_data.user_store
+
+
+def solution_to_dict(solution, wine_type):
+    """
+    Function that converts a recommendation solution into json serializable dictionaries.
+
+    Parameters:
+        solution (dataframe): selected wine and recommended wine side by side (see create_solution).
+        wine_type (str): "red" or "white".
+
+    Returns:
+        dict: selected and nearest wines as column -> value dictionaries. None if no solution.
+    """
+    if solution is None:
+        return None
+    names = ["wine"] + [col for col in wcat.get_catalogue_entry(wine_type)["columns"] if col != "Cluster"]
+    return {"selected": dict(zip(names, solution["Selected"].tolist())),
+            "nearest": dict(zip(names, solution["Nearest"].tolist()))}
+
+
+def recommend_user(user_id, distance):
+    """
+    Function that returns a user recommendation as a json serializable dictionary (worker thread).
+
+    Parameters:
+        user_id (str): user id.
+        distance (str): distance to use. Euclidean, manhattan or cosine.
+
+    Returns:
+        status (int): http status.
+        body (dict): recommendation or error message.
+    """
+    user_data = usf.get_user(get_user_store(), user_id)
+    if user_data is None:
+        return 404, {"error": f"User '{user_id}' not found"}
+
+    wcat.refresh_catalogues()
+    distribution, solution_red, solution_white = rcf.get_recommendation(user_data, distance)["recommendation"]
+    return 200, {"user": user_id,
+                 "distribution": distribution,
+                 "distance": distance,
+                 "red": solution_to_dict(solution_red, "red"),
+                 "white": solution_to_dict(solution_white, "white")}
+
+
+def report_user(user_id, distance):
+    """
+    Function that returns a user recommendation pdf, creating it if needed (worker thread).
+
+    Parameters:
+        user_id (str): user id.
+        distance (str): distance to use. Euclidean, manhattan or cosine.
+
+    Returns:
+        status (int): http status.
+        body (dict): report path or error message.
+    """
+    user_data = usf.get_user(get_user_store(), user_id)
+    if user_data is None:
+        return 404, {"error": f"User '{user_id}' not found"}
+
+    wcat.refresh_catalogues()
+    recommendation = rcf.get_recommendation(user_data, distance)
+    output_file = recommendation["report"]
+    if output_file is None or not os.path.exists(output_file):
+        distribution, solution_red, solution_white = recommendation["recommendation"]
+        recommendation_text = wrf.create_recommendation_text(distribution, solution_red, solution_white)
+        user_red_cat, user_white_cat = upf.get_user_catalogues(user_data)
+        output_file = upf.create_recomendation_pdf(user_data, user_red_cat, user_white_cat, user_id,
+                                                   solution_red, solution_white, recommendation_text,
+                                                   report_key=rcf.recommendation_key(user_data, distance))
+        rcf.set_report(user_data, distance, output_file)
+    return 200, {"user": user_id, "report": os.path.abspath(output_file)}
+
+
+# endpoint -> worker function
+endpoints = {"/recommend": recommend_user,
+             "/report": report_user}
+
+
+async def read_request(reader):
+    """
+    Function that reads an http request line and headers.
+
+    Parameters:
+        reader (asyncio.StreamReader): connection reader.
+
+    Returns:
+        method (str): http method.
+        target (str): request target (path and query).
+    """
+    request_line = (await reader.readline()).decode("latin-1").split()
+    while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+        pass # headers are not used
+    if len(request_line) < 2:
+        return None, None
+    return request_line[0], request_line[1]
+
+
+async def write_response(writer, status, body):
+    """
+    Function that writes a json http response and closes the connection.
+
+    Parameters:
+        writer (asyncio.StreamWriter): connection writer.
+        status (int): http status.
+        body (dict): json body.
+    """
+    payload = json.dumps(body, default=str).encode()
+    writer.write(f"HTTP/1.1 {status} {status_reasons[status]}\r\n"
+                 f"Content-Type: application/json\r\n"
+                 f"Content-Length: {len(payload)}\r\n"
+                 f"Connection: close\r\n\r\n".encode() + payload)
+    await writer.drain()
+    writer.close()
+
+
+def create_service(executor, max_pending=None):
+    """
+    Function that creates the request handler of the recommendation service.
+    CPU-bound work runs in the executor. Concurrent requests about the same user, endpoint and
+    distance share a single computation, and new computations over max_pending are rejected with 503.
+
+    Parameters:
+        executor (concurrent.futures.Executor): worker pool.
+        max_pending (int): maximum requests being processed. max_pending_requests if None.
+
+    Returns:
+        handler (coroutine function): asyncio connection handler.
+    """
+    max_pending = max_pending or max_pending_requests
+    in_flight = {}
+
+    def start_computation(key):
+        loop = asyncio.get_running_loop()
+        endpoint, user_id, distance = key
+        in_flight[key] = loop.run_in_executor(executor, endpoints[endpoint], user_id, distance)
+        in_flight[key].add_done_callback(lambda _: in_flight.pop(key, None))
+
+    async def handle(reader, writer):
+        method, target = await read_request(reader)
+        if method is None:
+            writer.close()
+            return
+        url = urlsplit(target)
+        query = parse_qs(url.query)
+
+        if method != "GET":
+            return await write_response(writer, 405, {"error": "Only GET is supported"})
+        if url.path == "/health":
+            return await write_response(writer, 200, {"status": "ok", "pending": len(in_flight)})
+        if url.path not in endpoints:
+            return await write_response(writer, 404, {"error": f"Unknown endpoint '{url.path}'"})
+        if "user" not in query:
+            return await write_response(writer, 400, {"error": "Missing 'user' parameter"})
+        distance = query.get("distance", ["euclidean"])[0]
+        if distance not in wsf.distances:
+            return await write_response(writer, 400, {"error": f"Unknown distance '{distance}'"})
+
+        # requests about a computation in flight wait for it (coalescing), new computations are
+        # rejected when max_pending are already queued or running (backpressure)
+        key = (url.path, query["user"][0], distance)
+        if key not in in_flight:
+            if len(in_flight) >= max_pending:
+                return await write_response(writer, 503, {"error": "Too many pending requests"})
+            start_computation(key)
+        try:
+            status, body = await asyncio.shield(in_flight[key])
+        except Exception as error:
+            status, body = 500, {"error": str(error)}
+        await write_response(writer, status, body)
+
+    return handle
+
+
+async def serve(path, host="127.0.0.1", port=8080, n_workers=None, max_pending=None):
+    """
+    Function that runs the recommendation service until it is cancelled.
+    Catalogues, search indexes and user store are loaded once and kept warm.
+
+    Parameters:
+        path (str): path to data.
+        host (str): host to listen on (localhost by default).
+        port (int): port to listen on.
+        n_workers (int): number of worker threads. Number of cores if None.
+        max_pending (int): maximum requests being processed. max_pending_requests if None.
+    """
+    warm_up(path)
+    with ThreadPoolExecutor(max_workers=n_workers or os.cpu_count()) as executor:
+        server = await asyncio.start_server(create_service(executor, max_pending), host, port)
+        print(f"RECOMMENDATION SERVICE LISTENING ON http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
@@ -0,0 +1,110 @@
+# user id functions
+import numpy as np
+
+# Opaque user ids: a monotonic counter (user key) is scrambled with a keyed Feistel network.
+# A Feistel network is a permutation, so different keys always give different ids and no
+# uniqueness check is needed. Cycle walking keeps ids inside the decimal id space.
+
+# number of digits of user ids
+id_digits = 8
+
+# Feistel round keys (change them to get a different id sequence)
+id_round_keys = [0x5bd1e995, 0x27d4eb2f, 0x165667b1, 0x9e3779b1]
+
+# 64 bit mixing multiplier of the round function
+round_multiplier = np.uint64(0x9E3779B97F4A7C15)
+
+
+def feistel_half_bits(n_digits):
+    """
+    Function that returns the half block size (bits) of the Feistel network covering an id space.
+
+    Parameters:
+        n_digits (int): number of digits of ids.
+
+    Returns:
+        int: bits of each Feistel half block.
+    """
+    return (int(10 ** n_digits - 1).bit_length() + 1) // 2
+
+
+def feistel_rounds(values, half_bits, round_keys):
+    """
+    Function that applies a balanced Feistel network to integers of 2 x half_bits bits.
+
+    Parameters:
+        values (np.array): integers to permute.
+        half_bits (int): bits of each half block.
+        round_keys (list(int)): one key per round.
+
+    Returns:
+        np.array: permuted integers.
+    """
+    mask = np.uint64((1 << half_bits) - 1)
+    shift = np.uint64(half_bits)
+    left = (values >> shift) & mask
+    right = values & mask
+    for key in round_keys:
+        mixed = (right + np.uint64(key)) * round_multiplier
+        mixed = (mixed ^ (mixed >> np.uint64(31))) * round_multiplier
+        left, right = right, left ^ ((mixed >> np.uint64(32)) & mask)
+    return (left << shift) | right
+
+
+def permute_user_keys(user_keys, n_digits=None, round_keys=None):
+    """
+    Function that maps user keys (counter values) to opaque user numbers, one to one.
+    Values out of the decimal id space are permuted again (cycle walking) until they fit.
+
+    Parameters:
+        user_keys (array-like): user keys, between 0 and 10 ** n_digits - 1.
+        n_digits (int): number of digits of ids. id_digits if None.
+        round_keys (list(int)): Feistel round keys. id_round_keys if None.
+
+    Returns:
+        np.array: user numbers, between 0 and 10 ** n_digits - 1.
+    """
+    n_digits = id_digits if n_digits is None else n_digits
+    round_keys = id_round_keys if round_keys is None else round_keys
+    limit = np.uint64(10 ** n_digits)
+
+    values = np.asarray(user_keys, dtype=np.uint64)
+    if np.any(values >= limit):
+        raise ValueError(f"User keys exceed the {n_digits} digits id space")
+
+    half_bits = feistel_half_bits(n_digits)
+    values = feistel_rounds(values, half_bits, round_keys)
+    outside = values >= limit
+    while outside.any():
+        values[outside] = feistel_rounds(values[outside], half_bits, round_keys)
+        outside = values >= limit
+    return values
+
+
+def format_user_ids(user_numbers, n_digits=None):
+    """
+    Function that formats user numbers as fixed width user ids.
+
+    Parameters:
+        user_numbers (array-like): user numbers.
+        n_digits (int): number of digits of ids. id_digits if None.
+
+    Returns:
+        np.array: user ids (str).
+    """
+    n_digits = id_digits if n_digits is None else n_digits
+    return np.char.zfill(np.asarray(user_numbers, dtype=np.uint64).astype(str), n_digits)
+
+
+def user_ids_from_keys(user_keys, n_digits=None):
+    """
+    Function that returns the opaque user id of each user key.
+
+    Parameters:
+        user_keys (array-like): user keys (counter values).
+        n_digits (int): number of digits of ids. id_digits if None.
+
+    Returns:
+        np.array: user ids (str).
+    """
+    return format_user_ids(permute_user_keys(user_keys, n_digits), n_digits)
@@ -1,22 +1,15 @@
 # user profile functions
 import pandas as pd
 import os
+import io
 import json
-import matplotlib.pyplot as plt
+import threading
 import numpy as np
 from math import pi
-from reportlab.lib.pagesizes import letter
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.lib.units import inch
-from reportlab.platypus import SimpleDocTemplate, Paragraph, PageBreak, Spacer, Image as PlatypusImage, Table, TableStyle
-from markdown2 import markdown  # Use markdown2 for better HTML conversion
-from bs4 import BeautifulSoup  # Use BeautifulSoup for parsing HTML
-from reportlab.lib import colors
 from datetime import datetime
-
-# wine catalogues 
-df_red = pd.read_parquet(os.path.join("../data", "red_wines_clustered.parquet"), engine ="pyarrow")
-df_white = pd.read_parquet(os.path.join("../data", "white_wines_clustered.parquet"), engine ="pyarrow")
+from modules import wine_catalogue_functions as wcat
+from modules import wine_profile_functions as wpf
+from modules import user_profile_view_functions as upv
 
 # Wine descripors
 wine_descriptors = ["Sweetness","Nuance", "Tannicity", "Body", "Vibrancy"]
@@ -35,6 +28,12 @@ descriptor_dict = {"residual sugar" : "Sweetness",
      "Body_tmp": "Body",
      "Vibrancy_tmp": "Vibrancy"}
 
+# catalogue columns used to create profiles and comparative plots
+profile_cols = wine_descriptors + list(descriptor_dict.keys())
+
+# radar figures of the current thread, built once and reused by every report (only data changes)
+radar_templates = threading.local()
+
 
 def get_user_list(path, json_file):
     """
@@ -102,6 +101,24 @@ def get_specific_wines(df, wine_distr):
     #filter & return user's wines from catalogue
     return df.iloc[wines_rows]
     
+def get_user_catalogues (user_data):
+    """
+    Function that obtain a user's wines from wine catalogues.
+
+    Parameters:
+        user_data (dict): users wine profile
+
+    Returns: user_red_catalogue, user_white_catalogue
+       user_red_catalogue : users' red wines list obtained for red wine catalogue.
+       user_white_catalogue: users' white wines list obtained for white wine catalogue.
+    """   
+    # filter and obtain user wine catalogue to create profile
+    user_red_catalogue = get_specific_wines(wcat.get_catalogue("red", profile_cols),
+                                            user_data["red_distribution"])
+    user_white_catalogue = get_specific_wines(wcat.get_catalogue("white", profile_cols),
+                                              user_data["white_distribution"])
+    return user_red_catalogue, user_white_catalogue
+
 def get_specific_user_info (users_list, user_id):
     """
     Function that obtain specific users wine data.
@@ -124,12 +141,8 @@ def get_specific_user_info (users_list, user_id):
     # get specific user's data
     user_info = [x for x in users_list if x["user"] == user_id]
     if len(user_info) == 1:
-        
         user_data = user_info[0]
-                
-        # filter and obtain user wine catalogue to create profile
-        user_red_catalogue = get_specific_wines(df_red, user_info[0]["red_distribution"])
-        user_white_catalogue = get_specific_wines(df_white, user_info[0]["white_distribution"])
+        user_red_catalogue, user_white_catalogue = get_user_catalogues(user_data)
     
     return user_data, user_red_catalogue, user_white_catalogue
 
@@ -146,95 +159,236 @@ def map_value_to_position(key, val):
     """    
     return descriptor_values[key].index(val)
 
-def create_radar_plot(average_df, title, user_id, save_path):
+def figure_to_buffer(fig):
     """
-    Function that plots a radar or spider plot according to average wine profile.
-    
+    Function that renders a figure as png into an in-memory buffer.
+
     Parameters:
-        average_df (pd.DataFrame): DataFrame containing average positions for each descriptor.
-        user_id (str): User identification code.
-        title (str): Title to assign to the plot
-        save_path (str) : Path to save the plot
+        fig (matplotlib.figure.Figure): figure to render.
+
     Returns:
-       Plots radar graph corresponding to average wine profile and saves as png.
-    """  
+       io.BytesIO: png image, positioned at its start.
+    """
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png', bbox_inches='tight', pad_inches=0.5)
+    buffer.seek(0)
+    return buffer
 
-    # Prepare categories and corresponding values
-    categories = average_df['Descriptor'].tolist()
-    values = average_df['Average Position'].tolist()
-    values += values[:1]  # Repeat the first value at the end to close the circle
+def radar_angles():
+    """
+    Function that returns the radar angle of each wine descriptor.
 
-    # Calculate angles for the plot
-    N = len(categories)
+    Returns:
+       list(float): angles, the first one repeated at the end to close the loop.
+    """
+    N = len(wine_descriptors)
     angles = [n / float(N) * 2 * pi for n in range(N)]
-    angles += angles[:1]  # Close the loop
+    return angles + angles[:1]
+
+def create_radar_figure(figsize):
+    """
+    Function that creates a figure drawn with the non-interactive Agg renderer (no pyplot, no display).
+
+    Parameters:
+        figsize (tuple): figure width and height in inches.
 
-    # Start creating the radar plot
-    fig, ax = plt.subplots(1, 2, figsize=(8, 8), subplot_kw=dict(polar=True))
+    Returns:
+       matplotlib.figure.Figure: empty figure.
+    """
+    # matplotlib is only needed to draw reports
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    return fig
+
+def create_radar_axes(fig):
+    """
+    Function that adds the polar axes of a radar plot (left side): one axis per wine descriptor
+    and a fixed 0 to 2 position scale.
+
+    Parameters:
+        fig (matplotlib.figure.Figure): figure to draw on.
+
+    Returns:
+       radar polar axes.
+    """
+    ax = fig.add_subplot(1, 2, 1, polar=True)
 
     # Draw one axis per variable and add labels
-    ax[0].set_xticks(angles[:-1])
-    ax[0].set_xticklabels(categories, size=15)
+    angles = radar_angles()
+    ax.set_xticks(angles[:-1])
+    ax.set_xticklabels(wine_descriptors, size=15)
 
-    # Draw y-labels (customizable based on your data scale)
-    ax[0].set_rlabel_position(30)
-    plt.yticks([0, 1, 2], ["0", "1", "2"], color="grey", size=7)
-    plt.ylim(0, 2)  # Adjust depending on your value range 
+    # Draw y-labels
+    ax.set_rlabel_position(30)
+    ax.set_yticks([0, 1, 2], ["0", "1", "2"], color="grey", size=7)
+    ax.set_ylim(0, 2)
+    return ax
+
+def create_summary_axes(fig):
+    """
+    Function that adds the hidden axes where the plot summary is written (right side).
+
+    Parameters:
+        fig (matplotlib.figure.Figure): figure to draw on.
+
+    Returns:
+       summary axes (summary text coordinates are given on a 0 to 2 scale).
+    """
+    ax = fig.add_subplot(1, 2, 2, polar=True)
+    ax.set_ylim(0, 2)
+    ax.axis('off')  # Turn off the axis
+    return ax
+
+def add_radar_area(ax, label=None):
+    """
+    Function that adds a radar line and its filled area, empty until set_radar_values is called.
+
+    Parameters:
+        ax: radar polar axes.
+        label (str): legend label.
+
+    Returns:
+       line and filled area artists.
+    """
+    angles = radar_angles()
+    line, = ax.plot(angles, [0] * len(angles), linewidth=2, linestyle='solid', label=label)
+    area, = ax.fill(angles, [0] * len(angles), alpha=0.25)  # Fill area under the graph
+    return line, area
+
+def set_radar_values(line, area, values):
+    """
+    Function that updates a radar line and its filled area.
+
+    Parameters:
+        line: radar line artist.
+        area: radar filled area artist.
+        values (list(float)): one position per wine descriptor.
+    """
+    values = list(values) + list(values[:1])  # Repeat the first value at the end to close the circle
+    line.set_ydata(values)
+    area.set_xy(np.column_stack([radar_angles(), values]))
+
+def create_profile_radar_template():
+    """
+    Function that builds the wine profile radar figure: radar on the left and summary on the right.
+
+    Returns:
+       dict: figure and the artists updated per plot (line, area, summary and title).
+    """
+    fig = create_radar_figure((8, 8))
+    ax = create_radar_axes(fig)
+    line, area = add_radar_area(ax)
 
-    # Plot the radar chart
-    ax[0].plot(angles, values, linewidth=2, linestyle='solid', label=title)
-    ax[0].fill(angles, values, alpha=0.25)  # Fill area under the graph
-    
     # Summary on the right side
-    ax[1].axis('off')  # Turn off the axis
+    summary_ax = create_summary_axes(fig)
+    summary = summary_ax.text(0.05, 0.05, "", fontsize=16, ha='center', va='center', wrap=False,
+                              bbox=dict(facecolor='white', alpha=0.6, boxstyle='round,pad=0.75'))
+    title = summary_ax.set_title("", size=20, color='navy', y=0.90)
+    return {"figure": fig, "line": line, "area": area, "summary": summary, "title": title}
 
-    # Add summary text
-    summary_text ='\n'.join([f"'{row['Descriptor']}': {round(row['Average Position'],2)}," for index, row in average_df.iterrows()])
-    ax[1].text(0.05, 0.05, summary_text, fontsize=16, ha='center', va='center', wrap=False,
-              bbox=dict(facecolor='white', alpha=0.6, boxstyle='round,pad=0.75'))
+def create_comparative_radar_template():
+    """
+    Function that builds the comparative radar figure: reference and nearest wine radars on the
+    left and their descriptors on the right.
+
+    Returns:
+       dict: figure and the artists updated per plot (lines, areas, summary and title).
+    """
+    fig = create_radar_figure((10, 5))  # Adjust figure size
+    ax = create_radar_axes(fig)
+    reference_line, reference_area = add_radar_area(ax, "reference")
+    nearest_line, nearest_area = add_radar_area(ax, "nearest")
+    ax.legend()
+
+    # Layout is computed once: radar on the left side, below the title
+    fig.tight_layout(rect=[0, 0, 0.7, 0.88])
+
+    # Summary on the right side, below the title (it does not depend on the layout)
+    summary = fig.text(0.7, 0.88, "", fontsize=16, ha='left', va='top', wrap=True)
+    title = fig.suptitle("", size=20, color='navy', y=0.95)
+    return {"figure": fig, "reference_line": reference_line, "reference_area": reference_area,
+            "nearest_line": nearest_line, "nearest_area": nearest_area, "summary": summary, "title": title}
+
+# radar template builders
+radar_template_builders = {"profile": create_profile_radar_template,
+                           "comparative": create_comparative_radar_template}
+
+def get_radar_template(name):
+    """
+    Function that returns a radar figure template of the current thread, building it if needed.
+    Figures are not shared between threads, so reports can be created concurrently.
 
-    # Set title for the radar plot
+    Parameters:
+        name (str): "profile" or "comparative".
+
+    Returns:
+       dict: figure and its data artists.
+    """
+    templates = getattr(radar_templates, "figures", None)
+    if templates is None:
+        templates = radar_templates.figures = {}
+    if name not in templates:
+        templates[name] = radar_template_builders[name]()
+    return templates[name]
+
+def clear_radar_templates():
+    """
+    Function that releases the radar figure templates of the current thread.
+    """
+    radar_templates.figures = {}
+
+def create_radar_plot(average_df, title):
+    """
+    Function that plots a radar or spider plot according to average wine profile.
     
-    ax[1].set_title(title, size=20, color='navy', y=0.90)
+    Parameters:
+        average_df (pd.DataFrame): DataFrame containing average positions for each descriptor.
+        title (str): Title to assign to the plot
+    Returns:
+       io.BytesIO: radar graph corresponding to average wine profile as png.
+    """  
+    template = get_radar_template("profile")
+
+    # Plot the radar chart
+    positions = average_df.set_index('Descriptor')['Average Position']
+    set_radar_values(template["line"], template["area"], positions.loc[wine_descriptors].tolist())
 
-    # save file
-    title1 = f"{title}_user_{str(user_id)}"
-    plt.savefig(os.path.join(save_path, title1 + '.png'), bbox_inches='tight', pad_inches=0.5)
+    # Add summary text and title
+    summary_text ='\n'.join([f"'{descriptor}': {round(position,2)}," for descriptor, position in positions.items()])
+    template["summary"].set_text(summary_text)
+    template["title"].set_text(title)
 
-def create_wine_profile_plots(df, title, user_id, save_path):
+    # render in memory
+    return figure_to_buffer(template["figure"])
+
+def create_wine_profile_plots(df, title, profile=None):
     """
     Function that creates users wine profile radar plots
 
     Parameters:
         df (dataframe):  users wine catalogue
         title (str): title to give to created radar plot.
-        user_id (str): user identification code.
-        save_path (str): path to save created radar plot.
+        profile (pd.Series): users materialized profile (see user_profile_view_functions). Average
+            positions are computed from df if None.
 
-    Returns: user_data, user_red_catalogue, user_white_catalogue
-       user_data : users wine profile
-       user_red_catalogue : users' red wines list obtained for red wine catalogue.
-       user_white_catalogue: users' white wines list obtained for white wine catalogue.
+    Returns:
+       io.BytesIO: users wine profile radar plot as png.
     """   
-    
-    # Applying the mapping function to each row
-    df_f = pd.DataFrame()
-    for descriptor in wine_descriptors:
-        df_f[descriptor] = df[descriptor].apply(lambda val: map_value_to_position(descriptor, val))
-
-  
-    # Calculate average value per each descriptor based on position columns
-    average_values = {
-        descriptor: df_f[descriptor].mean() for descriptor in wine_descriptors
-    }
-
+    # Average position per each descriptor: precomputed or directly on categorical codes
+    if profile is not None:
+        average_values = profile[wine_descriptors].astype(float)
+    else:
+        average_values = wpf.descriptor_codes(df, wine_descriptors).mean()
 
     # Create a DataFrame for the average values
-    average_df = pd.DataFrame.from_dict(average_values, orient='index', columns=['Average Position']).reset_index()
-    average_df.rename(columns={'index': 'Descriptor'}, inplace=True)
+    average_df = pd.DataFrame({'Descriptor': wine_descriptors,
+                               'Average Position': average_values.loc[wine_descriptors].to_numpy()})
 
-    # create plots & save
-    create_radar_plot(average_df, title, user_id, save_path)
+    # create plot
+    return create_radar_plot(average_df, title)
 
 def create_intro_paragraph(user_data):
     """
@@ -336,8 +490,7 @@ def create_profile_text(user_data):
     
     return profile_text  
 
-def create_user_profiles_elements(user_data, user_red_cat, 
-                                  user_white_cat, user_id):    
+def create_user_profiles_elements(user_data, user_red_cat, user_white_cat):    
     """
     Function that creates corresponding users elements to complete recommendation pdf.
 
@@ -345,30 +498,22 @@ def create_user_profiles_elements(user_data, user_red_cat,
         user_data: users wine profile.
         user_red_cat (dataframe): users red wine catalogue. 
         user_white_cat  (dataframe): users white wine catalogue.
-        user_id (str): User identification reference.
 
     Returns: 
-       report_tmp (str): path where temporal elements are created
-       title_red (str): red wines profile plot filename.
-       title_white (str): white wines profile plot filename.
+       red_image (io.BytesIO): red wines profile plot as png.
+       white_image (io.BytesIO): white wines profile plot as png.
        markdown_text (str) : introductory user profile text to add to pdf
     """   
 
-    # create new folder to save temporal elements
-    report_tmp = "../report_tmp"
-    os.makedirs(report_tmp, exist_ok=True)
- 
-        
-    # 2- create red / white wines profiling graphs
-    title_red = f"red_wine_profile"
-    create_wine_profile_plots(user_red_cat, title_red, user_id , report_tmp)
-    title_white = f"white_wine_profile"
-    create_wine_profile_plots(user_white_cat,title_white, user_id , report_tmp)
+    # 1- create red / white wines profiling graphs (in memory), from materialized profiles if up to date
+    profiles = upv.get_user_profile(user_data)
+    red_image = create_wine_profile_plots(user_red_cat, "red_wine_profile", profiles.get("red"))
+    white_image = create_wine_profile_plots(user_white_cat, "white_wine_profile", profiles.get("white"))
     
-    # 3 - create text in markdown
+    # 2 - create text in markdown
     markdown_text = create_profile_text(user_data)
     
-    return report_tmp, title_red, title_white, markdown_text
+    return red_image, white_image, markdown_text
 
 def parse_markdown_table(text):
     """
@@ -404,6 +549,9 @@ def format_table(table_data):
     Returns:
        Formate table
     """   
+    from reportlab.lib import colors
+    from reportlab.platypus import Table, TableStyle
+
     table = Table(table_data)
     table.setStyle(TableStyle([
         ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor("#c6dcec")),  # Header row background
@@ -426,6 +574,10 @@ def parse_markdown_text(markdown_texts, styles):
     Returns:
        Formate text as need.
     """   
+    from reportlab.platypus import Paragraph, Spacer
+    from markdown2 import markdown  # Use markdown2 for better HTML conversion
+    from bs4 import BeautifulSoup  # Use BeautifulSoup for parsing HTML
+
     story = []
     for markdown_text in markdown_texts:
         # Convert Markdown to HTML
@@ -458,12 +610,15 @@ def create_image_table(image1_path, image2_path):
     Function that create an image table to visualize both wine types plots side by side.
 
     Parameters:
-        image1_path (str):  first image path
-        image2_path (str) : second image path.
+        image1_path (str or io.BytesIO):  first image path or in-memory image.
+        image2_path (str or io.BytesIO) : second image path or in-memory image.
 
     Returns:
        an image table to visualize both wine types plots side by side.
     """   
+    from reportlab.lib.units import inch
+    from reportlab.platypus import Image as PlatypusImage, Table, TableStyle
+
     image_height = 2 * inch
     image_width = 3.5 * inch
 
@@ -509,7 +664,7 @@ def create_comparative_plot_title (type, solution_df):
 
     return title
 
-def create_comparative_plots(user_data, solution_red, solution_white, save_path):
+def create_comparative_plots(user_data, solution_red, solution_white):
     
     """
     Function that generates comparative radar plots.
@@ -518,84 +673,53 @@ def create_comparative_plots(user_data, solution_red, solution_white, save_path)
         user_data: users wine profile.
         solution_red: red wine recomendation if correspond.
         solution_white: white wine recommendation if correspond.
-        save_path: path where to save the plots.
 
     Returns:
-       creates plot and returns
-       red_png_title (str): title of generated comparative red wines plot.
-       white_png_title (str): title of generated comparative white wines plot.
+       red_image (io.BytesIO): comparative red wines plot as png. None if not recommended.
+       white_image (io.BytesIO): comparative white wines plot as png. None if not recommended.
     """   
 
-    red_png_title = ""
-    white_png_title = ""
-    current_date_str = datetime.now().strftime("%Y-%m-%d")
-    if user_data["distribution"] == "equal":
+    red_image = None
+    white_image = None
+    if user_data["distribution"] in ["equal", "more_red"]:
 
         # red wines comparative plot
+        df_red = wcat.get_catalogue("red", profile_cols)
         title = create_comparative_plot_title ("red", solution_red)
-        red_png_title = f"Red_comparation_{user_data['user']}_{current_date_str}.png"
-        create_comparative_radar_plot(df_red.loc[solution_red["Selected"][0]],
-                                      df_red.loc[solution_red["Nearest"][0]],
-                                      title, save_path, red_png_title)
-        # white wines comparative plot
-        title = create_comparative_plot_title ("white", solution_white)
-        white_png_title = f"White_comparation_{user_data['user']}_{current_date_str}.png"
-        create_comparative_radar_plot(df_white.loc[solution_white["Selected"][0]],
-                                      df_white.loc[solution_white["Nearest"][0]],
-                                      title, save_path, white_png_title)
-
-    elif user_data["distribution"] == "more_white":
+        red_image = create_comparative_radar_plot(
+            df_red.loc[[solution_red["Selected"][0], solution_red["Nearest"][0]]], title)
+    if user_data["distribution"] in ["equal", "more_white"]:
 
         # white wines comparative plot
+        df_white = wcat.get_catalogue("white", profile_cols)
         title = create_comparative_plot_title ("white", solution_white)
-        white_png_title = f"White_comparation_{user_data['user']}_{current_date_str}.png"
-        create_comparative_radar_plot(df_white.loc[solution_white["Selected"][0]],
-                                      df_white.loc[solution_white["Nearest"][0]],
-                                      title, save_path, white_png_title)
-    else:
+        white_image = create_comparative_radar_plot(
+            df_white.loc[[solution_white["Selected"][0], solution_white["Nearest"][0]]], title)
+    return red_image, white_image
 
-        # red wines comparative plot
-        title = create_comparative_plot_title ("red", solution_red)
-        red_png_title = f"Red_comparation_{user_data['user']}_{current_date_str}.png"
-        create_comparative_radar_plot(df_red.loc[solution_red["Selected"][0]],
-                                      df_red.loc[solution_red["Nearest"][0]],
-                                      title, save_path, red_png_title)
-    return red_png_title, white_png_title
-
-def add_images_based_on_distribution(story, user_data, report_tmp, red_png_title, white_png_title):
+def add_images_based_on_distribution(story, user_data, red_image, white_image):
     """
     Function to add images based on the user's distribution preference.
     
     Parameters:
         story (list): The list of story elements for the PDF.
         user_data (dict): User's data including distribution preference.
-        report_tmp (str): Path to the temporary report directory.
-        red_png_title (str): Filename for the red wine comparison image.
-        white_png_title (str): Filename for the white wine comparison image.
+        red_image (io.BytesIO): Red wine comparison image.
+        white_image (io.BytesIO): White wine comparison image.
     """
+    from reportlab.lib.units import inch
+    from reportlab.platypus import Image as PlatypusImage, Spacer
+
     if user_data["distribution"] == "equal":
         # Add both images as a table
-        comp_image1_path = os.path.join(report_tmp, red_png_title)
-        comp_image2_path = os.path.join(report_tmp, white_png_title)
-        story.append(create_image_table(comp_image1_path, comp_image2_path))
+        story.append(create_image_table(red_image, white_image))
     
-    elif user_data["distribution"] == "more_red":
-        # red path
-        comp_image1_path = os.path.join(report_tmp, red_png_title)
-        image_height = 3 * inch
-        image_width = 5.5 * inch
-
-        image1 = PlatypusImage(comp_image1_path)
-        image1.drawHeight = image_height
-        image1.drawWidth = image_width
-        story.append(image1)
     else:
-        # red path
-        comp_image1_path = os.path.join(report_tmp, white_png_title)
+        # red or white image
         image_height = 3 * inch
         image_width = 5.5 * inch
 
-        image1 = PlatypusImage(comp_image1_path)
+        image1 = PlatypusImage(red_image if user_data["distribution"] == "more_red" else white_image)
         image1.drawHeight = image_height
         image1.drawWidth = image_width
         story.append(image1)
@@ -603,7 +727,8 @@ def add_images_based_on_distribution(story, user_data, report_tmp, red_png_title
     story.append(Spacer(1, 12))  # Add space after images
 
 def create_recomendation_pdf(user_data, user_red_cat, user_white_cat, user_id, 
-                              solution_red, solution_white, recommendation_text):
+                              solution_red, solution_white, recommendation_text,
+                              pdf_path=None, report_key=None):
     """
     Function that generates elements to add to pdf and compose report pdf.
     Elements created to add: 
@@ -611,6 +736,7 @@ def create_recomendation_pdf(user_data, user_red_cat, user_white_cat, user_id,
      - Corresponding radar plots for each wine type profile of user.
      - Recommendation markdown text, comparing reference wine with recommended one.
      - Recommendation comparative radar plots.     
+    Plots are rendered in memory, nothing but the PDF is written to disk.
 
     Parameters:
         user_data (dict): User's wine profile.
@@ -620,27 +746,36 @@ def create_recomendation_pdf(user_data, user_red_cat, user_white_cat, user_id,
         solution_red: Red wine recommendation, if applicable.
         solution_white: White wine recommendation, if applicable.
         recommendation_text (str): Recommendation text to add to recommendation pdf.
+        pdf_path (str): Path where the PDF is saved. "../report" if None.
+        report_key (str): Recommendation cache key (see recommendation_cache_functions.recommendation_key),
+            added to the file name so that reports of other distances, modes or catalogues are not overwritten.
 
     Returns:
         str: Path to the generated recommendation PDF.
     """   
-    # Create temporal data
-    report_tmp, title_red, title_white, markdown_text = create_user_profiles_elements(
-        user_data, user_red_cat, user_white_cat, user_id
+    # PDF libraries are only needed to create reports
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.platypus import SimpleDocTemplate, PageBreak, Spacer
+
+    # Create profile plots and text
+    red_image, white_image, markdown_text = create_user_profiles_elements(
+        user_data, user_red_cat, user_white_cat
     )
 
     # Create corresponding comparative radar plots
-    red_png_title, white_png_title = create_comparative_plots(
-        user_data, solution_red, solution_white, report_tmp
+    red_comparative_image, white_comparative_image = create_comparative_plots(
+        user_data, solution_red, solution_white
     )
 
     # Create a folder to save the last report
-    pdf_path = report_tmp.rsplit('_tmp', 1)[0]
+    pdf_path = pdf_path or "../report"
     os.makedirs(pdf_path, exist_ok=True)
     
     # Create pdf file name
     current_date_str = datetime.now().strftime("%Y-%m-%d")
-    pdf_filename = f"user_{user_id}_recomendation_{current_date_str}.pdf"
+    key_suffix = f"_{report_key[:12]}" if report_key is not None else ""
+    pdf_filename = f"user_{user_id}_recomendation_{current_date_str}{key_suffix}.pdf"
     
     # Create a PDF canvas    
     output_file = os.path.join(pdf_path, pdf_filename)
@@ -653,11 +788,7 @@ def create_recomendation_pdf(user_data, user_red_cat, user_white_cat, user_id,
     story.append(Spacer(1,12))
     
     # Add user profile images
-    image1_name = f"{title_red}_user_{str(user_id)}.png"
-    image2_name = f"{title_white}_user_{str(user_id)}.png"
-    image1_path = os.path.join(report_tmp, image1_name)
-    image2_path = os.path.join(report_tmp, image2_name)
-    story.append(create_image_table(image1_path, image2_path))
+    story.append(create_image_table(red_image, white_image))
  
     # Insert a page break 
     story.append(PageBreak())
@@ -666,7 +797,7 @@ def create_recomendation_pdf(user_data, user_red_cat, user_white_cat, user_id,
     story.extend(parse_markdown_text(recommendation_text, styles))
 
     # Add comparative images based on the user's distribution
-    add_images_based_on_distribution(story, user_data, report_tmp, red_png_title, white_png_title)
+    add_images_based_on_distribution(story, user_data, red_comparative_image, white_comparative_image)
 
     # Build the PDF
     doc.build(story)
@@ -689,78 +820,45 @@ def key_from_value(value):
             return key
 
 
-def create_comparative_radar_plot(row, row2, title, save_path, image_title):
+def comparative_summary_text(row, row2):
     """
-    Function that plots radar or spider plot according to wine profile.
-    
+    Function that writes the descriptors of a reference and a nearest wine side by side.
+
     Parameters:
         row (pd.DataFrame row): row corresponding to a reference wine profile.
         row2 (pd.DataFrame row): row corresponding to a nearest wine profile.
-        title (str): title to assign to the plot.
-        save_path (str): path where to save the plot.
-        image_title (str): title to assign to the plot.
 
     Returns:
-       plots comparative radar plots between two similar wines.
-    """  
-
-    # Prepare categories and corresponding values
-    categories = ['Sweetness', 'Nuance', 'Tannicity', 'Body', 'Vibrancy']    
+       str: summary text (mathtext bold descriptor names).
+    """
+    return "\n".join([
+        f"$\\bf{{{cat}}}$ " + 
+        f":\n{row[cat]} vs {row2[cat]}\n" + 
+        f"(V:{round(row[key_from_value(cat)], 2)}) vs (V:{round(row2[key_from_value(cat)], 2)})"
+        for cat in wine_descriptors
+    ])
 
-    # reference
-    values = [map_value_to_position(key, row[key]) for key in categories]
-    values += values[:1]  # Repeat the first value at the end to close the circle
+def create_comparative_radar_plot(wines, title):
+    """
+    Function that plots radar or spider plot according to wine profile.
     
-    # nearest
-    values1 = [map_value_to_position(key, row2[key]) for key in categories]
-    values1 += values1[:1]  # Repeat the first value at the end to close the circle
+    Parameters:
+        wines (pd.DataFrame): reference wine profile (first row) and nearest wine profile (second row).
+        title (str): title to assign to the plot.
 
-    # Calculate angles for the plot
-    N = len(categories)
-    angles = [n / float(N) * 2 * pi for n in range(N)]
-    angles += angles[:1]  # Close the loop
+    Returns:
+       io.BytesIO: comparative radar plots between two similar wines as png.
+    """  
+    template = get_radar_template("comparative")
 
-    # Start creating the radar plot
-    fig, ax = plt.subplots(1, 2, figsize=(10, 5), subplot_kw=dict(polar=True))  # Adjust figure size
+    # Plot the radar charts: reference and nearest (descriptor categorical codes)
+    positions = wpf.descriptor_codes(wines, wine_descriptors).to_numpy()
+    set_radar_values(template["reference_line"], template["reference_area"], positions[0].tolist())
+    set_radar_values(template["nearest_line"], template["nearest_area"], positions[1].tolist())
 
-    # Draw one axis per variable and add labels
-    ax[0].set_xticks(angles[:-1])
-    ax[0].set_xticklabels(categories, size=15)
-
-    # Draw y-labels (customizable based on your data scale)
-    ax[0].set_rlabel_position(30)
-    plt.yticks([0, 1, 2], ["0", "1", "2"], color="grey", size=7)
-    plt.ylim(0, 2)  # Adjust depending on your value range 
-
-    # Plot the radar charts
-    # reference
-    ax[0].plot(angles, values, linewidth=2, linestyle='solid', label="reference")
-    ax[0].fill(angles, values, alpha=0.25)  # Fill area under the graph
-    # nearest
-    ax[0].plot(angles, values1, linewidth=2, linestyle='solid', label="nearest")
-    ax[0].fill(angles, values1, alpha=0.25)  
-    ax[0].legend()
+    # Add summary text and title
+    template["summary"].set_text(comparative_summary_text(wines.iloc[0], wines.iloc[1]))
+    template["title"].set_text(title)
 
-    # Summary on the right side
-    ax[1].axis('off')  # Turn off the axis
-
-    # Add summary text, moving it further to the left    
-    summary_text = "\n".join([
-        f"$\\bf{{{cat}}}$ " + 
-        f":\n{row[cat]} vs {row2[cat]}\n" + 
-        f"(V:{round(row[key_from_value(cat)], 2)}) vs (V:{round(row2[key_from_value(cat)], 2)})"
-        for i, cat in enumerate(categories)
-    ])
-    ax[1].text(-0.1, 0.08, summary_text, fontsize=16, ha='left', va='center', wrap=True) 
-    
-    # Adjust layout for minimal spacing
-    plt.subplots_adjust(top=0.85, wspace=0.01, left=0.01, right=0.99)  # Minimal horizontal spacing
-    
-    # Set title for the radar plot
-    fig.suptitle(title, size=20, color='navy', y=0.95) 
-    plt.tight_layout(rect=[0, 0, 1, 0.95])  
-    #plt.show()
-
-    # save file
-    plt.savefig(os.path.join(save_path, image_title), bbox_inches='tight', pad_inches=0.5)
-    
\ No newline at end of file
+    # render in memory
+    return figure_to_buffer(template["figure"])
@@ -0,0 +1,228 @@
+# user profile view functions
+import os
+import json
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from modules import wine_catalogue_functions as wcat
+from modules import wine_profile_functions as wpf
+from modules import wine_search_functions as wsf
+from modules import wine_recommendation_functions as wrf
+from modules import recommendation_cache_functions as rcf
+from modules import user_store_functions as usf
+
+# materialized user profiles filename (inside data folder)
+profile_view_file = "user_profiles.parquet"
+
+# loaded view: file version, catalogue hashes it was built with and profiles indexed by user and wine type
+loaded_view = {}
+
+# 64 bit mixing constants of row signatures
+signature_multipliers = (np.uint64(0xBF58476D1CE4E5B9), np.uint64(0x94D049BB133111EB))
+
+
+def mix_rows(rows):
+    """
+    Function that scrambles catalogue row numbers into 64 bit values (splitmix64 finalizer).
+
+    Parameters:
+        rows (array-like): catalogue rows.
+
+    Returns:
+        np.array: uint64 mixed value of each row.
+    """
+    z = np.asarray(rows, dtype=np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+    z = (z ^ (z >> np.uint64(30))) * signature_multipliers[0]
+    z = (z ^ (z >> np.uint64(27))) * signature_multipliers[1]
+    return z ^ (z >> np.uint64(31))
+
+
+def rows_signature(rows):
+    """
+    Function that computes the order independent signature of a user's catalogue rows.
+    It changes when the user's wines change, so stale profiles are detected.
+
+    Parameters:
+        rows (array-like): catalogue rows of a user and wine type.
+
+    Returns:
+        int: signed 64 bit signature.
+    """
+    return int(mix_rows(rows).sum(dtype=np.uint64).view(np.int64))
+
+
+def build_wine_type_profiles(conn, wine_type):
+    """
+    Function that computes every user's profile of a wine type in one pass: user wines are joined
+    to catalogue descriptor codes and scaled features, and grouped by user.
+
+    Parameters:
+        conn (sqlite3.Connection): user store connection.
+        wine_type (str): "red" or "white".
+
+    Returns:
+        profiles (dataframe): one row per user with wines of this type: user_key, wine_type, n_wines,
+        favorite_zone, rows_signature, mean descriptor positions, mean scaled features and number of
+        wines per zone. None if no user has wines of this type.
+    """
+    wines = usf.get_user_wines_table(conn, wine_type) # ordered by user key
+    if len(wines) == 0:
+        return None
+    user_keys, starts, counts = np.unique(wines["user_key"].to_numpy(), return_index=True, return_counts=True)
+    rows = wines["row"].to_numpy()
+
+    # descriptor positions and scaled features of every user wine
+    catalogue = wcat.get_catalogue(wine_type, wpf.wine_descriptors)
+    codes = wpf.descriptor_codes(catalogue).to_numpy()[catalogue.index.get_indexer(rows)]
+    engine = wrf.get_search_engine(wine_type)
+    features = engine["matrix"][engine["labels"].get_indexer(rows)]
+
+    # per user sums (wines are grouped by user key)
+    descriptor_means = np.add.reduceat(codes.astype(np.float64), starts, axis=0) / counts[:, None]
+    feature_means = np.add.reduceat(features, starts, axis=0) / counts[:, None]
+    signatures = np.add.reduceat(mix_rows(rows), starts).view(np.int64)
+
+    # zone histogram and favourite zone (first zone with most wines)
+    zones = wcat.get_cluster_table(wine_type)["Zone"].tolist()
+    zone_codes = pd.Categorical(wines["zone"].astype(str), categories=zones).codes.astype(np.int64)
+    user_pos = np.repeat(np.arange(len(user_keys)), counts)
+    histogram = np.bincount(user_pos * len(zones) + zone_codes,
+                            minlength=len(user_keys) * len(zones)).reshape(len(user_keys), len(zones))
+
+    profiles = pd.DataFrame({"user_key": user_keys, "wine_type": wine_type, "n_wines": counts.astype(np.int32),
+                             "favorite_zone": np.asarray(zones)[histogram.argmax(axis=1)],
+                             "rows_signature": signatures})
+    profiles[wpf.wine_descriptors] = descriptor_means.astype(np.float32)
+    profiles[wsf.scaled_cols] = feature_means
+    profiles[zones] = histogram.astype(np.int32)
+    return profiles
+
+
+def build_user_profiles(conn):
+    """
+    Function that materializes every user's red and white profiles.
+
+    Parameters:
+        conn (sqlite3.Connection): user store connection.
+
+    Returns:
+        profiles (dataframe): one row per user and wine type (see build_wine_type_profiles) with user id.
+    """
+    profiles = [build_wine_type_profiles(conn, wine_type) for wine_type in ["red", "white"]]
+    profiles = [p for p in profiles if p is not None]
+    if len(profiles) == 0:
+        # no user has wines: empty view with the same columns
+        zones = sorted(set(zone for wine_type in ["red", "white"] for zone in wcat.get_cluster_table(wine_type)["Zone"]))
+        profiles.append(pd.DataFrame({"user_key": pd.Series(dtype=np.int32),
+                                      "wine_type": pd.Series(dtype=str),
+                                      "n_wines": pd.Series(dtype=np.int32),
+                                      "favorite_zone": pd.Series(dtype=str),
+                                      "rows_signature": pd.Series(dtype=np.int64),
+                                      **{col: pd.Series(dtype=np.float32) for col in wpf.wine_descriptors},
+                                      **{col: pd.Series(dtype=np.float64) for col in wsf.scaled_cols},
+                                      **{zone: pd.Series(dtype=np.int32) for zone in zones}}))
+    profiles = pd.concat(profiles, ignore_index=True)
+
+    # zone counts of zones not present in a wine type catalogue are 0
+    zone_cols = [col for col in profiles.columns if col.startswith("Zone_")]
+    profiles[zone_cols] = profiles[zone_cols].fillna(0).astype(np.int32)
+    profiles["wine_type"] = profiles["wine_type"].astype("category")
+    profiles["favorite_zone"] = profiles["favorite_zone"].astype("category")
+
+    users = usf.get_users_table(conn)[["user_key", "user"]].astype({"user_key": np.int64, "user": str}) # typed if empty
+    profiles = users.merge(profiles, on="user_key")
+    return profiles.sort_values(["user_key", "wine_type"], ignore_index=True)
+
+
+def save_user_profiles(path, profiles):
+    """
+    Function that saves the materialized user profiles, with the content hash of the catalogues
+    they were built with.
+
+    Parameters:
+        path (str): path to data.
+        profiles (dataframe): user profiles (see build_user_profiles).
+
+    Returns:
+        str: saved file path.
+    """
+    table = pa.Table.from_pandas(profiles, preserve_index=False)
+    catalogues = {wine_type: rcf.catalogue_content_hash(wine_type) for wine_type in wcat.catalogue_files}
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}),
+                                           b"catalogues": json.dumps(catalogues).encode()})
+    file_path = os.path.join(path, profile_view_file)
+    pq.write_table(table, f"{file_path}.tmp")
+    os.replace(f"{file_path}.tmp", file_path)
+    return file_path
+
+
+def materialize_user_profiles(path):
+    """
+    Function that builds and saves the user profiles of the user store.
+
+    Parameters:
+        path (str): path to data.
+
+    Returns:
+        profiles (dataframe): user profiles (see build_user_profiles).
+    """
+    user_store = usf.connect_user_store(path)
+    profiles = build_user_profiles(user_store)
+    user_store.close()
+    save_user_profiles(path, profiles)
+    return profiles
+
+
+def get_user_profiles():
+    """
+    Function that returns the materialized user profiles of the data folder. They are read once per
+    file version and ignored if either catalogue changed since they were built.
+
+    Returns:
+        profiles (dataframe): user profiles indexed by user and wine type. None if not available.
+    """
+    file_path = os.path.join(wcat.get_data_root(), profile_view_file)
+    if not os.path.exists(file_path):
+        return None
+
+    stat = os.stat(file_path)
+    version = (stat.st_mtime_ns, stat.st_size)
+    if loaded_view.get("version") != version:
+        table = pq.read_table(file_path)
+        loaded_view.update(version=version,
+                           catalogues=json.loads(table.schema.metadata[b"catalogues"]),
+                           profiles=table.to_pandas().set_index(["user", "wine_type"]).sort_index())
+
+    for wine_type, content_hash in loaded_view["catalogues"].items():
+        if rcf.catalogue_content_hash(wine_type) != content_hash:
+            return None
+    return loaded_view["profiles"]
+
+
+def get_user_profile(user_data):
+    """
+    Function that returns a user's materialized profiles that are still valid for the user record
+    (same wines as when they were built).
+
+    Parameters:
+        user_data (dict): user wine distribution configuration.
+
+    Returns:
+        dict: wine type -> profile (pd.Series). Wine types without valid profile are missing.
+    """
+    profiles = get_user_profiles()
+    if profiles is None:
+        return {}
+
+    user_profiles = {}
+    for wine_type in ["red", "white"]:
+        key = (str(user_data["user"]), wine_type)
+        if key not in profiles.index:
+            continue
+        profile = profiles.loc[key]
+        rows = [row for zone in user_data[f"{wine_type}_distribution"]
+                for k, values in zone.items() if k.endswith("_rows") for row in values]
+        if rows_signature(rows) == profile["rows_signature"]:
+            user_profiles[wine_type] = profile
+    return user_profiles
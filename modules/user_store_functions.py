@@ -0,0 +1,404 @@
+# user store functions
+import os
+import json
+import sqlite3
+import numpy as np
+import pandas as pd
+from modules import user_id_functions as uif
+
+# user store filename (inside data folder)
+store_file = "users.sqlite"
+
+# user store schema: users (integer surrogate key, unique user id, index on distribution),
+# wines per zone and user wines (keyed by user key), and the user key counter
+store_schema = """
+CREATE TABLE IF NOT EXISTS users (
+    user_key INTEGER PRIMARY KEY,
+    user TEXT NOT NULL UNIQUE,
+    distribution TEXT NOT NULL,
+    wine_qty INTEGER NOT NULL,
+    how_more INTEGER NOT NULL,
+    red_wines INTEGER NOT NULL,
+    white_wines INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS users_distribution ON users (distribution);
+CREATE TABLE IF NOT EXISTS user_zones (
+    user_key INTEGER NOT NULL,
+    wine_type TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    zone TEXT NOT NULL,
+    qty INTEGER NOT NULL,
+    PRIMARY KEY (user_key, wine_type, position)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS user_wines (
+    user_key INTEGER NOT NULL,
+    wine_type TEXT NOT NULL,
+    zone TEXT NOT NULL,
+    row INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS user_wines_user ON user_wines (user_key, wine_type);
+CREATE TABLE IF NOT EXISTS user_key_counter (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    next_key INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO user_key_counter VALUES (0, 0);
+"""
+
+# users table columns
+user_cols = ["user", "distribution", "wine_qty", "how_more", "red_wines", "white_wines"]
+
+
+def connect_user_store(path):
+    """
+    Function that opens (and creates if needed) the user store of a data folder.
+    Write-ahead logging lets readers (e.g. recommendations) work while users are written.
+
+    Parameters:
+        path (str): path to data.
+
+    Returns:
+        conn (sqlite3.Connection): user store connection.
+    """
+    conn = sqlite3.connect(os.path.join(path, store_file))
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(store_schema)
+    return conn
+
+
+def open_user_store(path, json_file="users_wine_delivery_conf.json"):
+    """
+    Function that opens the user store of a data folder, importing the users json file
+    (previous format) if the store does not exist yet.
+
+    Parameters:
+        path (str): path to data.
+        json_file (str): users wine distribution json filename.
+
+    Returns:
+        conn (sqlite3.Connection): user store connection.
+    """
+    exists = os.path.exists(os.path.join(path, store_file))
+    conn = connect_user_store(path)
+    if not exists and os.path.exists(os.path.join(path, json_file)):
+        import_user_json(conn, path, json_file)
+    return conn
+
+
+def clear_user_store(conn):
+    """
+    Function that deletes all users of the user store (e.g. before a new users simulation).
+
+    Parameters:
+        conn (sqlite3.Connection): user store connection.
+    """
+    with conn:
+        for table in ["user_wines", "user_zones", "users"]:
+            conn.execute(f"DELETE FROM {table}")
+
+
+def allocate_user_keys(conn, n_keys):
+    """
+    Function that reserves consecutive user keys from the store counter (never reused, even if
+    users are deleted). Opaque user ids are derived from keys, so they are unique without any check.
+    The range is reserved by a single counter update, so concurrent writers never get the same keys.
+
+    Parameters:
+        conn (sqlite3.Connection): user store connection.
+        n_keys (int): number of keys to reserve.
+
+    Returns:
+        np.array: reserved user keys.
+    """
+    with conn:
+        next_key = conn.execute("UPDATE user_key_counter SET next_key = next_key + ? RETURNING next_key",
+                                (n_keys,)).fetchone()[0]
+        if next_key > min(10 ** uif.id_digits, 2 ** 31):
+            raise ValueError("User id space exhausted, increase user_id_functions.id_digits") # rolled back
+    return np.arange(next_key - n_keys, next_key)
+
+
+def delete_user_wines(conn, user_keys):
+    """
+    Function that deletes zones and wines of users (before writing them again).
+
+    Parameters:
+        conn (sqlite3.Connection): user store connection.
+        user_keys (list(int)): users key.
+    """
+    conn.executemany("DELETE FROM user_zones WHERE user_key = ?", [(user_key,) for user_key in user_keys])
+    conn.executemany("DELETE FROM user_wines WHERE user_key = ?", [(user_key,) for user_key in user_keys])
+
+
+def get_user_keys(conn, user_ids):
+    """
+    Function that gets the user key of users id (unique index lookups).
+
+    Parameters:
+        conn (sqlite3.Connection): user store connection.
+        user_ids (list(str)): users id.
+
+    Returns:
+        dict: user key of each user id found in the store.
+    """
+    keys = {}
+    for user_id in user_ids:
+        row = conn.execute("SELECT user_key FROM users WHERE user = ?", (user_id,)).fetchone()
+        if row is not None:
+            keys[user_id] = row[0]
+    return keys
+
+
+def put_users(conn, user_list):
+    """
+    Function that inserts or updates users wine distribution configuration (one transaction).
+    Existing users keep their user key, new users get new keys.
+
+    Parameters:
+        conn (sqlite3.Connection): user store connection.
+        user_list (list[dict]): users wine distribution configuration (json format).
+    """
+    # last configuration of repeated users
+    user_list = list({str(d["user"]): d for d in user_list}.values())
+
+    keys = get_user_keys(conn, [str(d["user"]) for d in user_list])
+    new_users = [str(d["user"]) for d in user_list if str(d["user"]) not in keys]
+    keys.update(zip(new_users, allocate_user_keys(conn, len(new_users)).tolist()))
+
+    users, zones, wines = [], [], []
+    for d in user_list:
+        user_key = keys[str(d["user"])]
+        users.append((user_key, str(d["user"])) + tuple(d[col] for col in user_cols[1:]))
+        for wine_type in ["red", "white"]:
+            for position, zone_dict in enumerate(d[f"{wine_type}_distribution"]):
+                zone = [key for key in zone_dict if "_rows" not in key][0]
+                zones.append((user_key, wine_type, position, zone, int(zone_dict[zone])))
+                wines.extend((user_key, wine_type, zone, int(row)) for row in zone_dict[f"{zone}_rows"])
+
+    # existing users are updated in place, new users (newly reserved keys) are inserted
+    new_keys = set(keys[user] for user in new_users)
+    with conn:
+        delete_user_wines(conn, [user[0] for user in users])
+        conn.executemany(f"UPDATE users SET {', '.join(f'{col} = ?' for col in user_cols[1:])} WHERE user_key = ?",
+                         [user[2:] + (user[0],) for user in users if user[0] not in new_keys])
+        conn.executemany(f"INSERT INTO users (user_key, {', '.join(user_cols)}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                         [user for user in users if user[0] in new_keys])
+        conn.executemany("INSERT INTO user_zones VALUES (?, ?, ?, ?, ?)", zones)
+        conn.executemany("INSERT INTO user_wines VALUES (?, ?, ?, ?)", wines)
+
+
+def put_simulation(conn, simulation):
+    """
+    Function that bulk inserts a columnar users simulation (see
+    user_wine_distribution_functions.simulate_users) without building per user dictionaries.
+    Users get new keys (and ids) from the store counter, updated in the simulation.
+
+    Parameters:
+        conn (sqlite3.Connection): user store connection.
+        simulation (dict): columnar users simulation.
+    """
+    user_keys = allocate_user_keys(conn, len(simulation["users"]))
+    simulation["users"] = simulation["users"].assign(user_key=user_keys, user=uif.user_ids_from_keys(user_keys))
+    users = simulation["users"]
+
+    zones = []
+    for wine_type in ["red", "white"]:
+        counts = simulation["zone_counts"][wine_type]
+        n_zones = counts.shape[1]
+        zones.append(pd.DataFrame({"user_key": np.repeat(user_keys, n_zones),
+                                   "wine_type": wine_type,
+                                   "position": np.tile(np.arange(n_zones), len(counts)),
+                                   "zone": np.tile(simulation["zones"][wine_type], len(counts)),
+                                   "qty": counts.ravel()}))
+    zones = pd.concat(zones, ignore_index=True)
+
+    assignments = simulation["assignments"]
+    wines = pd.DataFrame({"user_key": user_keys[assignments["user_idx"].to_numpy()],
+                          "wine_type": assignments["wine_type"].astype(str),
+                          "zone": assignments["zone"].astype(str),
+                          "row": assignments["row"]})
+
+    with conn:
+        conn.executemany(f"INSERT INTO users (user_key, {', '.join(user_cols)}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                         table_rows(users[["user_key"] + user_cols]))
+        conn.executemany("INSERT INTO user_zones VALUES (?, ?, ?, ?, ?)", table_rows(zones))
+        conn.executemany("INSERT INTO user_wines VALUES (?, ?, ?, ?)", table_rows(wines))
+
+
+def table_rows(df):
+    """
+    Function that iterates dataframe rows as tuples of python values (faster than itertuples
+    for string columns).
+
+    Parameters:
+        df (dataframe): table to iterate.
+
+    Returns:
+        iterator of row tuples.
+    """
+    return zip(*(df[col].to_numpy(dtype=object).tolist() for col in df.columns))
+
+
+def import_user_json(conn, path, json_file="users_wine_delivery_conf.json"):
+    """
+    Function that imports users from the users wine distribution json file.
+
+    Parameters:
+        conn (sqlite3.Connection): user store connection.
+        path (str): path to users distribution json.
+        json_file (str): users wine distribution json filename.
+    """
+    with open(os.path.join(path, json_file), 'r') as users_file:
+        put_users(conn, json.load(users_file))
+
+
+def get_user(conn, user_id):
+    """
+    Function that gets a user wine distribution configuration by id (primary key lookup).
+
+    Parameters:
+        conn (sqlite3.Connection): user store connection.
+        user_id (str): user id.
+
+    Returns:
+        user_data (dict): user wine distribution configuration (json format), None if not found.
+    """
+    user = conn.execute(f"SELECT user_key, {', '.join(user_cols)} FROM users WHERE user = ?",
+                        (str(user_id),)).fetchone()
+    if user is None:
+        return None
+    user_key = user[0]
+    user_data = dict(zip(user_cols, user[1:]))
+
+    # wines per zone, in zone order
+    wines = {}
+    for wine_type, zone, row in conn.execute("SELECT wine_type, zone, row FROM user_wines "
+                                             "WHERE user_key = ? ORDER BY rowid", (user_key,)):
+        wines.setdefault((wine_type, zone), []).append(row)
+
+    user_data["red_distribution"], user_data["white_distribution"] = [], []
+    for wine_type, zone, qty in conn.execute("SELECT wine_type, zone, qty FROM user_zones "
+                                             "WHERE user_key = ? ORDER BY wine_type, position", (user_key,)):
+        user_data[f"{wine_type}_distribution"].append({zone: qty, f"{zone}_rows": wines.get((wine_type, zone), [])})
+    return user_data
+
+
+def list_users(conn):
+    """
+    Function that gets all users id.
+
+    Parameters:
+        conn (sqlite3.Connection): user store connection.
+
+    Returns:
+        list(str): all users id.
+    """
+    return [user for (user,) in conn.execute("SELECT user FROM users ORDER BY user_key")]
+
+
+def users_by_distribution(conn, distribution):
+    """
+    Function that gets users id with a wine distribution (secondary index lookup).
+
+    Parameters:
+        conn (sqlite3.Connection): user store connection.
+        distribution (str): "more_red", "more_white" or "equal".
+
+    Returns:
+        list(str): users id.
+    """
+    return [user for (user,) in conn.execute("SELECT user FROM users WHERE distribution = ? ORDER BY user_key",
+                                             (distribution,))]
+
+
+def get_users_table(conn):
+    """
+    Function that gets all users as a table, ordered by user key.
+
+    Parameters:
+        conn (sqlite3.Connection): user store connection.
+
+    Returns:
+        users (dataframe): user_key, user, distribution, wine_qty, how_more, red_wines and white_wines.
+    """
+    return pd.read_sql_query(f"SELECT user_key, {', '.join(user_cols)} FROM users ORDER BY user_key", conn)
+
+
+def get_user_zones_table(conn, wine_type):
+    """
+    Function that gets every user's wines per zone of a wine type as a table.
+
+    Parameters:
+        conn (sqlite3.Connection): user store connection.
+        wine_type (str): "red" or "white".
+
+    Returns:
+        zones (dataframe): user_key, position, zone and qty, ordered by user key and zone position.
+    """
+    return pd.read_sql_query("SELECT user_key, position, zone, qty FROM user_zones WHERE wine_type = ? "
+                             "ORDER BY user_key, position", conn, params=(wine_type,))
+
+
+def remap_user_zones(conn, wine_type, row_zones):
+    """
+    Function that moves every user's wines of a wine type to the zones of a re-clustered catalogue:
+    wines get the zone of their catalogue row and wines per zone are counted again (all zones, in
+    catalogue zone order).
+
+    Parameters:
+        conn (sqlite3.Connection): user store connection.
+        wine_type (str): "red" or "white".
+        row_zones (pd.Series): zone (categorical, categories in zone order) of each catalogue row.
+    """
+    wines = pd.read_sql_query("SELECT rowid, user_key, row FROM user_wines WHERE wine_type = ?",
+                              conn, params=(wine_type,))
+    wines["zone"] = row_zones.reindex(wines["row"]).to_numpy()
+
+    zones = row_zones.cat.categories.tolist()
+    user_keys = pd.read_sql_query("SELECT DISTINCT user_key FROM user_zones WHERE wine_type = ? ORDER BY user_key",
+                                  conn, params=(wine_type,))["user_key"].to_numpy()
+    counts = wines.groupby(["user_key", "zone"]).size()
+    counts = counts.reindex(pd.MultiIndex.from_product([user_keys, zones]), fill_value=0)
+    user_zones = pd.DataFrame({"user_key": np.repeat(user_keys, len(zones)),
+                               "wine_type": wine_type,
+                               "position": np.tile(np.arange(len(zones)), len(user_keys)),
+                               "zone": np.tile(zones, len(user_keys)),
+                               "qty": counts.to_numpy()})
+
+    with conn:
+        conn.executemany("UPDATE user_wines SET zone = ? WHERE rowid = ?",
+                         table_rows(wines[["zone", "rowid"]].astype({"zone": str})))
+        conn.execute("DELETE FROM user_zones WHERE wine_type = ?", (wine_type,))
+        conn.executemany("INSERT INTO user_zones VALUES (?, ?, ?, ?, ?)", table_rows(user_zones))
+
+
+def get_user_wines_table(conn, wine_type):
+    """
+    Function that gets every user's wines of a wine type as a table.
+
+    Parameters:
+        conn (sqlite3.Connection): user store connection.
+        wine_type (str): "red" or "white".
+
+    Returns:
+        wines (dataframe): user_key (int32), zone and catalogue row (int32), ordered by user key.
+    """
+    wines = pd.read_sql_query("SELECT user_key, zone, row FROM user_wines WHERE wine_type = ? "
+                              "ORDER BY user_key, rowid", conn, params=(wine_type,))
+    return wines.astype({"user_key": np.int32, "zone": "category", "row": np.int32})
+
+
+def get_user_wine_arrays(conn, wine_type):
+    """
+    Function that gets every user's wines of a wine type as compact arrays.
+
+    Parameters:
+        conn (sqlite3.Connection): user store connection.
+        wine_type (str): "red" or "white".
+
+    Returns:
+        user_keys (np.array): int32 user key of each user wine.
+        rows (np.array): int32 catalogue row of each user wine.
+    """
+    wines = get_user_wines_table(conn, wine_type)
+    return wines["user_key"].to_numpy(), wines["row"].to_numpy()
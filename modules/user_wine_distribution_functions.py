@@ -1,8 +1,11 @@
 # user wine distribution functions
 import random
+import numpy as np
 import pandas as pd
 import os
 import json
+from modules import wine_catalogue_functions as wcat
+from modules import user_id_functions as uif
 
 def total_wine_distribution ():
     """
@@ -234,45 +237,250 @@ def save_dict_list_json(path, user_list):
         json.dump(user_list, json_file)
 
     
-def wine_delibery_conf (path, filename1, filename2):
+def group_rows_by_zone(df):
     """
-    Function that creates users and save each users wine delivery configuration
+    Function that groups catalogue row indexes by zone (once per catalogue).
+
+    Parameters:
+        df (dataframe): wine catalogue with "Cluster" and "Zone" columns.
+
+    Returns:
+        zone_index (dict): zone index composed by:
+            zones: zone names ordered by cluster number.
+            rows: catalogue row indexes sorted by cluster.
+            bounds: start position of each zone in rows (plus total length).
+    """
+    clusters = df["Cluster"].to_numpy()
+    order = np.argsort(clusters, kind="stable")
+    cluster_numbers, starts = np.unique(clusters[order], return_index=True)
+    zones = [str(zone) for zone in df["Zone"].to_numpy()[order][starts]]
+    return {"zones": zones,
+            "rows": df.index.to_numpy()[order],
+            "bounds": np.append(starts, len(order))}
+
+
+def draw_wine_distribution(rng, n_users):
+    """
+    Function that draws every user red and white wine quantities at once
+    (same rules as total_wine_distribution, wine_quantity, how_more and wine_distribution).
+
+    Parameters:
+        rng (np.random.Generator): random generator.
+        n_users (int): number of users.
+
+    Returns:
+        users (dataframe): distribution, wine_qty, how_more, red_wines and white_wines per user.
+    """
+    choices = np.array(["more_red", "more_white", "equal"])
+    choice = rng.integers(0, 3, n_users)
+    qty = rng.integers(5, 21, n_users)
+    qty2 = rng.integers(1, 6, n_users)
+
+    # total quantity even, and (qty - qty2) even when there are more wines of one type
+    qty = qty + qty % 2
+    equal = choice == 2
+    qty2[equal] = 0
+    qty = qty + (qty - qty2) % 2
+    minin = (qty - qty2) // 2
+    maxim = qty - minin
+
+    more_red = choice == 0
+    return pd.DataFrame({"distribution": choices[choice],
+                         "wine_qty": qty,
+                         "how_more": qty2,
+                         "red_wines": np.where(more_red, maxim, minin),
+                         "white_wines": np.where(more_red, minin, maxim)})
+
+
+def draw_zone_quantities(rng, tot_wines, n_zones):
+    """
+    Function that draws how many wines per zone each user has (as wine_zone_distribution):
+    a balanced base per zone and the remainder spread randomly.
+
+    Parameters:
+        rng (np.random.Generator): random generator.
+        tot_wines (np.array): total wines of a type per user.
+        n_zones (int): number of zones.
+
+    Returns:
+        counts (np.array): n_users x n_zones wines per zone.
+    """
+    remainder = tot_wines % n_zones
+    extra = rng.multinomial(remainder, np.full(n_zones, 1.0 / n_zones))
+    return (tot_wines // n_zones)[:, None] + extra
+
+
+def sample_zone_rows(rng, zone_rows, counts):
+    """
+    Function that samples without replacement wines of a zone for every user at once.
+    Positions are drawn with replacement and repeated ones are redrawn until each user's are unique.
+    Users asking for more wines than the zone has get all of them (as wine_delibery).
+
+    Parameters:
+        rng (np.random.Generator): random generator.
+        zone_rows (np.array): catalogue row indexes of the zone.
+        counts (np.array): wines to sample per user.
+
+    Returns:
+        owners (np.array): user position of each sampled wine, ordered by user.
+        rows (np.array): sampled catalogue row indexes.
+    """
+    n_rows = len(zone_rows)
+    counts = np.minimum(counts, n_rows)
+    owners = np.repeat(np.arange(len(counts)), counts)
+    positions = rng.integers(0, n_rows, len(owners))
+
+    # users with the whole zone take every wine
+    whole = counts[owners] == n_rows
+    if n_rows > 0:
+        positions[whole] = np.arange(whole.sum()) % n_rows
+
+    # each user's wines are contiguous (owners sorted), so only users with repeated positions are checked again
+    starts = np.cumsum(counts) - counts
+    active = np.arange(len(owners))
+    while len(active) > 0:
+        keys = owners[active] * n_rows + positions[active]
+        order = np.argsort(keys, kind="stable")
+        repeated = np.zeros(len(order), dtype=bool)
+        repeated[1:] = keys[order][1:] == keys[order][:-1]
+        redraw = active[order[repeated]]
+        positions[redraw] = rng.integers(0, n_rows, len(redraw))
+
+        users = np.unique(owners[redraw])
+        lengths = counts[users]
+        active = (np.repeat(starts[users] - (np.cumsum(lengths) - lengths), lengths)
+                  + np.arange(lengths.sum()))
+
+    return owners, zone_rows[positions]
+
+
+def simulate_users(df_red, df_white, n_users, seed=None, first_key=0):
+    """
+    Function that simulates users and their wine distribution with batched array operations.
+    Catalogues are grouped by zone once, and the same seed reproduces exactly the same simulation.
+
+    Parameters:
+        df_red (dataframe): red wine catalogue with "Cluster" and "Zone" columns.
+        df_white (dataframe): white wine catalogue with "Cluster" and "Zone" columns.
+        n_users (int): number of users.
+        seed (int): random generator seed. Random run if None.
+        first_key (int): user key of the first user (user ids are derived from user keys).
+
+    Returns:
+        simulation (dict): columnar simulation composed by:
+            seed: seed used.
+            users: one row per user (user_key, user, distribution, wine_qty, how_more, red_wines, white_wines).
+            zones: zone names per wine type.
+            zone_counts: n_users x n_zones wines per zone per wine type.
+            assignments: one row per user wine (user position, wine type, zone and catalogue row).
+    """
+    if seed is None:
+        seed = int(np.random.SeedSequence().entropy % 2 ** 32)
+    rng = np.random.default_rng(seed)
+
+    users = draw_wine_distribution(rng, n_users)
+    user_keys = np.arange(first_key, first_key + n_users)
+    users.insert(0, "user_key", user_keys)
+    users.insert(1, "user", uif.user_ids_from_keys(user_keys))
+
+    wine_types = ["red", "white"]
+    zone_indexes = [group_rows_by_zone(df_red), group_rows_by_zone(df_white)]
+    zone_categories = sorted(set(zone_indexes[0]["zones"]) | set(zone_indexes[1]["zones"]))
+
+    zones, zone_counts, owners, rows, type_codes, zone_codes = {}, {}, [], [], [], []
+    for t, (wine_type, zone_index) in enumerate(zip(wine_types, zone_indexes)):
+        zones[wine_type] = zone_index["zones"]
+        counts = draw_zone_quantities(rng, users[f"{wine_type}_wines"].to_numpy(), len(zone_index["zones"]))
+        zone_counts[wine_type] = counts
+
+        for z, zone in enumerate(zone_index["zones"]):
+            zone_rows = zone_index["rows"][zone_index["bounds"][z]:zone_index["bounds"][z + 1]]
+            zone_owners, zone_selection = sample_zone_rows(rng, zone_rows, counts[:, z])
+            owners.append(zone_owners)
+            rows.append(zone_selection)
+            type_codes.append(np.full(len(zone_owners), t, dtype=np.int8))
+            zone_codes.append(np.full(len(zone_owners), zone_categories.index(zone), dtype=np.int16))
+
+    # order by user (wine type and zone order kept)
+    owners = np.concatenate(owners)
+    order = np.argsort(owners, kind="stable")
+    assignments = pd.DataFrame({
+        "user_idx": owners[order].astype(np.int32),
+        "wine_type": pd.Categorical.from_codes(np.concatenate(type_codes)[order], wine_types),
+        "zone": pd.Categorical.from_codes(np.concatenate(zone_codes)[order], zone_categories),
+        "row": np.concatenate(rows)[order]})
+
+    return {"seed": seed, "users": users, "zones": zones,
+            "zone_counts": zone_counts, "assignments": assignments}
+
+
+def simulation_to_user_list(simulation):
+    """
+    Function that converts a columnar simulation into the users wine delivery configuration list.
+
+    Parameters:
+        simulation (dict): columnar simulation (see simulate_users).
+
+    Returns:
+       user_list: a list of users and its wine delivery configuration
+    """
+    users = simulation["users"]
+    assignments = simulation["assignments"]
+
+    # wines per user, wine type and zone
+    grouped = {key: rows.tolist() for key, rows in
+               assignments.groupby(["user_idx", "wine_type", "zone"], observed=True, sort=False)["row"]}
+
+    user_list = []
+    for i, user in enumerate(users.to_dict("records")):
+        d = {key: (int(value) if isinstance(value, np.integer) else value) for key, value in user.items()
+             if key != "user_key"}
+        for wine_type in ["red", "white"]:
+            d[f"{wine_type}_distribution"] = [
+                {zone: int(simulation["zone_counts"][wine_type][i, z]),
+                 f"{zone}_rows": grouped.get((i, wine_type, zone), [])}
+                for z, zone in enumerate(simulation["zones"][wine_type])]
+        user_list.append(d)
+    return user_list
+
+
+def wine_delibery_simulation (path, filename1, filename2, n_users=None, seed=None):
+    """
+    Function that creates users and their wine delivery configuration as a columnar simulation
     
     Parameters:
         path (str): wines catalogue root path
         filename1 (str): red wines catalogue filename
         filename2 (str): white wines catalogue filename
+        n_users (int): number of users. Random between 5 and 20 if None.
+        seed (int): random generator seed, to reproduce a simulation. Random run if None.
 
     Returns:
-       user_list: a list of users and its wine delivery configuration
+       simulation: columnar users simulation (see simulate_users)
     """ 
 
     # load wine catalogues 
-    df_red = pd.read_parquet(os.path.join(path, filename1), engine ="pyarrow")
-    df_white = pd.read_parquet(os.path.join(path, filename2), engine ="pyarrow")
+    df_red = wcat.read_clustered_catalogue(path, filename1, ["Cluster", "Zone"])
+    df_white = wcat.read_clustered_catalogue(path, filename2, ["Cluster", "Zone"])
 
     # Create users configuration 
-    user_list = []
-    for i in range(0, random.randint(5,20)):
-        d = {}
-        choice = total_wine_distribution()
-        qty = wine_quantity()
-        d["user"]= ''.join(["{}".format(random.randint(0, 9)) for num in range(0, 5)])
-        d["distribution"] = choice
-        qty, qty2, red_wines, white_wines = wine_distribution (choice, qty)
-        d["wine_qty"] = qty
-        d["how_more"] = qty2
-        d["red_wines"] = red_wines
-        d["white_wines"] = white_wines
-        red_clusters = len(df_red["Cluster"].unique())
-        red_distr = wine_zone_distribution (red_clusters, d["red_wines"])   
-        red_distr_delivery = wine_delibery(df_red, red_distr)  
-        d["red_distribution"] = wine_assignations(red_distr, red_distr_delivery)        
-        white_clusters = len(df_white["Cluster"].unique())
-        white_distr = wine_zone_distribution (white_clusters, d["white_wines"])
-        white_distr_delivery = wine_delibery(df_white, white_distr)  
-        d["white_distribution"] = wine_assignations(white_distr, white_distr_delivery)
-        user_list.append(d)
+    if n_users is None:
+        n_users = int(np.random.default_rng(seed).integers(5, 21))
+    return simulate_users(df_red, df_white, n_users, seed)
+
     
-    return user_list
+def wine_delibery_conf (path, filename1, filename2, n_users=None, seed=None):
+    """
+    Function that creates users and save each users wine delivery configuration
+    
+    Parameters:
+        path (str): wines catalogue root path
+        filename1 (str): red wines catalogue filename
+        filename2 (str): white wines catalogue filename
+        n_users (int): number of users. Random between 5 and 20 if None.
+        seed (int): random generator seed, to reproduce a simulation. Random run if None.
 
+    Returns:
+       user_list: a list of users and its wine delivery configuration
+    """ 
+    return simulation_to_user_list(wine_delibery_simulation(path, filename1, filename2, n_users, seed))
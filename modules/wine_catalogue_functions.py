@@ -0,0 +1,275 @@
+# wine catalogue functions
+import os
+import json
+import threading
+import pandas as pd
+import pyarrow.parquet as pq
+
+# data root (project "data" folder by default, independent of the working directory)
+data_root = os.environ.get("WINE_DATA_ROOT",
+                           os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data"))
+
+# clustered catalogue filename per wine type
+catalogue_files = {"red": "red_wines_clustered.parquet",
+                   "white": "white_wines_clustered.parquet"}
+
+# loaded catalogues per wine type. Each entry: version, columns, df (loaded columns) and derived objects
+loaded_catalogues = {}
+
+# guards loaded catalogues (service worker threads load, build and release them concurrently).
+# Reentrant: derived object builders read catalogues
+catalogue_lock = threading.RLock()
+
+
+def set_data_root(path):
+    """
+    Function that sets the folder where clustered catalogues are stored.
+    Loaded catalogues are released, so next access reads from the new folder.
+
+    Parameters:
+        path (str): path to data.
+    """
+    global data_root
+    data_root = path
+    reload_catalogues()
+
+
+def get_data_root():
+    """
+    Function that returns the folder where clustered catalogues are stored.
+
+    Returns:
+        data_root (str): path to data.
+    """
+    return data_root
+
+
+def catalogue_path(wine_type):
+    """
+    Function that returns the clustered catalogue path of a wine type.
+
+    Parameters:
+        wine_type (str): "red" or "white".
+
+    Returns:
+        path (str): clustered catalogue path.
+    """
+    return os.path.join(data_root, catalogue_files[wine_type])
+
+
+def catalogue_version(wine_type):
+    """
+    Function that returns the version of a clustered catalogue file (modification time and size).
+
+    Parameters:
+        wine_type (str): "red" or "white".
+
+    Returns:
+        version (tuple): modification time in nanoseconds and size in bytes.
+    """
+    stat = os.stat(catalogue_path(wine_type))
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def cluster_table_filename(filename):
+    """
+    Function that returns the cluster table filename of a clustered catalogue.
+
+    Parameters:
+        filename (str): clustered catalogue filename. Example: "red_wines_clustered.parquet".
+
+    Returns:
+        filename (str): cluster table filename. Example: "red_wines_clusters.parquet".
+    """
+    return f"{filename.split('_clustered.parquet')[0]}_clusters.parquet"
+
+
+def read_cluster_table(path, filename):
+    """
+    Function that reads the cluster table saved next to a clustered catalogue.
+
+    Parameters:
+        path (str): path to data.
+        filename (str): clustered catalogue filename.
+
+    Returns:
+        cluster_table (dataframe): one row per cluster with its Zone and centroid ("_scaled" columns).
+        scaler (dict): scaled columns and their StandardScaler mean and scale.
+    """
+    table = pq.read_table(os.path.join(path, cluster_table_filename(filename)))
+    scaler = json.loads(table.schema.metadata[b"scaler"])
+    return table.to_pandas().sort_values("Cluster").reset_index(drop=True), scaler
+
+
+def join_zones(clusters, cluster_table):
+    """
+    Function that obtains each wine zone from its cluster number.
+
+    Parameters:
+        clusters (np.array): cluster number of each wine.
+        cluster_table (dataframe): cluster table.
+
+    Returns:
+        zones (pd.Categorical): zone of each wine.
+    """
+    return pd.Categorical.from_codes(clusters, categories=cluster_table["Zone"].tolist())
+
+
+def clustered_columns(path, filename):
+    """
+    Function that returns clustered catalogue columns in file order without reading its data.
+    Zone is joined from the cluster table, so it is added as last column.
+
+    Parameters:
+        path (str): path to data.
+        filename (str): clustered catalogue filename.
+
+    Returns:
+        list(str): catalogue column names.
+    """
+    names = pq.read_schema(os.path.join(path, filename)).names
+    names = [name for name in names if not name.startswith("__index_level_")]
+    return names if "Zone" in names else names + ["Zone"]
+
+
+def read_clustered_catalogue(path, filename, columns=None):
+    """
+    Function that reads a clustered catalogue joining zones from its cluster table on demand.
+
+    Parameters:
+        path (str): path to data.
+        filename (str): clustered catalogue filename.
+        columns (list(str)): columns to read. All columns if None.
+
+    Returns:
+        df (dataframe): wine catalogue.
+    """
+    file_columns = pq.read_schema(os.path.join(path, filename)).names
+    columns = clustered_columns(path, filename) if columns is None else list(columns)
+    join_zone = "Zone" in columns and "Zone" not in file_columns
+
+    read_columns = [col for col in columns if col in file_columns]
+    if join_zone and "Cluster" not in read_columns:
+        read_columns.append("Cluster")
+    df = pd.read_parquet(os.path.join(path, filename), columns=read_columns, engine="pyarrow")
+
+    if join_zone:
+        cluster_table, _ = read_cluster_table(path, filename)
+        df["Zone"] = join_zones(df["Cluster"].to_numpy(), cluster_table)
+    return df[columns]
+
+
+def get_catalogue_entry(wine_type):
+    """
+    Function that returns the loaded catalogue entry of a wine type, creating it if needed.
+
+    Parameters:
+        wine_type (str): "red" or "white".
+
+    Returns:
+        entry (dict): catalogue version, file columns, loaded dataframe (None if nothing loaded)
+        and derived objects.
+    """
+    with catalogue_lock:
+        if wine_type not in loaded_catalogues:
+            loaded_catalogues[wine_type] = {"version": catalogue_version(wine_type),
+                                            "columns": clustered_columns(data_root, catalogue_files[wine_type]),
+                                            "df": None,
+                                            "derived": {}}
+        return loaded_catalogues[wine_type]
+
+
+def get_catalogue(wine_type, columns=None):
+    """
+    Function that returns a clustered catalogue. It is read once, on first access, and only the
+    requested columns are read. Missing columns are added on later accesses.
+
+    Parameters:
+        wine_type (str): "red" or "white".
+        columns (list(str)): columns needed. All columns if None.
+
+    Returns:
+        df (dataframe): wine catalogue (shared, do not modify it).
+    """
+    with catalogue_lock:
+        entry = get_catalogue_entry(wine_type)
+
+        all_columns = entry["columns"] if columns is None else list(columns)
+        loaded = [] if entry["df"] is None else list(entry["df"].columns)
+        missing = [col for col in all_columns if col not in loaded]
+
+        # read only columns not loaded yet
+        if len(missing) > 0:
+            new_df = read_clustered_catalogue(data_root, catalogue_files[wine_type], missing)
+            if entry["df"] is not None:
+                new_df = pd.concat([entry["df"], new_df], axis=1)
+            # keep file column order
+            entry["df"] = new_df[[col for col in entry["columns"] if col in new_df.columns]]
+        df = entry["df"]
+
+    if columns is None:
+        return df
+    return df[all_columns]
+
+
+def get_derived(wine_type, key, builder):
+    """
+    Function that returns an object derived from a catalogue (e.g. a search engine).
+    It is built once per catalogue version and released when the catalogue is reloaded.
+
+    Parameters:
+        wine_type (str): "red" or "white".
+        key (str): derived object name.
+        builder (function): function without parameters that builds the object.
+
+    Returns:
+        derived object.
+    """
+    with catalogue_lock:
+        entry = get_catalogue_entry(wine_type)
+
+        if key not in entry["derived"]:
+            entry["derived"][key] = builder()
+        return entry["derived"][key]
+
+
+def get_cluster_table(wine_type):
+    """
+    Function that returns the cluster table of a catalogue. It is read once per catalogue version.
+
+    Parameters:
+        wine_type (str): "red" or "white".
+
+    Returns:
+        cluster_table (dataframe): one row per cluster with its Zone and centroid ("_scaled" columns).
+    """
+    return get_derived(wine_type, "cluster_table",
+                       lambda: read_cluster_table(data_root, catalogue_files[wine_type])[0])
+
+
+def reload_catalogues(wine_types=None):
+    """
+    Function that releases loaded catalogues and their derived objects. Next access reads them again.
+
+    Parameters:
+        wine_types (list(str)): wine types to release. All if None.
+    """
+    with catalogue_lock:
+        if wine_types is None:
+            wine_types = list(loaded_catalogues.keys())
+        for wine_type in wine_types:
+            loaded_catalogues.pop(wine_type, None)
+
+
+def refresh_catalogues():
+    """
+    Function that reloads catalogues whose file version changed since they were loaded.
+
+    Returns:
+        list(str): reloaded wine types.
+    """
+    with catalogue_lock:
+        changed = [wine_type for wine_type, entry in loaded_catalogues.items()
+                   if entry["version"] != catalogue_version(wine_type)]
+        reload_catalogues(changed)
+    return changed
@@ -1,17 +1,22 @@
 # wine clustering functions
 import pandas as pd
 import os
+import json
 import numpy as np
-from sklearn.preprocessing import StandardScaler
-from sklearn.cluster import KMeans
+import pyarrow as pa
+import pyarrow.parquet as pq
+from concurrent.futures import ProcessPoolExecutor
 import itertools 
-import matplotlib.pyplot as plt
-import rpy2.robjects as ro
-from rpy2.robjects import pandas2ri
+from modules import wine_catalogue_functions as wcat
+from modules import wine_model_functions as wmf
+from modules import wine_profile_functions as wpf
 
 # global variable
 clustering_cols = ['residual sugar', 'chlorides', 'sulphates', 'Body_tmp', 'Vibrancy_tmp']
 
+# best cluster number selection methods: NbClust in R or python native indices
+k_selection_methods = ["nbclust", "native"]
+
 def get_best_cluster_number (data):
     """
     Function that determines best cluster number calling to R script. 
@@ -23,6 +28,10 @@ def get_best_cluster_number (data):
     Returns:
         n_clusters: best cluster number       
     """  
+    # R is only needed by this method
+    import rpy2.robjects as ro
+    from rpy2.robjects import pandas2ri
+
     # Convert the scaled data back to a Pandas DataFrame for R interaction
     pandas2ri.activate() 
 
@@ -39,33 +48,129 @@ def get_best_cluster_number (data):
     return n_clusters
 
 
-def cluster_data (data):
+def evaluate_cluster_number (data, n_clusters, sample_size, n_refs, random_state):
+    """
+    Function that fits KMeans with a cluster number and computes its validity indices.
+
+    Parameters:
+        data (np.array): scaled data.
+        n_clusters (int): cluster number to evaluate.
+        sample_size (int): number of points used to compute silhouette.
+        n_refs (int): number of uniform reference datasets of the gap statistic.
+        random_state (int): random seed.
+
+    Returns:
+        indices (dict): silhouette, calinski_harabasz, davies_bouldin, gap and gap_sd values.
+    """  
+    from sklearn.cluster import KMeans
+    from sklearn.metrics import silhouette_score, calinski_harabasz_score, davies_bouldin_score
+
+    kmeans = KMeans(n_clusters = n_clusters, init = 'k-means++', max_iter = 300, n_init = 10,
+                    random_state = random_state)
+    labels = kmeans.fit_predict(data)
+
+    # gap statistic: log dispersion of uniform references (data bounding box) minus data log dispersion
+    rng = np.random.default_rng(random_state)
+    mins, maxs = data.min(axis=0), data.max(axis=0)
+    ref_log_w = []
+    for _ in range(n_refs):
+        reference = rng.uniform(mins, maxs, size=data.shape)
+        ref_kmeans = KMeans(n_clusters = n_clusters, init = 'k-means++', max_iter = 300, n_init = 3,
+                            random_state = random_state).fit(reference)
+        ref_log_w.append(np.log(ref_kmeans.inertia_))
+
+    return {"silhouette": silhouette_score(data, labels, sample_size=min(sample_size, len(data)),
+                                           random_state=random_state),
+            "calinski_harabasz": calinski_harabasz_score(data, labels),
+            "davies_bouldin": davies_bouldin_score(data, labels),
+            "gap": np.mean(ref_log_w) - np.log(kmeans.inertia_),
+            "gap_sd": np.std(ref_log_w) * np.sqrt(1 + 1.0 / n_refs)}
+
+
+def get_best_cluster_number_native (data, min_nc = 2, max_nc = 20, sample_size = 2000, n_refs = 5,
+                                    n_jobs = None, random_state = 0):
+    """
+    Function that determines best cluster number without R.
+    Each cluster number is evaluated in a process pool and the best cluster number of each index
+    (silhouette, Calinski-Harabasz, Davies-Bouldin and gap statistic) is voted. As in the NbClust
+    R script, the most voted cluster number wins and ties are solved with the greatest one.
+
+    Parameters:
+        data (dataframe): data to apply clustering.
+        min_nc (int): minimum cluster number.
+        max_nc (int): maximum cluster number.
+        sample_size (int): number of points used to compute silhouette.
+        n_refs (int): number of uniform reference datasets of the gap statistic.
+        n_jobs (int): number of processes. All cores if None.
+        random_state (int): random seed.
+
+    Returns:
+        n_clusters: best cluster number       
+    """  
+    X = np.asarray(data, dtype=np.float64)
+    candidates = list(range(min_nc, min(max_nc, len(X) - 1) + 1))
+
+    # evaluate each cluster number in parallel
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        results = list(executor.map(evaluate_cluster_number, itertools.repeat(X), candidates,
+                                    itertools.repeat(sample_size), itertools.repeat(n_refs),
+                                    itertools.repeat(random_state)))
+    indices = pd.DataFrame(results, index=candidates)
+
+    # best cluster number per index
+    votes = [indices["silhouette"].idxmax(),
+             indices["calinski_harabasz"].idxmax(),
+             indices["davies_bouldin"].idxmin()]
+
+    # gap: smallest k such that gap(k) >= gap(k+1) - sd(k+1)
+    gap_ok = indices["gap"].to_numpy()[:-1] >= (indices["gap"] - indices["gap_sd"]).to_numpy()[1:]
+    votes.append(candidates[int(np.argmax(gap_ok))] if gap_ok.any() else indices["gap"].idxmax())
+
+    # most voted cluster number, the greatest one if tie
+    freq = pd.Series(votes).value_counts()
+    return int(max(freq[freq == freq.max()].index))
+
+
+def cluster_data (data, k_method = "nbclust"):
     """
-    Function that applies clustering. Best cluster number determines calling to R script.
+    Function that applies clustering. Best cluster number determines calling to R script (NbClust)
+    or with python native indices.
 
     Parameters:
         data (dataframe): data to apply clustering.
+        k_method (str): best cluster number selection method. "nbclust" or "native".
 
     Returns:
+        X_scaled: scaled data
         n_clusters: best cluster number
         kmeans: kmeans model
         y_kmeans: clustering result
+        scaler: fitted scaler
     """  
+    # scikit-learn is only needed to fit a model (saved models are reused)
+    from sklearn.preprocessing import StandardScaler
+    from sklearn.cluster import KMeans
 
     # Scale data
     scaler = StandardScaler()
     X_scaled = scaler.fit_transform(data[clustering_cols])
     X_scaled_data = pd.DataFrame(X_scaled, columns= clustering_cols)
 
-    # GET BEST CLUSTER NUMBER (by NbClust function in R script).  
-    n_clusters = get_best_cluster_number(X_scaled_data) # get clusters only by clustering columns 
+    # GET BEST CLUSTER NUMBER (by NbClust function in R script or python native indices).  
+    if k_method not in k_selection_methods:
+        raise ValueError(f"Unknown cluster number selection method '{k_method}'. Use one of {k_selection_methods}.")
+    if k_method == "native":
+        n_clusters = get_best_cluster_number_native(X_scaled_data)
+    else:
+        n_clusters = get_best_cluster_number(X_scaled_data) # get clusters only by clustering columns 
+    print(f"\tBEST CLUSTER NUMBER ({k_method}): {int(n_clusters)}")
 
     # APPLY KMEANS
     kmeans = KMeans(n_clusters = int(n_clusters), init = 'k-means++', max_iter = 300, n_init = 10,
                     random_state = 0)
     y_kmeans = kmeans.fit_predict(X_scaled)
 
-    return X_scaled, n_clusters, kmeans, y_kmeans
+    return X_scaled, n_clusters, kmeans, y_kmeans, scaler
 
 
 def character_list_by_clusters (n_clusters):
@@ -81,79 +186,106 @@ def character_list_by_clusters (n_clusters):
 
     return [f"Zone_{chr(i)}" for i in range(65, 65 + n_clusters)]
 
-def create_map_dictionaries (n_clusters, kmeans, y_kmeans):
+def save_cluster_table (path, filename, model):
     """
-    Function that generates map dictionaries.
-    One relates cluster numbers with Zones. Example: cluster 0 = Zone A
-    Other relates centroides with cluster numbeers. Example cluser 0 = Centroid data.
+    Function that saves the cluster table next to the clustered catalogue.
+    One row per cluster with its Zone and centroid, scaler parameters saved as table metadata.
 
     Parameters:
-        n_clusters : best cluster number
-        kmeans: kmeans model
-        y_kmeans: clustering result
+        path (str): path to data.
+        filename (str): clustered catalogue filename.
+        model (dict): clustering model (centroids, zones and scaler parameters).
 
     Returns:
-        cluster_zone: map dictionary that relates cluster numbers with Zones.
-        clusters_centroid:  map dictionary that relates cluster with its Centroid data.
-        centroids: centroids summary
-
+        cluster_table (dataframe): saved cluster table.
     """   
-    
-    # Create cluster - zone map dictionary
-    zones = character_list_by_clusters(int(n_clusters))
-    clusters_zone = {i: zones[i] for i in set(y_kmeans)}
-
-    # Create cluster - centroid relation map dsctionary
-    centroids = kmeans.cluster_centers_
+    cluster_table = pd.DataFrame(np.asarray(model["centroids"]), columns=[x + "_scaled" for x in clustering_cols])
+    cluster_table.insert(0, "Cluster", np.arange(model["n_clusters"], dtype=np.int32))
+    cluster_table.insert(1, "Zone", model["zones"])
+
+    # scaler parameters as metadata
+    scaler_params = {"columns": clustering_cols,
+                     "mean": np.asarray(model["mean"]).tolist(),
+                     "scale": np.asarray(model["scale"]).tolist()}
+    table = pa.Table.from_pandas(cluster_table, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[b"scaler"] = json.dumps(scaler_params).encode()
+    pq.write_table(table.replace_schema_metadata(metadata), os.path.join(path, wcat.cluster_table_filename(filename)))
+
+    return cluster_table
+
+def get_clustering_model (path, name, df, k_method = "nbclust"):
+    """
+    Function that returns the clustering model of a catalogue.
+    Models are saved as artifacts keyed by data fingerprint, so an unchanged catalogue is not refitted.
 
-    # save as np.array not as string
-    clusters_centroid = {i: centroids[i] for i in set(y_kmeans)}
+    Parameters:
+        path (str): path to data.
+        name (str): catalogue name. Example: "red_wines".
+        df (dataframe): categorized catalogue.
+        k_method (str): best cluster number selection method. "nbclust" (R) or "native".
 
-    return clusters_zone, clusters_centroid, centroids
+    Returns:
+        model (dict): clustering model (see wine_model_functions.load_clustering_model).
+    """   
+    fingerprint = wmf.data_fingerprint(df[clustering_cols], k_method)
+    model = wmf.load_clustering_model(path, name, fingerprint)
+    if model is not None:
+        print(f"\tREUSING SAVED CLUSTERING MODEL {fingerprint} ({model['n_clusters']} CLUSTERS)")
+        wmf.mark_latest(path, name, fingerprint)
+        return model
 
+    print("\tDETERMINING BEST CLUSTER NUMBER...")
+    X_scaled, n_clusters, kmeans, y_kmeans, scaler = cluster_data(df, k_method)
+    zones = character_list_by_clusters(int(n_clusters))
+    return wmf.save_clustering_model(path, name, fingerprint, clustering_cols, scaler, kmeans, zones, k_method)
 
-def apply_clustering (path, filename):
+def apply_clustering (path, filename, k_method = "nbclust"):
     """
     Function that applies clustering to corresponding data.
     Scales, determine best cluster number, clusters and add new columns with resulted values.
+    Fitted models are saved and reused while the catalogue does not change.
 
     Parameters:
         path (str): path to data.
         filename (str): filename to load and apply clustering
+        k_method (str): best cluster number selection method. "nbclust" (R) or "native".
 
     Returns:
-        Null
-        But saves clustered data with "_clustered.csv" name
+        df_combined: clustered data
+        centroids: centroids summary
+        But saves clustered data with "_clustered.parquet" name and its cluster table
+        (zones, centroids and scaler) with "_clusters.parquet" name.
     """   
 
-    # LOAD DATA 
+    # LOAD DATA (descriptors as categorical codes, saved dictionary encoded)
     filename_root = filename.split("_categorized.csv")[0]
-    df = pd.read_csv(os.path.join(path, filename))
+    df = wpf.read_categorized_data(os.path.join(path, filename))
 
-    # APPLY CLUSTERING 
-    print("\tDETERMINING BEST CLUSTER NUMBER...")
-    X_scaled, n_clusters, kmeans, y_kmeans = cluster_data(df)
+    # APPLY CLUSTERING (fit or reuse saved model)
+    model = get_clustering_model(path, filename_root, df, k_method)
 
     # DETERMINE EACH WINES ZONE (based on clusters)
     print("\tDETERMINING WINE ZONES BASED ON CLUSTERS...")
-    clusters_zone, clusters_centroid, centroids= create_map_dictionaries (n_clusters, kmeans, y_kmeans)
+    X_scaled, y_kmeans, zones = wmf.assign_zones(model, df)
 
     # add scaled data to origin df
     X_scaled_data = pd.DataFrame(X_scaled, columns=clustering_cols)
     X_scaled_data = X_scaled_data.add_suffix('_scaled')
     df_combined = pd.concat([df, X_scaled_data], axis=1)
 
-    # ADD NEW columns 
+    # ADD NEW columns (centroids and zones are saved once in the cluster table)
     df_combined.loc[:,"Cluster"] = y_kmeans
-    df_combined.loc[:,"Centroid"] = df_combined["Cluster"].map(clusters_centroid)
-    df_combined.loc[:,"Zone"] = df_combined["Cluster"].map(clusters_zone)
 
     # save clustered data in correct formats
     new_filename = f"{filename_root}_clustered.parquet"
     df_combined.to_parquet(os.path.join(path,new_filename), engine ="pyarrow")
+    save_cluster_table(path, new_filename, model)
 
+    # zones joined for callers
+    df_combined.loc[:,"Zone"] = zones
 
-    return df_combined, centroids
+    return df_combined, np.asarray(model["centroids"])
 
 def plot_clusters(data, centroids):
 
@@ -166,6 +298,9 @@ def plot_clusters(data, centroids):
     Returns:
         Null
     """   
+    # pyplot is only needed by this method (interactive exploration)
+    import matplotlib.pyplot as plt
+
     # Pair combinations of columns for plotting
     new_cols = [x +"_scaled" for x in clustering_cols]
     cols_combination = list(itertools.combinations(new_cols, 2))
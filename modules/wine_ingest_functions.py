@@ -0,0 +1,234 @@
+# wine ingest functions
+import os
+import json
+import shutil
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from modules import wine_profile_functions as wpf
+from modules import wine_clustering_functions as wcf
+from modules import wine_model_functions as wmf
+from modules import wine_knn_graph_functions as wkg
+from modules import wine_catalogue_functions as wcat
+
+# ingested wines mean squared distance to their centroid over the fitted one, over which the
+# catalogue is fully re-clustered
+drift_threshold = 1.5
+
+# raw columns that identify a wine (used to skip wines already in the catalogue)
+raw_cols = wpf.indiv_cols + [col for cols in wpf.complex_relation_dict.values() for col in cols]
+
+
+def profile_new_wines(df, cut_points):
+    """
+    Function that creates new wines profiles with the cut points of the catalogue (as wine_profiling,
+    without recomputing percentiles).
+
+    Parameters:
+        df (dataframe): raw new wines (same columns as raw wine files).
+        cut_points (dict): min and max percentile values per categorized column.
+
+    Returns:
+        df (dataframe): categorized new wines.
+    """
+    # remove no used data
+    df = df.drop([col for col in wpf.no_used_cols if col in df.columns], axis=1)
+
+    # detect if exist duplicates & remove if any
+    df = df[~df.duplicated(keep=False)].reset_index(drop=True)
+
+    df = wpf.create_complex_descriptors(df)
+    return wpf.categorize_with_percentiles(df, cut_points)
+
+
+def raw_fingerprints(df):
+    """
+    Function that reduces each wine raw values to a 64 bit hash fingerprint.
+
+    Parameters:
+        df (dataframe): wines.
+
+    Returns:
+        np.array: fingerprint of each wine.
+    """
+    return pd.util.hash_pandas_object(df[raw_cols], index=False).to_numpy()
+
+
+def catalogue_fingerprints(path, name, chunksize=100000):
+    """
+    Function that computes the fingerprints of the wines of a catalogue, both clustered and only
+    categorized (e.g. rows appended before a re-cluster that did not finish).
+
+    Parameters:
+        path (str): path to data.
+        name (str): catalogue name. Example: "red_wines".
+        chunksize (int): categorized file rows read at a time.
+
+    Returns:
+        fingerprints (np.array): unique fingerprints of the catalogue wines.
+        n_clustered (int): number of wines of the clustered file.
+    """
+    catalogue_raw = pd.read_parquet(os.path.join(path, f"{name}_clustered.parquet"), columns=raw_cols,
+                                    engine="pyarrow")
+    fingerprints = [raw_fingerprints(catalogue_raw)]
+    for chunk in wpf.read_categorized_data(os.path.join(path, f"{name}_categorized.csv"), usecols=raw_cols,
+                                           chunksize=chunksize):
+        fingerprints.append(raw_fingerprints(chunk))
+    return np.unique(np.concatenate(fingerprints)), len(catalogue_raw)
+
+
+def append_parquet_rows(file_path, df):
+    """
+    Function that appends rows to a parquet file as a new row group.
+    Existing row groups are copied without decoding them to pandas, and the file is replaced atomically.
+    Default (range) index of the file continues over the new rows.
+
+    Parameters:
+        file_path (str): parquet file path.
+        df (dataframe): rows to append, with the file columns.
+
+    Returns:
+        n_rows (int): number of rows of the file after appending.
+    """
+    parquet_file = pq.ParquetFile(file_path)
+    schema = parquet_file.schema_arrow
+    n_rows = parquet_file.metadata.num_rows + len(df)
+
+    # update range index stop in pandas metadata
+    metadata = dict(schema.metadata or {})
+    if b"pandas" in metadata:
+        pandas_meta = json.loads(metadata[b"pandas"])
+        for index in pandas_meta["index_columns"]:
+            if isinstance(index, dict) and index["kind"] == "range":
+                index["stop"] = index["start"] + n_rows * index["step"]
+        metadata[b"pandas"] = json.dumps(pandas_meta).encode()
+    schema = schema.with_metadata(metadata)
+
+    new_rows = pa.Table.from_pandas(df[schema.names], schema=schema, preserve_index=False)
+
+    tmp_path = f"{file_path}.tmp"
+    with pq.ParquetWriter(tmp_path, schema) as writer:
+        for i in range(parquet_file.num_row_groups):
+            writer.write_table(parquet_file.read_row_group(i).replace_schema_metadata(metadata))
+        writer.write_table(new_rows)
+    os.replace(tmp_path, file_path)
+    return n_rows
+
+
+def load_drift(path, name, model):
+    """
+    Function that loads the drift accumulated by wines ingested since the model was fitted.
+
+    Parameters:
+        path (str): path to data.
+        name (str): catalogue name. Example: "red_wines".
+        model (dict): clustering model.
+
+    Returns:
+        drift (dict): number of ingested wines and sum of their squared distances to their centroid.
+    """
+    drift_file = os.path.join(wmf.model_path(path, name, model["fingerprint"]), "drift.json")
+    if not os.path.exists(drift_file):
+        return {"n_wines": 0, "sq_dist": 0.0}
+    with open(drift_file, 'r') as json_file:
+        return json.load(json_file)
+
+
+def save_drift(path, name, model, drift):
+    """
+    Function that saves the drift accumulated by wines ingested since the model was fitted.
+
+    Parameters:
+        path (str): path to data.
+        name (str): catalogue name. Example: "red_wines".
+        model (dict): clustering model.
+        drift (dict): number of ingested wines and sum of their squared distances to their centroid.
+    """
+    drift_file = os.path.join(wmf.model_path(path, name, model["fingerprint"]), "drift.json")
+    with open(drift_file, 'w') as json_file:
+        json.dump(drift, json_file)
+
+
+def ingest_wines(path, name, new_wines, threshold=None, k_method=None):
+    """
+    Function that adds new wines to a catalogue without rebuilding it.
+    New wines are categorized with the saved cut points, scaled and assigned to a zone with the
+    saved clustering model, appended to the categorized and clustered files and to the knn graph.
+    When ingested wines drift from the model centroids (mean squared distance to their centroid
+    over the fitted one greater than threshold) the catalogue is fully re-clustered.
+
+    Parameters:
+        path (str): path to data.
+        name (str): catalogue name. Example: "red_wines".
+        new_wines (dataframe): raw new wines (same columns as raw wine files).
+        threshold (float): drift threshold. drift_threshold if None.
+        k_method (str): best cluster number selection method used if re-clustering. Method the
+            catalogue model was fitted with if None.
+
+    Returns:
+        summary (dict): number of ingested wines, drift and whether the catalogue was re-clustered.
+    """
+    threshold = drift_threshold if threshold is None else threshold
+    clustered_filename = f"{name}_clustered.parquet"
+    clustered_file = os.path.join(path, clustered_filename)
+
+    # 1- PROFILE NEW WINES WITH CATALOGUE CUT POINTS
+    df = profile_new_wines(new_wines, wpf.load_cut_points(path, name))
+
+    # skip wines already in the catalogue
+    columns = wcat.clustered_columns(path, clustered_filename)[:-1]
+    known, n_old = catalogue_fingerprints(path, name)
+    df = df[~np.isin(raw_fingerprints(df), known)].reset_index(drop=True)
+    if len(df) == 0:
+        return {"n_wines": 0, "drift": None, "reclustered": False}
+
+    # 2- ASSIGN ZONES WITH SAVED MODEL
+    model = wmf.load_clustering_model(path, name)
+    X_scaled = wmf.scale_wines(model, df)
+    clusters, sq_dist = wmf.assign_clusters(model, X_scaled)
+
+    drift = load_drift(path, name, model)
+    drift = {"n_wines": drift["n_wines"] + len(df), "sq_dist": drift["sq_dist"] + float(sq_dist.sum())}
+    drift_value = drift["sq_dist"] / drift["n_wines"] / model["inertia_per_wine"]
+
+    # 3- APPEND TO A COPY OF THE CATEGORIZED FILE (replaces it once the clustered file is updated)
+    categorized_filename = f"{name}_categorized.csv"
+    categorized_file = os.path.join(path, categorized_filename)
+    tmp_filename = f"{categorized_filename}.tmp"
+    tmp_file = os.path.join(path, tmp_filename)
+    categorized_cols = pd.read_csv(categorized_file, nrows=0).columns
+    shutil.copyfile(categorized_file, tmp_file)
+    try:
+        df[categorized_cols].to_csv(tmp_file, index=False, header=False, mode='a')
+
+        graph = wkg.load_knn_graph(path, clustered_filename)
+        if drift_value > threshold:
+            # 4a- FULL RE-CLUSTER (new model, zones and knn graph)
+            print(f"\tDRIFT {drift_value:.2f} OVER {threshold}: RE-CLUSTERING {name.upper()}")
+            k_method = k_method or model.get("k_method", "nbclust") # models saved without method used R
+            wcf.apply_clustering(path, tmp_filename, k_method)
+            os.replace(tmp_file, categorized_file)
+            if graph is not None:
+                k, distance = graph["labels"].shape[1], graph["distance"]
+                del graph # release memory maps before overwriting files
+                wkg.create_knn_graph(path, clustered_filename, k, distance)
+        else:
+            # 4b- APPEND TO CLUSTERED FILE AND UPDATE KNN GRAPH
+            X_scaled_data = pd.DataFrame(X_scaled, columns=[col + "_scaled" for col in model["columns"]])
+            df_combined = pd.concat([df, X_scaled_data], axis=1)
+            df_combined.loc[:, "Cluster"] = clusters
+            append_parquet_rows(clustered_file, df_combined[columns])
+            os.replace(tmp_file, categorized_file)
+            save_drift(path, name, model, drift)
+            if graph is not None:
+                del graph
+                wkg.update_knn_graph(path, clustered_filename, n_old)
+    finally:
+        # categorized file is left unchanged if the clustered file could not be updated
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+    # loaded catalogues are refreshed on next access
+    wcat.refresh_catalogues()
+    return {"n_wines": len(df), "drift": drift_value, "reclustered": drift_value > threshold}
@@ -0,0 +1,197 @@
+# wine knn graph functions
+import os
+import json
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from modules import wine_search_functions as wsf
+from modules import pairwise_distance_functions as pdk
+
+
+def build_knn_graph(df, k=10, distance="euclidean", block_size=None, n_jobs=None, dtype=np.float64):
+    """
+    Function that computes each wine k nearest wines over scaled features.
+    The catalogue is self joined by blocks in parallel threads (NumPy releases the GIL), keeping only
+    each wine running k nearest, so memory stays within the pairwise distance memory budget.
+
+    Parameters:
+        df (dataframe): clustered wine catalogue.
+        k (int): number of neighbours per wine.
+        distance (str): distance to use. Euclidean, manhattan or cosine.
+        block_size (int): number of wines per block. pairwise distance query_block_size if None.
+        n_jobs (int): number of threads. All cores if None.
+        dtype (np.dtype): distance precision, np.float32 or np.float64.
+
+    Returns:
+        graph (dict): knn graph composed by:
+            labels: n_wines x k catalogue indexes of nearest wines, ordered by distance.
+            distances: n_wines x k corresponding distances.
+            distance: distance used.
+    """
+    engine = wsf.build_search_engine(df)
+    positions, distances = pdk.streaming_top_k(engine["matrix"], engine["matrix"], k, distance, dtype,
+                                               np.arange(len(engine["matrix"])), block_size, n_jobs)
+    return {"labels": engine["labels"].to_numpy()[positions],
+            "distances": distances.astype(np.float32),
+            "distance": distance}
+
+
+def knn_graph_filenames(filename):
+    """
+    Function that returns knn graph filenames of a clustered catalogue.
+
+    Parameters:
+        filename (str): clustered catalogue filename. Example: "red_wines_clustered.parquet".
+
+    Returns:
+        labels_file (str): neighbours filename.
+        distances_file (str): distances filename.
+        meta_file (str): graph description filename.
+    """
+    filename_root = filename.split("_clustered.parquet")[0]
+    return (f"{filename_root}_knn_labels.npy",
+            f"{filename_root}_knn_distances.npy",
+            f"{filename_root}_knn_graph.json")
+
+
+def create_knn_graph(path, filename, k=10, distance="euclidean", block_size=1024, n_jobs=None):
+    """
+    Function that builds the knn graph of a clustered catalogue and saves it next to it.
+
+    Parameters:
+        path (str): path to data.
+        filename (str): clustered catalogue filename.
+        k (int): number of neighbours per wine.
+        distance (str): distance to use. Euclidean, manhattan or cosine.
+        block_size (int): number of wines per block.
+        n_jobs (int): number of threads. All cores if None.
+
+    Returns:
+        Null
+        But saves "_knn_labels.npy", "_knn_distances.npy" and "_knn_graph.json" files.
+    """
+    df = pd.read_parquet(os.path.join(path, filename), columns=wsf.scaled_cols, engine="pyarrow")
+    graph = build_knn_graph(df, k, distance, block_size, n_jobs)
+    save_knn_graph(path, filename, graph)
+
+
+def save_knn_graph(path, filename, graph):
+    """
+    Function that saves the knn graph of a clustered catalogue next to it.
+
+    Parameters:
+        path (str): path to data.
+        filename (str): clustered catalogue filename.
+        graph (dict): knn graph (labels, distances and distance used).
+
+    Returns:
+        Null
+        But saves "_knn_labels.npy", "_knn_distances.npy" and "_knn_graph.json" files.
+    """
+    labels_file, distances_file, meta_file = knn_graph_filenames(filename)
+    # written to temporary files and replaced (loaded graphs keep memory maps of previous files)
+    for graph_file, array in [(labels_file, graph["labels"]), (distances_file, graph["distances"])]:
+        with open(os.path.join(path, f"{graph_file}.tmp"), 'wb') as npy_file:
+            np.save(npy_file, array)
+        os.replace(os.path.join(path, f"{graph_file}.tmp"), os.path.join(path, graph_file))
+    with open(os.path.join(path, meta_file), 'w') as json_file:
+        json.dump({"k": int(graph["labels"].shape[1]), "distance": graph["distance"],
+                   "n_wines": len(graph["labels"])}, json_file)
+
+
+def load_knn_graph(path, filename):
+    """
+    Function that loads the knn graph of a clustered catalogue as memory maps.
+
+    Parameters:
+        path (str): path to data.
+        filename (str): clustered catalogue filename.
+
+    Returns:
+        graph (dict): knn graph (see build_knn_graph) or None if it has not been created.
+    """
+    labels_file, distances_file, meta_file = knn_graph_filenames(filename)
+    if not os.path.exists(os.path.join(path, meta_file)):
+        return None
+
+    with open(os.path.join(path, meta_file), 'r') as json_file:
+        meta = json.load(json_file)
+
+    return {"labels": np.load(os.path.join(path, labels_file), mmap_mode='r'),
+            "distances": np.load(os.path.join(path, distances_file), mmap_mode='r'),
+            "distance": meta["distance"],
+            "n_wines": meta["n_wines"]}
+
+
+def graph_nearest_wine(graph, position, exclude=None):
+    """
+    Function that looks up the nearest wine of a catalogue wine in the knn graph.
+
+    Parameters:
+        graph (dict): knn graph.
+        position (int): catalogue position of the reference wine.
+        exclude (list): catalogue indexes that can not be returned (e.g. users' wines).
+
+    Returns:
+        catalogue index of the nearest not excluded wine, or None if all graph neighbours are excluded.
+    """
+    neighbours = np.asarray(graph["labels"][position])
+    if exclude is not None and len(exclude) > 0:
+        neighbours = neighbours[~np.isin(neighbours, list(exclude))]
+    return neighbours[0] if len(neighbours) > 0 else None
+
+
+def update_knn_graph(path, filename, n_old, block_size=1024, n_jobs=None):
+    """
+    Function that updates the knn graph of a catalogue after appending new wines at its end.
+    New wines get their k nearest wines from the whole catalogue, and old wines only compare
+    with new wines, merging them with their saved neighbours.
+
+    Parameters:
+        path (str): path to data.
+        filename (str): clustered catalogue filename.
+        n_old (int): number of wines before appending new ones.
+        block_size (int): number of wines per block.
+        n_jobs (int): number of threads. All cores if None.
+
+    Returns:
+        bool: True if the graph exists and has been updated.
+    """
+    graph = load_knn_graph(path, filename)
+    if graph is None or graph["n_wines"] != n_old:
+        return False
+
+    df = pd.read_parquet(os.path.join(path, filename), columns=wsf.scaled_cols, engine="pyarrow")
+    engine = wsf.build_search_engine(df)
+    n_wines = len(df)
+    k = graph["labels"].shape[1]
+    all_labels = engine["labels"].to_numpy()
+
+    saved_labels, saved_distances, distance = graph["labels"], graph["distances"], graph["distance"]
+    labels = np.empty((n_wines, k), dtype=np.int64)
+    distances = np.empty((n_wines, k), dtype=np.float32)
+    new_rows = np.arange(n_old, n_wines)
+
+    def process_old_block(start):
+        # saved neighbours + new wines as candidates
+        end = min(start + block_size, n_old)
+        new_dist = wsf.compute_distances(engine, engine["matrix"][start:end], distance, new_rows)
+        cand_dist = np.hstack([np.asarray(saved_distances[start:end], dtype=np.float64), new_dist])
+        cand_labels = np.hstack([np.asarray(saved_labels[start:end]),
+                                 np.broadcast_to(all_labels[new_rows], new_dist.shape)])
+        positions, top_dist = wsf.select_top_k(cand_dist, k)
+        labels[start:end] = np.take_along_axis(cand_labels, positions, axis=1)
+        distances[start:end] = top_dist
+
+    with ThreadPoolExecutor(max_workers=n_jobs or os.cpu_count()) as executor:
+        list(executor.map(process_old_block, range(0, n_old, block_size)))
+
+    # new wines nearest wines in the whole catalogue
+    positions, distances[n_old:] = pdk.streaming_top_k(engine["matrix"][new_rows], engine["matrix"], k,
+                                                       distance, query_positions=new_rows,
+                                                       block_size=block_size, n_jobs=n_jobs)
+    labels[n_old:] = all_labels[positions]
+
+    # saved graph files are replaced, not overwritten, so its memory maps stay valid
+    save_knn_graph(path, filename, {"labels": labels, "distances": distances, "distance": distance})
+    return True
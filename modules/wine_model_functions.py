@@ -0,0 +1,187 @@
+# wine model functions
+import os
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+from datetime import datetime
+
+# clustering model artifacts format version
+model_version = 1
+
+
+def data_fingerprint(data, k_method):
+    """
+    Function that computes the fingerprint of the data used to fit a clustering model.
+    Same data and cluster number selection method give the same fingerprint.
+
+    Parameters:
+        data (dataframe): clustering columns of the catalogue.
+        k_method (str): best cluster number selection method.
+
+    Returns:
+        fingerprint (str): hexadecimal fingerprint.
+    """
+    digest = hashlib.sha1()
+    digest.update(json.dumps([model_version, list(data.columns), k_method]).encode())
+    digest.update(pd.util.hash_pandas_object(data, index=False).to_numpy().tobytes())
+    return digest.hexdigest()[:16]
+
+
+def model_path(path, name, fingerprint):
+    """
+    Function that returns the folder of a clustering model artifacts.
+
+    Parameters:
+        path (str): path to data.
+        name (str): catalogue name. Example: "red_wines".
+        fingerprint (str): data fingerprint.
+
+    Returns:
+        str: model folder ("models/<name>/<fingerprint>" inside data folder).
+    """
+    return os.path.join(path, "models", name, fingerprint)
+
+
+def save_clustering_model(path, name, fingerprint, columns, scaler, kmeans, zones, k_method):
+    """
+    Function that saves a fitted clustering model as versioned artifacts.
+    Arrays are saved as .npy files (memory-mappable) and the rest as json. The model is also
+    marked as the latest model of the catalogue (see mark_latest).
+
+    Parameters:
+        path (str): path to data.
+        name (str): catalogue name. Example: "red_wines".
+        fingerprint (str): fingerprint of the data used to fit the model.
+        columns (list(str)): clustering columns.
+        scaler: fitted StandardScaler.
+        kmeans: fitted KMeans.
+        zones (list(str)): zone of each cluster.
+        k_method (str): best cluster number selection method (reused to re-cluster the catalogue).
+
+    Returns:
+        model (dict): saved model (see load_clustering_model).
+    """
+    folder = model_path(path, name, fingerprint)
+    os.makedirs(folder, exist_ok=True)
+
+    np.save(os.path.join(folder, "scaler_mean.npy"), scaler.mean_)
+    np.save(os.path.join(folder, "scaler_scale.npy"), scaler.scale_)
+    np.save(os.path.join(folder, "centroids.npy"), kmeans.cluster_centers_)
+
+    # mean squared distance of fitted wines to their centroid (reference to measure drift)
+    meta = {"version": model_version,
+            "fingerprint": fingerprint,
+            "columns": list(columns),
+            "n_clusters": int(kmeans.n_clusters),
+            "zones": list(zones),
+            "k_method": k_method,
+            "inertia_per_wine": float(kmeans.inertia_ / len(kmeans.labels_)),
+            "created": datetime.now().isoformat()}
+    with open(os.path.join(folder, "model.json"), 'w') as json_file:
+        json.dump(meta, json_file)
+
+    mark_latest(path, name, fingerprint)
+    return load_clustering_model(path, name, fingerprint)
+
+
+def mark_latest(path, name, fingerprint):
+    """
+    Function that marks a saved model as the latest model of the catalogue (the one used to assign
+    new wines). Called whenever a catalogue is clustered, with a new or a reused model.
+
+    Parameters:
+        path (str): path to data.
+        name (str): catalogue name. Example: "red_wines".
+        fingerprint (str): fingerprint of the model.
+    """
+    latest_file = os.path.join(path, "models", name, "latest.json")
+    with open(f"{latest_file}.tmp", 'w') as json_file:
+        json.dump({"fingerprint": fingerprint}, json_file)
+    os.replace(f"{latest_file}.tmp", latest_file)
+
+
+def load_clustering_model(path, name, fingerprint=None):
+    """
+    Function that loads clustering model artifacts. Arrays are memory maps.
+
+    Parameters:
+        path (str): path to data.
+        name (str): catalogue name. Example: "red_wines".
+        fingerprint (str): data fingerprint. Latest model of the catalogue if None.
+
+    Returns:
+        model (dict): model composed by json metadata (columns, n_clusters, zones...) and
+        mean, scale and centroids arrays. None if there is no saved model.
+    """
+    if fingerprint is None:
+        latest_file = os.path.join(path, "models", name, "latest.json")
+        if not os.path.exists(latest_file):
+            return None
+        with open(latest_file, 'r') as json_file:
+            fingerprint = json.load(json_file)["fingerprint"]
+
+    folder = model_path(path, name, fingerprint)
+    if not os.path.exists(os.path.join(folder, "model.json")):
+        return None
+
+    with open(os.path.join(folder, "model.json"), 'r') as json_file:
+        model = json.load(json_file)
+    if model["version"] != model_version:
+        return None
+
+    model["mean"] = np.load(os.path.join(folder, "scaler_mean.npy"), mmap_mode='r')
+    model["scale"] = np.load(os.path.join(folder, "scaler_scale.npy"), mmap_mode='r')
+    model["centroids"] = np.load(os.path.join(folder, "centroids.npy"), mmap_mode='r')
+    return model
+
+
+def scale_wines(model, df):
+    """
+    Function that scales wines with the saved scaler parameters.
+
+    Parameters:
+        model (dict): clustering model.
+        df (dataframe): wines with clustering columns.
+
+    Returns:
+        X_scaled (np.array): scaled clustering columns.
+    """
+    return (df[model["columns"]].to_numpy(dtype=np.float64) - model["mean"]) / model["scale"]
+
+
+def assign_clusters(model, X_scaled):
+    """
+    Function that assigns scaled wines to their closest centroid (as KMeans predict).
+
+    Parameters:
+        model (dict): clustering model.
+        X_scaled (np.array): scaled clustering columns.
+
+    Returns:
+        clusters (np.array): cluster number of each wine.
+        sq_dist (np.array): squared distance of each wine to its centroid.
+    """
+    centroids = np.asarray(model["centroids"])
+    sq_dist = ((X_scaled ** 2).sum(axis=1)[:, None] - 2.0 * (X_scaled @ centroids.T)
+               + (centroids ** 2).sum(axis=1)[None, :])
+    clusters = sq_dist.argmin(axis=1)
+    return clusters.astype(np.int32), np.maximum(sq_dist[np.arange(len(clusters)), clusters], 0.0)
+
+
+def assign_zones(model, df):
+    """
+    Function that scales new wines and assigns them to a zone without refitting.
+
+    Parameters:
+        model (dict): clustering model.
+        df (dataframe): wines with clustering columns.
+
+    Returns:
+        X_scaled (np.array): scaled clustering columns.
+        clusters (np.array): cluster number of each wine.
+        zones (np.array): zone of each wine.
+    """
+    X_scaled = scale_wines(model, df)
+    clusters, _ = assign_clusters(model, X_scaled)
+    return X_scaled, clusters, np.asarray(model["zones"])[clusters]
@@ -1,14 +1,11 @@
 # wine profiling functions
 
 import os
+import json
+import tempfile
 import pandas as pd
-
-import matplotlib
-matplotlib.use('TkAgg')
-
-import matplotlib.pyplot as plt
+from modules import quantile_sketch_functions as qsf
 import numpy as np
-from math import pi
 
 # Complex descriptors relations
 complex_relation_dict = {"Body": ["alcohol", "density"],
@@ -38,26 +35,38 @@ descriptor_values = {"Sweetness":["Dry", "Semi-Dry", "Sweet"],
 # wine descriptors
 wine_descriptors = ["Sweetness","Nuance", "Tannicity", "Body", "Vibrancy"]
 
+# shared categorical type of each descriptor: int8 codes, code = position in descriptor_values
+descriptor_dtypes = {descriptor: pd.CategoricalDtype(values, ordered=True)
+                     for descriptor, values in descriptor_values.items()}
+
+# raw columns not used to create profiles
+no_used_cols = ["free sulfur dioxide","total sulfur dioxide","quality"]
+
+# row fingerprints of streamed files are spilled to this many (power of two) temporary files by their top bits,
+# so duplicates are found one bucket at a time
+fingerprint_buckets = 256
 
-def create_new_value(row, descriptor):
+# columns to categorize: individual descriptors first, then complex descriptors
+indiv_cols = ["residual sugar", "chlorides","sulphates"]
+tmp_cols = [f"{col}_tmp" for col in complex_relation_dict]
+
+
+def create_new_value(df, descriptor):
     """
     Function that is responsible to calculate complex descriptors new values.
     Example: body is composed by alcohol and density values. Each contributor has same weight 1/2.
-    Each contibutor have same weight. 
+    Values are computed as a weighted sum of contributor columns for all rows at once.
 
     Parameters:
-        row (pd.DataFrame row): row to calculate new value.
+        df (pd.DataFrame): data to calculate new values.
         descriptor (str): descriptor to find in the dictionary. 
 
     Returns:
-        value: return the corresponding calculated value for each row.
+        value (np.array): return the corresponding calculated value for each row.
     """    
     contributors = complex_relation_dict[descriptor] # get contributors columns
-    weight = 1.0 / len(contributors) # same weight to each contributor
-    value = 0.0 # initialize
-    for val in contributors:
-        value += row[val] * weight  # Access each value from the row
-    return value  # Return the computed value for this row
+    weights = np.full(len(contributors), 1.0 / len(contributors)) # same weight to each contributor
+    return df[contributors].to_numpy(dtype=np.float64) @ weights  # weighted column sum
 
 
 def plot_hist_with_percentiles (df, col, percent_min, percent_max):
@@ -90,24 +99,25 @@ def plot_hist_with_percentiles (df, col, percent_min, percent_max):
     
     return percentiles # return percentile values
 
-def classify_data(percentiles, col, terms):
+def classify_data(percentiles, values, terms):
     """
-    Function that categorized especified column by terms provided according to percentile values.
+    Function that categorized especified values by terms provided according to percentile values.
+    All values are binned in one vectorized step.
 
     Parameters:
         percentiles (list): percentile limits
-        col (str): column to apply categorization
-        terms (list): list of values to use to categorize the new value
+        values (array-like): values to apply categorization
+        terms (list or pd.CategoricalDtype): values (or categorical type) to use to categorize the new value
 
     Returns:
-       new categorization according to percentile values
+       new categorization according to percentile values (pd.Categorical):
+       first term if less or equal than minimum percentile, second term if less or equal than
+       maximum percentile and third term otherwise.
     """    
-    if col <= percentiles[0]: # less than minimum percentile value
-        return terms[0] # assign first term of the list
-    elif percentiles[0] < col <= percentiles[1]: # between both percentile values
-        return terms[1] # assign second term of the list
-    else: # greater than maximum percentile
-        return terms[2] # assign third term of the list
+    codes = np.searchsorted(percentiles, values, side="left").astype(np.int8) # 0, 1 or 2 per value
+    if isinstance(terms, pd.CategoricalDtype):
+        return pd.Categorical.from_codes(codes, dtype=terms)
+    return pd.Categorical.from_codes(codes, categories=terms, ordered=True)
     
 
 def categorize_data (df, col_list, percent_min, percent_max):
@@ -123,18 +133,58 @@ def categorize_data (df, col_list, percent_min, percent_max):
     Returns:
        new categorization according to percentile values
     """    
-    for col in col_list:    
-       # visulize hist and 10,90 percentiles 
-       percentiles =  plot_hist_with_percentiles (df, col, percent_min, percent_max) 
-       
-       # assign new categories according to percentiles   
-       range_terms = range_dict[col]
+    # visulize hist and 10,90 percentiles 
+    percentiles = {col: plot_hist_with_percentiles (df, col, percent_min, percent_max) for col in col_list}
+    return categorize_with_percentiles(df, percentiles)
+
+def categorize_with_percentiles (df, percentiles):
+    """
+    Function that categorized especified columns by terms according to already known percentile values.
+
+    Parameters:
+        df (pd.DataFrame): dataframe to apply the categorization.
+        percentiles (dict): min and max percentile values per column to categorize.
+
+    Returns:
+       new categorization according to percentile values
+    """    
+    for col, col_percentiles in percentiles.items():    
+       # assign new categories according to percentiles (shared descriptor categorical type)
        new_col = descriptor_dict[col]
-       df[new_col] = df[col].apply(lambda x: classify_data(percentiles, x, range_terms))    
+       df[new_col] = classify_data(col_percentiles, df[col].to_numpy(), descriptor_dtypes[new_col])
        #print("\n",df[new_col].value_counts())
        
     return df   
 
+def create_complex_descriptors (df):
+    """
+    Function that adds complex descriptors columns (temporal new values used to categorized).
+
+    Parameters:
+        df (pd.DataFrame): wine data.
+
+    Returns:
+       wine data with "_tmp" complex descriptors columns.
+    """    
+    for new_col in complex_relation_dict:
+        df[f"{new_col}_tmp"] = create_new_value(df, new_col)
+    return df
+
+def categorized_data_path (path):
+    """
+    Function that creates (if needed) the data folder next to the raw files folder.
+
+    Parameters:
+        path (str): path to raw data ("files" folder).
+
+    Returns:
+       new_data_path (str): path to data folder.
+    """    
+    data_path = path.rsplit('files', 1)[0]  # Get the part before 'files'
+    new_data_path = os.path.join(data_path, "data")  # Create new path to data folder
+    os.makedirs(new_data_path, exist_ok=True)
+    return new_data_path
+
 def wine_profiling(path, filename):
     """
     Function that creates wine profile
@@ -151,7 +201,6 @@ def wine_profiling(path, filename):
     df = pd.read_csv(os.path.join(path,filename),sep=";")
 
     # remove no used data
-    no_used_cols = ["free sulfur dioxide","total sulfur dioxide","quality"]
     df = df.drop(no_used_cols,axis = 1)
 
     # detect if exist duplicates & remove if any
@@ -160,31 +209,177 @@ def wine_profiling(path, filename):
         df = df.drop(duplicate_indices).reset_index(drop=True)
 
     # create complex descriptors (temporal new values used to categorized)
-    new_col = "Body"
-    df[f"{new_col}_tmp"] = df.apply(lambda row: create_new_value(row, new_col), axis=1)
-
-    new_col = "Vibrancy"
-    df[f"{new_col}_tmp"] = df.apply(lambda row: create_new_value(row, new_col), axis=1)
+    df = create_complex_descriptors(df)
 
     # categorize data
-    # select individual descriptors and categorize
-    indiv_cols = ["residual sugar", "chlorides","sulphates"]
-    df = categorize_data (df, indiv_cols, 10, 90)
-
-    # select complex descriptors columns  and categorize
-    tmp_cols = [col for col in df.columns if "tmp" in col]
-    df = categorize_data (df, tmp_cols, 10, 90)
+    # select individual descriptors and complex descriptors columns and categorize
+    percentiles = {col: plot_hist_with_percentiles (df, col, 10, 90) for col in indiv_cols + tmp_cols}
+    df = categorize_with_percentiles (df, percentiles)
 
-    # create folder to save data
-    data_path = path.rsplit('files', 1)[0]  # Get the part before 'files'
-    new_data_path = os.path.join(data_path, "data")  # Create new path to data folder
-    os.makedirs(new_data_path, exist_ok=True)
+    # create folder to save data & cut points (used to categorize new wines)
+    new_data_path = categorized_data_path(path)
+    save_cut_points(new_data_path, filename_root, percentiles)
 
     # save information in new data folder
     new_filename = f"{filename_root}_categorized.csv"
     df.to_csv(os.path.join(new_data_path, new_filename),index =False)
 
 
+def save_cut_points(path, filename_root, percentiles):
+    """
+    Function that saves the percentile cut points used to categorize a catalogue.
+
+    Parameters:
+        path (str): path to data folder.
+        filename_root (str): catalogue name. Example: "red_wines".
+        percentiles (dict): min and max percentile values per categorized column.
+    Returns:
+       NULL
+       saves "_cut_points.json" file.
+    """    
+    with open(os.path.join(path, f"{filename_root}_cut_points.json"), 'w') as json_file:
+        json.dump({col: [float(v) for v in values] for col, values in percentiles.items()}, json_file)
+
+def load_cut_points(path, filename_root):
+    """
+    Function that loads the percentile cut points used to categorize a catalogue.
+
+    Parameters:
+        path (str): path to data folder.
+        filename_root (str): catalogue name. Example: "red_wines".
+    Returns:
+       percentiles (dict): min and max percentile values per categorized column, in categorization order.
+    """    
+    with open(os.path.join(path, f"{filename_root}_cut_points.json"), 'r') as json_file:
+        return json.load(json_file)
+
+def duplicated_fingerprints(path, filename, chunksize):
+    """
+    Function that finds duplicated rows of a raw wine file reading it by chunks.
+    Each row is reduced to a 64 bit hash fingerprint, spilled to a temporary bucket file by its top
+    bits (copies of a row share bucket), and buckets are searched for duplicates one at a time.
+
+    Parameters:
+        path (str): path to data.
+        filename (str): raw wine filename.
+        chunksize (int): number of rows per chunk.
+
+    Returns:
+       np.array: sorted fingerprints of rows that appear more than once.
+    """    
+    shift = np.uint64(64 - int(np.log2(fingerprint_buckets)))
+    duplicated = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        bucket_files = [os.path.join(tmp_dir, f"bucket_{i}.bin") for i in range(fingerprint_buckets)]
+        for chunk in pd.read_csv(os.path.join(path, filename), sep=";", chunksize=chunksize):
+            chunk = chunk.drop(no_used_cols, axis=1)
+            fingerprints = np.sort(pd.util.hash_pandas_object(chunk, index=False).to_numpy())
+            bounds = np.searchsorted(fingerprints >> shift, np.arange(fingerprint_buckets + 1, dtype=np.uint64))
+            for bucket in np.nonzero(np.diff(bounds))[0]:
+                with open(bucket_files[bucket], 'ab') as bucket_file:
+                    fingerprints[bounds[bucket]:bounds[bucket + 1]].tofile(bucket_file)
+
+        # buckets are ordered by fingerprint top bits, so duplicates come out sorted
+        for bucket_file in bucket_files:
+            if os.path.exists(bucket_file):
+                hashes, counts = np.unique(np.fromfile(bucket_file, dtype=np.uint64), return_counts=True)
+                duplicated.append(hashes[counts > 1])
+    return np.concatenate(duplicated) if duplicated else np.empty(0, dtype=np.uint64)
+
+def read_profiling_chunks(path, filename, chunksize, duplicated):
+    """
+    Function that reads a raw wine file by chunks, removing no used columns and duplicated rows,
+    and adding complex descriptors.
+
+    Parameters:
+        path (str): path to data.
+        filename (str): raw wine filename.
+        chunksize (int): number of rows per chunk.
+        duplicated (np.array): fingerprints of duplicated rows.
+
+    Returns:
+       generator of prepared chunks.
+    """    
+    for chunk in pd.read_csv(os.path.join(path, filename), sep=";", chunksize=chunksize):
+        chunk = chunk.drop(no_used_cols, axis=1)
+
+        # all copies of duplicated rows are removed, as in wine_profiling
+        fingerprints = pd.util.hash_pandas_object(chunk, index=False).to_numpy()
+        chunk = chunk[~np.isin(fingerprints, duplicated)]
+
+        yield create_complex_descriptors(chunk.copy())
+
+def wine_profiling_streaming(path, filename, chunksize=100000, sketch_capacity=4096):
+    """
+    Function that creates wine profile reading data by chunks, for files larger than memory.
+    The file is read three times: rows fingerprints to find duplicates, approximate 10th and 90th
+    percentiles with mergeable quantile sketches and categorization, written chunk by chunk.
+    Peak memory depends on chunksize (and one fingerprint bucket, 8 bytes per row over
+    fingerprint_buckets), not on file size.
+
+    Parameters:
+        path (str): path to data.
+        filename (str): filename to use to create profiles.
+        chunksize (int): number of rows per chunk.
+        sketch_capacity (int): quantile sketch capacity per level. Higher capacity, lower error.
+    Returns:
+       NULL
+       saves new _categorized files with wine profiles.
+    """    
+    filename_root = filename.split(".")[0]
+    categorized_cols = indiv_cols + tmp_cols
+
+    # 1- find duplicated rows
+    duplicated = duplicated_fingerprints(path, filename, chunksize)
+
+    # 2- approximate percentiles per column
+    sketches = {col: qsf.create_quantile_sketch(sketch_capacity) for col in categorized_cols}
+    for chunk in read_profiling_chunks(path, filename, chunksize, duplicated):
+        for col in categorized_cols:
+            qsf.update_quantile_sketch(sketches[col], chunk[col].to_numpy())
+    percentiles = {col: qsf.sketch_quantiles(sketches[col], [0.10, 0.90]) for col in categorized_cols}
+
+    # 3- categorize and save information in new data folder incrementally
+    save_cut_points(categorized_data_path(path), filename_root, percentiles)
+    output_file = os.path.join(categorized_data_path(path), f"{filename_root}_categorized.csv")
+    header = True
+    for chunk in read_profiling_chunks(path, filename, chunksize, duplicated):
+        chunk = categorize_with_percentiles(chunk, percentiles)
+        chunk.to_csv(output_file, index=False, header=header, mode='w' if header else 'a')
+        header = False
+
+
+def read_categorized_data(file_path, **kwargs):
+    """
+    Function that reads a categorized wine file with descriptors as shared categorical types.
+    Floats are parsed exactly as written, so wines keep their fingerprint (see wine_ingest_functions).
+
+    Parameters:
+        file_path (str): categorized csv file path.
+        kwargs: other pd.read_csv parameters.
+
+    Returns:
+       df (pd.DataFrame): categorized wines.
+    """    
+    return pd.read_csv(file_path, dtype=descriptor_dtypes, float_precision="round_trip", **kwargs)
+
+def descriptor_codes(df, descriptors=None):
+    """
+    Function that returns wines descriptor positions (categorical codes, 0 to 2).
+    Descriptors not stored with the shared categorical type (e.g. previous catalogues saved as
+    strings) are encoded first.
+
+    Parameters:
+        df (pd.DataFrame): wines with descriptor columns.
+        descriptors (list(str)): descriptors to return. wine_descriptors if None.
+
+    Returns:
+       pd.DataFrame: int8 position per wine and descriptor.
+    """    
+    descriptors = wine_descriptors if descriptors is None else descriptors
+    return pd.DataFrame({descriptor: df[descriptor].astype(descriptor_dtypes[descriptor]).cat.codes
+                         for descriptor in descriptors}, index=df.index)
+
 def map_value_to_position(key, val):
     """
     Function that return the corresponding list position of the categorization
@@ -2,13 +2,62 @@
 import random
 import numpy as np
 import pandas as pd
-import os
+from modules import wine_search_functions as wsf
+from modules import wine_knn_graph_functions as wkg
+from modules import wine_catalogue_functions as wcat
+from modules import user_profile_view_functions as upv
 
-# wine catalogues 
-df_red = pd.read_parquet(os.path.join("../data", "red_wines_clustered.parquet"), engine ="pyarrow")
-df_white = pd.read_parquet(os.path.join("../data", "white_wines_clustered.parquet"), engine ="pyarrow")
+# number of closest zones to scan per query (None scans whole catalogue)
+search_nprobe = None
+
+# reference of recommendations: "favorite_zone" (a random wine of the favourite zone) or
+# "profile" (user's taste vector, built from all owned wines)
+recommendation_mode = "favorite_zone"
+
+# taste vector weighting: "mean" (every owned wine alike) or "zone" (wines weighted by their zone quantity)
+profile_weighting = "mean"
 
 # Functions
+def get_search_engine(wine_type):
+    """
+    Function that returns the nearest wine search engine of a catalogue (scaled features as a
+    contiguous matrix). It is built once per catalogue version.
+    
+    Parameters:
+        wine_type (str): "red" or "white".
+    Returns:
+        catalogue search engine.
+    """    
+    return wcat.get_derived(wine_type, "search_engine",
+                            lambda: wsf.build_search_engine(wcat.get_catalogue(wine_type, wsf.scaled_cols)))
+
+def get_ivf_index(wine_type):
+    """
+    Function that returns the zone IVF index of a catalogue, using its cluster table centroids.
+    It is built once per catalogue version.
+    
+    Parameters:
+        wine_type (str): "red" or "white".
+    Returns:
+        catalogue zone IVF index.
+    """    
+    return wcat.get_derived(wine_type, "ivf_index",
+                            lambda: wsf.build_ivf_index(get_search_engine(wine_type),
+                                                        wsf.catalogue_centroids(wcat.get_cluster_table(wine_type)),
+                                                        wcat.get_catalogue(wine_type, ["Cluster"])["Cluster"].to_numpy()))
+
+def get_knn_graph(wine_type):
+    """
+    Function that returns the precomputed knn graph of a catalogue. It is loaded once per catalogue version.
+    
+    Parameters:
+        wine_type (str): "red" or "white".
+    Returns:
+        knn graph or None if it has not been created by create_data_base.py.
+    """    
+    return wcat.get_derived(wine_type, "knn_graph",
+                            lambda: wkg.load_knn_graph(wcat.get_data_root(), wcat.catalogue_files[wine_type]))
+
 def determine_favorite_zone (zones):
     """
     Function that determines which wine zone is users favorite.
@@ -42,8 +91,139 @@ def select_wine_from_favorite_zone(zones, favorite_zone):
         for k, v in zone.items():
             if favorite_zone+"_rows" == k:
                 return (v[random.randint(0, len(v)-1)])
+
+def get_owned_wines(zones):
+    """
+    Function that lists all users wines of a wine type.
+    
+    Parameters:
+        zones : list of wines distributed by zone for user.
+    Returns:
+        list of catalogue indexes owned by the user.
+    """    
+    owned = []
+    for zone in zones:
+        for k, v in zone.items():
+            if "_rows" in k:
+                owned.extend(v)
+    return owned
             
 
+def user_profile_vector(engine, zones, weighting="mean"):
+    """
+    Function that computes a user's taste vector: average scaled features of all owned wines of a wine type.
+
+    Parameters:
+        engine (dict): catalogue search engine.
+        zones : list of wines distributed by zone for user.
+        weighting (str): "mean" (every wine alike) or "zone" (wines weighted by their zone quantity,
+            so the favourite zone weighs more).
+
+    Returns:
+        np.array: taste vector in scaled feature space. None if the user has no wines of this type.
+    """
+    owned = []
+    weights = []
+    for zone in zones:
+        for k, v in zone.items():
+            if "_rows" in k:
+                owned.extend(v)
+                weights.extend([len(v) if weighting == "zone" else 1] * len(v))
+    if len(owned) == 0:
+        return None
+    vectors = engine["matrix"][engine["labels"].get_indexer(owned)]
+    return np.asarray(weights, dtype=np.float64) @ vectors / np.sum(weights)
+
+def user_taste_vector(engine, user_data, wine_type, weighting="mean"):
+    """
+    Function that returns a user's taste vector of a wine type: the materialized profile mean scaled
+    features (user_profile_view_functions) while it is valid for the user record, computed from the
+    user's wines otherwise (stale or missing view, or zone weighting, which is not materialized).
+
+    Parameters:
+        engine (dict): catalogue search engine.
+        user_data : users wine preferences. User wine profile.
+        wine_type (str): "red" or "white".
+        weighting (str): "mean" or "zone" (see user_profile_vector).
+
+    Returns:
+        np.array: taste vector in scaled feature space. None if the user has no wines of this type.
+    """
+    if weighting == "mean":
+        profile = upv.get_user_profile(user_data).get(wine_type)
+        if profile is not None:
+            return profile[wsf.scaled_cols].to_numpy(dtype=np.float64)
+    return user_profile_vector(engine, user_data[f"{wine_type}_distribution"], weighting)
+
+def recommend_from_profile(wine_type, user_data, k=1, distance="euclidean", weighting=None):
+    """
+    Function that ranks the catalogue against a user's taste vector and returns the k nearest
+    wines the user does not own (one vectorized query, or the zone IVF index if search_nprobe is set).
+
+    Parameters:
+        wine_type (str): "red" or "white".
+        user_data : users wine preferences. User wine profile.
+        k (int): number of wines to recommend.
+        distance (str): distance to use. Euclidean, manhattan or cosine.
+        weighting (str): taste vector weighting, "mean" or "zone". profile_weighting if None.
+
+    Returns:
+        labels (np.array): catalogue indexes of the recommended wines, nearest first.
+        top_dist (np.array): corresponding distances to the taste vector.
+    """
+    engine = get_search_engine(wine_type)
+    vector = user_taste_vector(engine, user_data, wine_type, weighting or profile_weighting)
+    if vector is None:
+        return np.array([], dtype=np.int64), np.array([])
+
+    owned = get_owned_wines(user_data[f"{wine_type}_distribution"])
+    if search_nprobe is None:
+        labels, top_dist = wsf.query_top_k(engine, vector, k, distance, owned)
+    else:
+        labels, top_dist = wsf.ivf_search(get_ivf_index(wine_type), vector, k, distance, search_nprobe, owned)
+    return labels[0], top_dist[0]
+
+def closest_owned_wine(wine_type, user_data, distance="euclidean", weighting=None):
+    """
+    Function that selects the owned wine closest to the user's taste vector (the most representative
+    wine of the user's cellar), used as reference of profile recommendations.
+
+    Parameters:
+        wine_type (str): "red" or "white".
+        user_data : users wine preferences. User wine profile.
+        distance (str): distance to use. Euclidean, manhattan or cosine.
+        weighting (str): taste vector weighting, "mean" or "zone". profile_weighting if None.
+
+    Returns:
+        catalogue index of the owned wine closest to the taste vector.
+    """
+    engine = get_search_engine(wine_type)
+    vector = user_taste_vector(engine, user_data, wine_type, weighting or profile_weighting)
+    owned = np.asarray(get_owned_wines(user_data[f"{wine_type}_distribution"]))
+    dist = wsf.compute_distances(engine, vector, distance, engine["labels"].get_indexer(owned))
+    return owned[dist[0].argmin()]
+
+def recommend_top_k(user_data, k=5, distance="euclidean", weighting=None):
+    """
+    Function that recommends the k wines closest to the user's taste vector of each recommended
+    wine type (according to users distribution).
+
+    Parameters:
+        user_data : users wine preferences. User wine profile.
+        k (int): number of wines to recommend per wine type.
+        distance (str): distance to use. Euclidean, manhattan or cosine.
+        weighting (str): taste vector weighting, "mean" or "zone". profile_weighting if None.
+
+    Returns:
+        dict: wine type -> dataframe with recommended catalogue indexes ("wine") and distances, nearest first.
+    """
+    wine_types = {"equal": ["red", "white"], "more_white": ["white"]}.get(user_data["distribution"], ["red"])
+    recommendations = {}
+    for wine_type in wine_types:
+        labels, top_dist = recommend_from_profile(wine_type, user_data, k, distance, weighting)
+        recommendations[wine_type] = pd.DataFrame({"wine": labels, "distance": top_dist})
+    return recommendations
+
 def euclidean_distance(vec1, vec2):
     """
     Function that calculates euclidean distance of two centroids.
@@ -87,37 +267,69 @@ def cosine_similarity(vec1, vec2):
     norm_vec2 = np.linalg.norm(vec2)
     return dot_product / (norm_vec1 * norm_vec2)
 
-def get_nearest_wine(df, selected_row_idx , distance):
+def get_nearest_wine(df, selected_row_idx , distance, exclude_idx=None, engine=None, nprobe=None, graph=None,
+                     ivf_index=None):
     """
     Function that calculates the similarity of indicated wine.
+    Distances to all catalogue wines are computed in a single vectorized query over scaled features.
 
     Parameters:
         df (dataframe) : wine catalogue to select nearest wine.
         selected_row_idx (int) : wine row to used as reference.
-        distance (str): function to calculate distance. Euclidean, manhattan or cosine_similarity.
+        distance (str): function to calculate distance. Euclidean, manhattan or cosine.
+        exclude_idx (list): wine rows that can not be recommended (e.g. wines already owned by the user).
+        engine (dict): catalogue search engine. Built from df if None.
+        nprobe (int): number of closest zones to scan with the zone IVF index. Whole catalogue if None.
+        graph (dict): precomputed knn graph. Used when built with the same distance for this catalogue.
+        ivf_index (dict): zone IVF index used when nprobe is given. Built from catalogue cluster means if None.
 
     Returns:
-        selected wine and its rearest as a single dataframe
+        selected wine and its rearest as a single dataframe. ValueError if every catalogue wine is
+        excluded (no wine left to recommend).
     """    
     # choose reference row
     selected_row = df.loc[selected_row_idx]
-    cols = list(df.columns)
-    
-    # compute corresponding distance between selected row's centroind and all others
-    df1 = df.copy()
-    if distance == "euclidean":
-        df1['distance'] = df1['Centroid'].apply(lambda x: euclidean_distance(selected_row['Centroid'], x))
-    elif distance == "manhattan":
-        df1['distance'] = df1['Centroid'].apply(lambda x: manhattan_distance(selected_row['Centroid'], x))
+    excluded = [selected_row_idx] + list(exclude_idx or [])
+
+    # look up the precomputed graph first
+    nearest_idx = None
+    if graph is not None and graph["distance"] == distance and graph["n_wines"] == len(df):
+        nearest_idx = wkg.graph_nearest_wine(graph, df.index.get_loc(selected_row_idx), excluded)
+    if nearest_idx is not None:
+        return create_solution(df, selected_row, df.loc[nearest_idx])
+
+    if engine is None:
+        engine = wsf.build_search_engine(df)
+
+    # nearest wine excluding the selected row itself and excluded wines
+    query = engine["matrix"][engine["labels"].get_loc(selected_row_idx)]
+    if nprobe is None:
+        labels, _ = wsf.query_top_k(engine, query, 1, distance, excluded)
     else:
-        df1['distance'] = df1['Centroid'].apply(lambda x: cosine_similarity(selected_row['Centroid'], x))
-        
-    
-    # Find the row with the minimum distance (excluding the selected row itself)
-    nearest_row = df1[df1.index != selected_row.name].loc[df1['distance'].idxmin()]
-    
+        if ivf_index is None:
+            clusters = df["Cluster"].to_numpy()
+            ivf_index = wsf.build_ivf_index(engine, wsf.cluster_means(engine, clusters), clusters)
+        labels, _ = wsf.ivf_search(ivf_index, query, 1, distance, nprobe, excluded)
+    if len(labels[0]) == 0:
+        raise ValueError(f"No wine to recommend: all {len(df)} catalogue wines are excluded.")
+    nearest_row = df.loc[labels[0][0]]
+
+    return create_solution(df, selected_row, nearest_row)
+
+def create_solution(df, selected_row, nearest_row):
+    """
+    Function that visualizes selected wine and its nearest side by side.
+
+    Parameters:
+        df (dataframe) : wine catalogue.
+        selected_row (pd.Series) : reference wine.
+        nearest_row (pd.Series) : nearest wine.
+
+    Returns:
+        selected wine and its rearest as a single dataframe
+    """    
     # Convert the dictionaries to pandas Series
-    to_remove = ['distance',"Cluster","Centroid"]
+    to_remove = ["Cluster"]
     rest_of_columns = [cols for cols in df.columns if cols not in to_remove] # only interested columns
     
     selected_series = pd.Series([selected_row.name] + list(selected_row[rest_of_columns])) # add index as first element
@@ -131,12 +343,45 @@ def get_nearest_wine(df, selected_row_idx , distance):
     # return selected and nearest row
     return solution
 
-def recommend_wines (user_data):
+def recommend_wine_type (user_data, wine_type, distance="euclidean"):
+    """
+    Function that select reference wine of a wine type and obtain similar wine as recommendation.
+
+    Parameters:
+        user_data : users wine preferences. User wine profile.
+        wine_type (str): "red" or "white".
+        distance (str): distance to use. Euclidean, manhattan or cosine.
+
+    Returns: 
+        solution (dataframe) : Selected wine and recommended wine visualize side by side.
+    """    
+    zones = user_data[f"{wine_type}_distribution"]
+
+    # Profile mode: nearest unseen wine to the user's taste vector, compared with the most representative owned wine
+    if recommendation_mode == "profile":
+        df = wcat.get_catalogue(wine_type)
+        labels, _ = recommend_from_profile(wine_type, user_data, 1, distance)
+        if len(labels) == 0:
+            raise ValueError(f"No {wine_type} wine to recommend: user has no {wine_type} wines or owns every one.")
+        return create_solution(df, df.loc[closest_owned_wine(wine_type, user_data, distance)], df.loc[labels[0]])
+
+    # Determine reference wine
+    favorite = determine_favorite_zone(zones)
+    selected_idx = select_wine_from_favorite_zone(zones, favorite)
+
+    # Get nearest wine and get result in comparative way
+    return get_nearest_wine(wcat.get_catalogue(wine_type), selected_idx , distance,
+                            get_owned_wines(zones), get_search_engine(wine_type),
+                            search_nprobe, get_knn_graph(wine_type),
+                            get_ivf_index(wine_type) if search_nprobe is not None else None)
+
+def recommend_wines (user_data, distance="euclidean"):
     """
     Function that select reference wine and obtain similar wine as recommendation.
 
     Parameters:
         user_data : users wine preferences. User wine profile.
+        distance (str): distance to use. Euclidean, manhattan or cosine.
 
     Returns: 
         user_data["distribution"] (str): users distribution. Equal, More_white or More_red to determine if both
@@ -149,38 +394,14 @@ def recommend_wines (user_data):
     solution_white = None   
     
     if user_data["distribution"] == "equal":   # 2 recommendations one per each type
-                
-        # Determine red reference wine
-        red = determine_favorite_zone(user_data["red_distribution"])           
-        selected_red_idx = select_wine_from_favorite_zone (user_data["red_distribution"], red)
-        
-        # Get nearest red wine and get result in comparative way
-        solution_red = get_nearest_wine(df_red, selected_red_idx , "euclidean")
-               
-        # Determine white reference wine
-        white = determine_favorite_zone(user_data["white_distribution"])
-        selected_white_idx = select_wine_from_favorite_zone (user_data["white_distribution"], white)  
-        
-        # Get nearest white wine and get result in comparative way
-        solution_white = get_nearest_wine(df_white, selected_white_idx , "euclidean")
+        solution_red = recommend_wine_type(user_data, "red", distance)
+        solution_white = recommend_wine_type(user_data, "white", distance)
         
     elif user_data["distribution"] == "more_white":
-        
-        # Determine white reference wine
-        white = determine_favorite_zone(user_data["white_distribution"])
-        selected_white_idx = select_wine_from_favorite_zone (user_data["white_distribution"], white)
-        
-        # Get nearest white wine and get result in comparative way
-        solution_white = get_nearest_wine(df_white, selected_white_idx , "euclidean")
+        solution_white = recommend_wine_type(user_data, "white", distance)
                     
     else:
-        
-        # Determine red reference wine
-        red = determine_favorite_zone(user_data["red_distribution"])
-        selected_red_idx = select_wine_from_favorite_zone (user_data["red_distribution"], red)
-        
-        # Get nearest red wine and get result in comparative way
-        solution_red = get_nearest_wine(df_red, selected_red_idx , "euclidean")
+        solution_red = recommend_wine_type(user_data, "red", distance)
         
     return user_data["distribution"] , solution_red , solution_white
 
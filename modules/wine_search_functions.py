@@ -0,0 +1,288 @@
+# wine search functions
+import numpy as np
+import pandas as pd
+from modules import pairwise_distance_functions as pdk
+
+# scaled clustering columns used to compare wines
+scaled_cols = ['residual sugar_scaled', 'chlorides_scaled', 'sulphates_scaled',
+               'Body_tmp_scaled', 'Vibrancy_tmp_scaled']
+
+# available distances (cosine_similarity kept as cosine alias)
+distances = ["euclidean", "manhattan", "cosine", "cosine_similarity"]
+
+
+def build_matrix_engine(matrix, labels):
+    """
+    Function that builds a search engine from a float matrix.
+
+    Parameters:
+        matrix (np.array): vectors to search, one per row.
+        labels (pd.Index): reference of each matrix row.
+
+    Returns:
+        engine (dict): search engine composed by:
+            matrix: vectors as contiguous float matrix (one row per wine).
+            labels: reference of each matrix row.
+            sq_norms: squared norm of each matrix row.
+            norms: norm of each matrix row.
+    """
+    matrix = np.ascontiguousarray(matrix, dtype=np.float64)
+    sq_norms = np.einsum("ij,ij->i", matrix, matrix)
+
+    return {"matrix": matrix,
+            "labels": labels,
+            "sq_norms": sq_norms,
+            "norms": np.sqrt(sq_norms)}
+
+
+def build_search_engine(df):
+    """
+    Function that builds the nearest wine search engine of a wine catalogue.
+    Scaled columns are stored once as a contiguous float matrix, so each query is
+    answered without copying the catalogue.
+
+    Parameters:
+        df (dataframe): clustered wine catalogue.
+
+    Returns:
+        engine (dict): search engine (see build_matrix_engine), labels are catalogue indexes.
+    """
+    return build_matrix_engine(df[scaled_cols].to_numpy(dtype=np.float64), df.index)
+
+
+def compute_distances(engine, queries, distance, rows=None):
+    """
+    Function that computes the distance between query wines and catalogue wines in one call.
+
+    Parameters:
+        engine (dict): search engine created by build_search_engine.
+        queries (np.array): query vectors, one per row (n_queries x n_features).
+        distance (str): distance to use. Euclidean, manhattan or cosine.
+        rows (np.array): matrix positions to compare with. All catalogue if None.
+
+    Returns:
+        distances (np.array): n_queries x n_rows distances. Lower is more similar.
+    """
+    if distance not in distances:
+        raise ValueError(f"Unknown distance '{distance}'. Use one of {distances}.")
+
+    queries = np.atleast_2d(np.asarray(queries, dtype=np.float64))
+    if rows is None:
+        return pdk.block_distances(queries, engine["matrix"], distance, engine["sq_norms"], engine["norms"])
+    return pdk.block_distances(queries, engine["matrix"][rows], distance, engine["sq_norms"][rows],
+                               engine["norms"][rows])
+
+
+def select_top_k(dist, k):
+    """
+    Function that selects the k lowest distances of each query row without a full sort.
+
+    Parameters:
+        dist (np.array): n_queries x n_rows distances.
+        k (int): number of neighbours to keep.
+
+    Returns:
+        positions (np.array): n_queries x k column positions ordered by distance.
+        top_dist (np.array): n_queries x k corresponding distances.
+    """
+    k = min(k, dist.shape[1])
+    if k < dist.shape[1]:
+        positions = np.argpartition(dist, k - 1, axis=1)[:, :k]
+    else:
+        positions = np.broadcast_to(np.arange(k), (len(dist), k))
+    top_dist = np.take_along_axis(dist, positions, axis=1)
+
+    # order selected neighbours by distance
+    order = np.argsort(top_dist, axis=1, kind="stable")
+    return np.take_along_axis(positions, order, axis=1), np.take_along_axis(top_dist, order, axis=1)
+
+
+def query_top_k(engine, queries, k=1, distance="euclidean", exclude=None):
+    """
+    Function that obtains the k nearest wines of each query vector.
+
+    Parameters:
+        engine (dict): search engine created by build_search_engine.
+        queries (np.array): query vectors, one per row.
+        k (int): number of nearest wines to return.
+        distance (str): distance to use. Euclidean, manhattan or cosine.
+        exclude (list): catalogue indexes that can not be returned (e.g. users' wines).
+
+    Returns:
+        labels (np.array): n_queries x k catalogue indexes of the nearest wines.
+        top_dist (np.array): n_queries x k corresponding distances.
+    """
+    dist = compute_distances(engine, queries, distance)
+
+    # excluded wines are never selected
+    if exclude is not None and len(exclude) > 0:
+        excluded_pos = engine["labels"].get_indexer(list(exclude))
+        dist[:, excluded_pos[excluded_pos >= 0]] = np.inf
+
+    positions, top_dist = select_top_k(dist, k)
+
+    # drop excluded positions if k is greater than available wines
+    available = np.isfinite(top_dist).all(axis=0)
+    positions, top_dist = positions[:, available], top_dist[:, available]
+
+    return engine["labels"].to_numpy()[positions], top_dist
+
+
+def catalogue_centroids(cluster_table):
+    """
+    Function that obtains each cluster centroid from a catalogue cluster table.
+
+    Parameters:
+        cluster_table (dataframe): cluster table saved next to the clustered catalogue.
+
+    Returns:
+        centroids (np.array): n_clusters x n_features centroids ordered by cluster number.
+    """
+    return cluster_table.sort_values("Cluster")[scaled_cols].to_numpy(dtype=np.float64)
+
+
+def cluster_means(engine, clusters):
+    """
+    Function that computes each cluster mean vector. KMeans centroids are the means of their
+    clusters, so it is used when the cluster table is not available.
+
+    Parameters:
+        engine (dict): catalogue search engine.
+        clusters (np.array): cluster number of each catalogue wine.
+
+    Returns:
+        centroids (np.array): n_clusters x n_features means ordered by cluster number.
+    """
+    clusters = np.asarray(clusters)
+    n_clusters = clusters.max() + 1
+    sums = np.zeros((n_clusters, engine["matrix"].shape[1]))
+    np.add.at(sums, clusters, engine["matrix"])
+    return sums / np.bincount(clusters, minlength=n_clusters)[:, None]
+
+
+def build_ivf_index(engine, centroids, clusters):
+    """
+    Function that builds a zone based inverted file (IVF) index.
+    KMeans centroids are used as coarse quantizer and wines are grouped by cluster,
+    so a query only scans the wines of its closest zones.
+
+    Parameters:
+        engine (dict): catalogue search engine created by build_search_engine.
+        centroids (np.array): KMeans cluster centers (kmeans.cluster_centers_).
+        clusters (np.array): cluster number of each catalogue wine (Cluster column).
+
+    Returns:
+        index (dict): IVF index composed by:
+            engine: catalogue search engine.
+            quantizer: centroids search engine.
+            order: matrix positions grouped by cluster.
+            offsets: start and end of each cluster inside order.
+            recall: estimated recall per (k, distance, nprobe).
+    """
+    clusters = np.asarray(clusters)
+    order = np.argsort(clusters, kind="stable")
+    offsets = np.searchsorted(clusters[order], np.arange(len(centroids) + 1))
+
+    return {"engine": engine,
+            "quantizer": build_matrix_engine(centroids, pd.RangeIndex(len(centroids))),
+            "order": order,
+            "offsets": offsets,
+            "recall": {}}
+
+
+def ivf_search(index, queries, k=1, distance="euclidean", nprobe=1, exclude=None):
+    """
+    Function that obtains the approximate k nearest wines probing only the nprobe closest zones.
+
+    Parameters:
+        index (dict): IVF index created by build_ivf_index.
+        queries (np.array): query vectors, one per row.
+        k (int): number of nearest wines to return.
+        distance (str): distance to use. Euclidean, manhattan or cosine.
+        nprobe (int): number of closest zones to scan.
+        exclude (list): catalogue indexes that can not be returned (e.g. users' wines).
+
+    Returns:
+        labels (list(np.array)): catalogue indexes of the nearest wines of each query.
+        top_dist (list(np.array)): corresponding distances of each query.
+    """
+    engine = index["engine"]
+    queries = np.atleast_2d(np.asarray(queries, dtype=np.float64))
+    nprobe = min(nprobe, len(index["offsets"]) - 1)
+
+    # closest zones of each query
+    zone_dist = compute_distances(index["quantizer"], queries, distance)
+    probes, _ = select_top_k(zone_dist, nprobe)
+
+    # excluded matrix positions
+    excluded_pos = np.array([], dtype=np.intp)
+    if exclude is not None and len(exclude) > 0:
+        excluded_pos = engine["labels"].get_indexer(list(exclude))
+
+    labels = []
+    top_dist = []
+    for query, probe in zip(queries, probes):
+        # scan only the wines of the probed zones
+        rows = np.concatenate([index["order"][index["offsets"][z]:index["offsets"][z + 1]] for z in probe])
+        rows = rows[~np.isin(rows, excluded_pos)]
+        dist = compute_distances(engine, query, distance, rows)
+        positions, dist = select_top_k(dist, k)
+        labels.append(engine["labels"].to_numpy()[rows[positions[0]]])
+        top_dist.append(dist[0])
+
+    return labels, top_dist
+
+
+def estimate_ivf_recall(index, k=1, distance="euclidean", nprobe=1, n_samples=200, seed=0):
+    """
+    Function that estimates IVF recall comparing approximate and exact neighbours of sampled catalogue wines.
+    Estimation is saved in the index, so it is computed once per (k, distance, nprobe).
+
+    Parameters:
+        index (dict): IVF index created by build_ivf_index.
+        k (int): number of nearest wines.
+        distance (str): distance to use. Euclidean, manhattan or cosine.
+        nprobe (int): number of closest zones to scan.
+        n_samples (int): number of catalogue wines used as queries.
+        seed (int): random seed to select sampled wines.
+
+    Returns:
+        recall (float): average fraction of exact k nearest wines found by the IVF search.
+    """
+    key = (k, distance, nprobe)
+    if key not in index["recall"]:
+        engine = index["engine"]
+        rng = np.random.default_rng(seed)
+        sample = rng.choice(len(engine["matrix"]), min(n_samples, len(engine["matrix"])), replace=False)
+
+        hits = 0
+        for pos in sample:
+            query = engine["matrix"][pos]
+            own = [engine["labels"][pos]] # a wine is not its own neighbour
+            exact, _ = query_top_k(engine, query, k, distance, own)
+            approx, _ = ivf_search(index, query, k, distance, nprobe, own)
+            hits += len(np.intersect1d(exact[0], approx[0]))
+        index["recall"][key] = hits / float(len(sample) * k)
+
+    return index["recall"][key]
+
+
+def ivf_query_top_k(index, queries, k=1, distance="euclidean", nprobe=1, exclude=None):
+    """
+    Function that obtains the approximate k nearest wines and the estimated recall of the search.
+
+    Parameters:
+        index (dict): IVF index created by build_ivf_index.
+        queries (np.array): query vectors, one per row.
+        k (int): number of nearest wines to return.
+        distance (str): distance to use. Euclidean, manhattan or cosine.
+        nprobe (int): number of closest zones to scan.
+        exclude (list): catalogue indexes that can not be returned (e.g. users' wines).
+
+    Returns:
+        labels (list(np.array)): catalogue indexes of the nearest wines of each query.
+        top_dist (list(np.array)): corresponding distances of each query.
+        recall (float): estimated recall of the search for this k, distance and nprobe.
+    """
+    labels, top_dist = ivf_search(index, queries, k, distance, nprobe, exclude)
+    return labels, top_dist, estimate_ivf_recall(index, k, distance, nprobe)
@@ -0,0 +1,42 @@
+import os
+import sys
+import time
+
+# Add the parent directory (where modules is located) to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules import user_store_functions as usf
+from modules import batch_recommendation_functions as brf
+from modules import wine_catalogue_functions as wcat
+
+# Distance used to find recommended wines: euclidean, manhattan or cosine
+DISTANCE = "euclidean"
+
+# Reference wines selection seed (same seed, same recommendations). Random run if None
+SEED = None
+
+# Recommendation reference: "favorite_zone" (a random wine of the favourite zone, one wine per type)
+# or "profile" (TOP_K wines closest to each user's taste vector, built from all owned wines)
+MODE = "favorite_zone"
+TOP_K = 5
+
+# Taste vector weighting: "mean" (every owned wine alike) or "zone" (wines weighted by their zone quantity)
+PROFILE_WEIGHTING = "mean"
+
+# PRECOMPUTE RECOMMENDATIONS FOR ALL USERS (e.g. nightly job)
+if __name__ == "__main__":
+    wcat.set_data_root("../data")
+    start = time.perf_counter()
+
+    print("LOADING USERS AND COMPUTING RECOMMENDATIONS")
+    user_store = usf.connect_user_store("../data")
+    if MODE == "profile":
+        recommendations = brf.recommend_all_users_by_profile(user_store, TOP_K, DISTANCE, PROFILE_WEIGHTING)
+        output_file = brf.save_recommendations("../data", recommendations, brf.profile_recommendations_file)
+    else:
+        recommendations = brf.recommend_all_users(user_store, DISTANCE, SEED)
+        output_file = brf.save_recommendations("../data", recommendations)
+    user_store.close()
+
+    print(f"{recommendations['user_key'].nunique()} USERS, {len(recommendations)} RECOMMENDATIONS "
+          f"IN {time.perf_counter() - start:.1f}s. Saved in {output_file}")
@@ -0,0 +1,34 @@
+import os
+import sys
+import pandas as pd
+
+# Add the parent directory (where modules is located) to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules import collaborative_filtering_functions as cff
+from modules import wine_catalogue_functions as wcat
+
+# Simulated users per run
+USER_COUNTS = [10_000, 100_000, 1_000_000]
+
+# Wines recommended per user and wine type
+TOP_K = 5
+
+# Similar users considered per user
+N_NEIGHBOURS = 20
+
+# Worker processes (None: number of cores)
+N_WORKERS = None
+
+# Owners per wine each user is compared with (approximate neighbourhoods). All owners if None
+cff.sampled_owners_per_wine = 64
+
+# MEASURE COLLABORATIVE ENGINE BUILD TIME AND MEMORY (catalogues created by create_data_base.py)
+if __name__ == "__main__":
+    wcat.set_data_root("../data")
+    results = []
+    for n_users in USER_COUNTS:
+        print(f"BENCHMARKING {n_users} USERS")
+        results.append(cff.benchmark_collaborative(n_users, TOP_K, N_NEIGHBOURS, N_WORKERS))
+        print(results[-1])
+    print(pd.DataFrame(results).to_string(index=False))
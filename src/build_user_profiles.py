@@ -0,0 +1,19 @@
+import os
+import sys
+import time
+
+# Add the parent directory (where modules is located) to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules import user_profile_view_functions as upv
+from modules import wine_catalogue_functions as wcat
+
+# MATERIALIZE USERS' TASTE PROFILES (after the user store or the catalogues change)
+if __name__ == "__main__":
+    wcat.set_data_root("../data")
+    start = time.perf_counter()
+
+    print("MATERIALIZING USER PROFILES")
+    profiles = upv.materialize_user_profiles("../data")
+    print(f"{profiles['user_key'].nunique()} USERS, {len(profiles)} PROFILES "
+          f"IN {time.perf_counter() - start:.1f}s. Saved in {os.path.join('../data', upv.profile_view_file)}")
@@ -0,0 +1,35 @@
+import os
+import sys
+import time
+
+# Add the parent directory (where modules is located) to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules import bulk_report_functions as bkf
+
+# Distance used to find recommended wines: euclidean, manhattan or cosine
+DISTANCE = "euclidean"
+
+# Worker processes (None: number of cores)
+N_WORKERS = None
+
+# Folder where reports are saved
+OUTPUT_DIR = "../report"
+
+# Zip file where reports are packed instead (None: keep them in OUTPUT_DIR)
+ARCHIVE_FILE = None
+
+# Users to report (None: every user of the user store)
+USER_IDS = None
+
+# Recommendations computed before (main.py, server.py) are reused
+CACHE_DIR = "../data/recommendation_cache"
+
+# CREATE RECOMMENDATION REPORTS FOR MANY USERS (e.g. monthly mailing)
+if __name__ == "__main__":
+    start = time.perf_counter()
+    print("CREATING RECOMMENDATION REPORTS")
+    reports = bkf.create_bulk_reports("../data", USER_IDS, OUTPUT_DIR, ARCHIVE_FILE,
+                                      DISTANCE, N_WORKERS, CACHE_DIR)
+    print(bkf.report_timing_summary(reports))
+    print(f"DONE IN {time.perf_counter() - start:.1f}s. Reports in {ARCHIVE_FILE or OUTPUT_DIR}")
@@ -0,0 +1,36 @@
+import os
+import sys
+import time
+
+# Add the parent directory (where modules is located) to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules import user_store_functions as usf
+from modules import collaborative_filtering_functions as cff
+from modules import wine_catalogue_functions as wcat
+
+# Wines recommended per user and wine type
+TOP_K = 5
+
+# Similar users considered per user
+N_NEIGHBOURS = 20
+
+# Worker processes (None: number of cores)
+N_WORKERS = None
+
+# Owners per wine each user is compared with (approximate neighbourhoods). All owners if None
+cff.sampled_owners_per_wine = None
+
+# RECOMMEND EVERY USER THE WINES OF THE USERS WITH THE MOST SIMILAR CELLARS (e.g. nightly job)
+if __name__ == "__main__":
+    wcat.set_data_root("../data")
+    start = time.perf_counter()
+
+    print("BUILDING USER x WINE MATRIX AND USER NEIGHBOURHOODS")
+    user_store = usf.connect_user_store("../data")
+    recommendations, neighbours = cff.recommend_all_users_collaborative(user_store, TOP_K, N_NEIGHBOURS, N_WORKERS)
+    user_store.close()
+
+    output_file = cff.save_collaborative("../data", recommendations, neighbours)
+    print(f"{recommendations['user_key'].nunique()} USERS, {len(recommendations)} RECOMMENDATIONS "
+          f"IN {time.perf_counter() - start:.1f}s. Saved in {output_file}")
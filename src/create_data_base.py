@@ -8,45 +8,81 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from modules import wine_profile_functions as wpf
 from modules import wine_clustering_functions as wcf
 from modules import user_wine_distribution_functions as uwdf
+from modules import wine_knn_graph_functions as wkg
+from modules import user_store_functions as usf
+from modules import user_profile_view_functions as upv
+from modules import wine_catalogue_functions as wcat
 
-# Check if the output directory exists
-if os.path.exists("../files"):
-    # 1- CREATE WINE PROFILES & SAVE    
-    print("CREATING WINE PROFILES")     
-    # Create wine profiles for red and white wines
-    wpf.wine_profiling("../files", "red_wines.csv")  # red wines
-    wpf.wine_profiling("../files", "white_wines.csv")  # white wines
-
-# Check if the data directory exists before proceeding to classification
-if os.path.exists("../data"):
-    # 2- CLASSIFY WINES
-    # Check for categorized files
-    categorized_red_wines = os.path.join("../data", "red_wines_categorized.csv")
-    categorized_white_wines = os.path.join("../data", "white_wines_categorized.csv")
+# Raw files larger than this size (bytes) are profiled by chunks
+STREAMING_PROFILING_BYTES = 512 * 1024 ** 2
+
+# Best cluster number selection: "nbclust" (R NbClust) or "native" (python indices in a process pool)
+K_SELECTION_METHOD = "nbclust"
+
+# Number of neighbours of the precomputed wine knn graphs (0 to skip this stage)
+KNN_NEIGHBOURS = 10
+
+# Users simulation seed (same seed, same users and wine distribution). Random run if None
+SIMULATION_SEED = None
+
+# Guarded so that process pool workers can import this script safely
+if __name__ == "__main__":
+    # Check if the output directory exists
+    if os.path.exists("../files"):
+        # 1- CREATE WINE PROFILES & SAVE    
+        print("CREATING WINE PROFILES")     
+        # Create wine profiles for red and white wines (files larger than STREAMING_PROFILING_BYTES by chunks)
+        for filename in ["red_wines.csv", "white_wines.csv"]:
+            if os.path.getsize(os.path.join("../files", filename)) > STREAMING_PROFILING_BYTES:
+                wpf.wine_profiling_streaming("../files", filename)
+            else:
+                wpf.wine_profiling("../files", filename)
+
+    # Check if the data directory exists before proceeding to classification
+    if os.path.exists("../data"):
+        # 2- CLASSIFY WINES
+        # Check for categorized files
+        categorized_red_wines = os.path.join("../data", "red_wines_categorized.csv")
+        categorized_white_wines = os.path.join("../data", "white_wines_categorized.csv")
     
-    # Proceed only if both categorized files exist
-    if os.path.exists(categorized_red_wines) and os.path.exists(categorized_white_wines):
-        # Wine Clustering
-        print("CLASSIFYING RED WINES")
-        red, centroids_red = wcf.apply_clustering("../data", "red_wines_categorized.csv")
-
-        print("CLASSIFYING WHITE WINES")
-        white, centroids_white = wcf.apply_clustering("../data", "white_wines_categorized.csv")
-
-        # Check for clustered data files
-        red_clustered_file = os.path.join("../data", "red_wines_clustered.parquet")
-        white_clustered_file = os.path.join("../data", "white_wines_clustered.parquet")
-
-        # Ensure clustered files exist before proceeding
-        if os.path.exists(red_clustered_file) and os.path.exists(white_clustered_file):
-            # 3- CREATE USERS AND DISTRIBUTE WINES
-            print("CREATING USERS AND CONFIGURING USERS' WINE DISTRIBUTION")
-            user_list = uwdf.wine_delibery_conf("../data", "red_wines_clustered.parquet", "white_wines_clustered.parquet")
+        # Proceed only if both categorized files exist
+        if os.path.exists(categorized_red_wines) and os.path.exists(categorized_white_wines):
+            # Wine Clustering
+            print("CLASSIFYING RED WINES")
+            red, centroids_red = wcf.apply_clustering("../data", "red_wines_categorized.csv", K_SELECTION_METHOD)
+
+            print("CLASSIFYING WHITE WINES")
+            white, centroids_white = wcf.apply_clustering("../data", "white_wines_categorized.csv", K_SELECTION_METHOD)
+
+            # Check for clustered data files
+            red_clustered_file = os.path.join("../data", "red_wines_clustered.parquet")
+            white_clustered_file = os.path.join("../data", "white_wines_clustered.parquet")
+
+            # Ensure clustered files exist before proceeding
+            if os.path.exists(red_clustered_file) and os.path.exists(white_clustered_file):
+                # Optional: precompute each wine nearest wines
+                if KNN_NEIGHBOURS > 0:
+                    print("BUILDING WINE NEIGHBOUR GRAPHS")
+                    wkg.create_knn_graph("../data", "red_wines_clustered.parquet", KNN_NEIGHBOURS)
+                    wkg.create_knn_graph("../data", "white_wines_clustered.parquet", KNN_NEIGHBOURS)
+
+                # 3- CREATE USERS AND DISTRIBUTE WINES
+                print("CREATING USERS AND CONFIGURING USERS' WINE DISTRIBUTION")
+                simulation = uwdf.wine_delibery_simulation("../data", "red_wines_clustered.parquet",
+                                                           "white_wines_clustered.parquet", seed=SIMULATION_SEED)
        
-            # Save users data as JSON
-            if user_list:  # Check if user_list is not empty
-                uwdf.save_dict_list_json("../data", user_list)
-            else:
-                print("No users found for distribution configuration.")
+                # Save users data in the user store
+                if len(simulation["users"]) > 0:
+                    user_store = usf.connect_user_store("../data")
+                    usf.clear_user_store(user_store)
+                    usf.put_simulation(user_store, simulation)
+                    user_store.close()
+
+                    # 4- MATERIALIZE USERS' TASTE PROFILES (read by reports)
+                    print("MATERIALIZING USER PROFILES")
+                    wcat.set_data_root("../data")
+                    upv.materialize_user_profiles("../data")
+                else:
+                    print("No users found for distribution configuration.")
 
-print("SYSTEM DATABASE CORRECTLY CREATED.")
+    print("SYSTEM DATABASE CORRECTLY CREATED.")
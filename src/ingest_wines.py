@@ -0,0 +1,48 @@
+import os
+import pandas as pd
+import sys
+
+# Add the parent directory (where modules is located) to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules import wine_ingest_functions as wif
+from modules import user_profile_view_functions as upv
+from modules import wine_catalogue_functions as wcat
+from modules import user_store_functions as usf
+
+# Best cluster number selection if the catalogue is re-clustered: "nbclust" (R NbClust) or "native"
+# (python indices in a process pool). Method the catalogue model was fitted with if None
+K_SELECTION_METHOD = None
+
+# Usage: python ingest_wines.py <red|white> <new wines csv (same format as files/red_wines.csv)>
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] not in ["red", "white"]:
+        print("Usage: python ingest_wines.py <red|white> <new_wines.csv>")
+        sys.exit(1)
+
+    wine_type, new_wines_file = sys.argv[1], sys.argv[2]
+    new_wines = pd.read_csv(new_wines_file, sep=";")
+
+    print(f"INGESTING {len(new_wines)} {wine_type.upper()} WINES")
+    summary = wif.ingest_wines("../data", f"{wine_type}_wines", new_wines, k_method=K_SELECTION_METHOD)
+
+    if summary["n_wines"] == 0:
+        print("No new wines found (already in the catalogue).")
+    elif summary["reclustered"]:
+        print(f"{summary['n_wines']} WINES INGESTED. CATALOGUE RE-CLUSTERED (DRIFT {summary['drift']:.2f}).")
+    else:
+        print(f"{summary['n_wines']} WINES INGESTED (DRIFT {summary['drift']:.2f}).")
+
+    wcat.set_data_root("../data")
+
+    # Zones change when the catalogue is re-clustered: users' wines are moved to their new zones
+    if summary["reclustered"] and os.path.exists(os.path.join("../data", usf.store_file)):
+        print("MOVING USERS' WINES TO THE NEW ZONES")
+        user_store = usf.connect_user_store("../data")
+        usf.remap_user_zones(user_store, wine_type, wcat.get_catalogue(wine_type, ["Zone"])["Zone"])
+        user_store.close()
+
+    # Materialized user profiles are only valid for the catalogues they were built with
+    if summary["n_wines"] > 0 and os.path.exists(os.path.join("../data", upv.profile_view_file)):
+        print("MATERIALIZING USER PROFILES")
+        upv.materialize_user_profiles("../data")
@@ -7,24 +7,46 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from modules import user_profile_functions as upf
 from modules import wine_recommendation_functions as wrf
+from modules import user_store_functions as usf
+from modules import recommendation_cache_functions as rcf
+
+# Distance used to find recommended wines: euclidean, manhattan or cosine
+DISTANCE = "euclidean"
+
+# Reference of recommendations: "favorite_zone" (a random wine of the favourite zone) or
+# "profile" (wine closest to the user's taste vector, built from all owned wines)
+wrf.recommendation_mode = "favorite_zone"
+
+# Recommendations and reports are reused while the user and the catalogues do not change
+rcf.cache_dir = "../data/recommendation_cache"
 
 # RECOMMEND WINES BASED ON USERS PROFILE
 print("Please specify who you are from the list below:\n")
-user_list = upf.get_user_list("../data", "users_wine_delivery_conf.json")
-print(' | '.join(f"User: '{x}'" for x in upf.get_users_references(user_list)))
+user_store = usf.open_user_store("../data")
+print(' | '.join(f"User: '{x}'" for x in usf.list_users(user_store)))
 user_id = input("You are? ")
 print(f"\nHello '{user_id}'!")
 print("Based on your wine profile, I will provide you new wine recommendations. Please hold on a moment... \n")
 
 # Get users data
-user_data, user_red_cat, user_white_cat =  upf.get_specific_user_info (user_list, user_id)
-  
-# Get recommendation data
-distribution, solution_red, solution_white = wrf.recommend_wines(user_data)
-recommendation_text = wrf.create_recommendation_text (distribution, solution_red, solution_white)
-
-# Complete recommendation pdf
-output_file = upf.create_recomendation_pdf(user_data, user_red_cat, user_white_cat , user_id, 
-                                           solution_red, solution_white, recommendation_text)
+user_data = usf.get_user(user_store, user_id)
+if user_data is None:
+    print(f"User '{user_id}' not found.")
+    sys.exit(1)
+
+# Get recommendation data (cached while user and catalogues do not change)
+recommendation = rcf.get_recommendation(user_data, DISTANCE)
+output_file = recommendation["report"]
+
+if output_file is None or not os.path.exists(output_file):
+    distribution, solution_red, solution_white = recommendation["recommendation"]
+    recommendation_text = wrf.create_recommendation_text (distribution, solution_red, solution_white)
+
+    # Complete recommendation pdf
+    user_red_cat, user_white_cat = upf.get_user_catalogues(user_data)
+    output_file = upf.create_recomendation_pdf(user_data, user_red_cat, user_white_cat , user_id, 
+                                               solution_red, solution_white, recommendation_text,
+                                               report_key=rcf.recommendation_key(user_data, DISTANCE))
+    rcf.set_report(user_data, DISTANCE, output_file)
 
 print(f"Recomendation file create. Please check in {output_file}")
\ No newline at end of file
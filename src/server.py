@@ -0,0 +1,32 @@
+import os
+import sys
+import asyncio
+
+# Add the parent directory (where modules is located) to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules import recommendation_service_functions as rsf
+from modules import recommendation_cache_functions as rcf
+
+# Service address (localhost only)
+HOST = "127.0.0.1"
+PORT = 8080
+
+# Worker threads for recommendations and reports (None: number of cores)
+N_WORKERS = None
+
+# Computations queued or running at the same time before answering 503
+MAX_PENDING_REQUESTS = 64
+
+# Recommendations and reports are reused while the user and the catalogues do not change
+rcf.cache_dir = "../data/recommendation_cache"
+
+# RECOMMENDATION SERVICE
+# GET /recommend?user=<id>[&distance=euclidean]  -> recommendation as json
+# GET /report?user=<id>[&distance=euclidean]     -> recommendation pdf path
+# GET /health
+if __name__ == "__main__":
+    try:
+        asyncio.run(rsf.serve("../data", HOST, PORT, N_WORKERS, MAX_PENDING_REQUESTS))
+    except KeyboardInterrupt:
+        print("RECOMMENDATION SERVICE STOPPED")